@@ -1,6 +1,42 @@
+import base64
+
+import contextvars
+
+import csv
+
+import gzip
+
+import io
+
+import json
+
+import logging
+
+import math
+
 import os
 
-from flask import Flask, jsonify, request
+import random
+
+import sqlite3
+
+import tempfile
+
+import threading
+
+import time
+
+import uuid
+
+from collections import OrderedDict, deque
+
+from contextlib import contextmanager
+
+import click
+
+import jwt
+
+from flask import Flask, Response, g, jsonify, request, stream_with_context
 
 from flask_cors import CORS
 
@@ -8,12 +44,34 @@ from dotenv import load_dotenv
 
 from supabase import create_client, Client
 
-from datetime import datetime, timedelta
+from prometheus_client import REGISTRY, CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+
+from postgrest.exceptions import APIError
+
+from pytz import timezone
+
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+
+from bisect import bisect_left, insort
+
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
 
 from functools import wraps
 
 from werkzeug.middleware.proxy_fix import ProxyFix
 
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # opcional: sem ele fica o provider JSON padrão do Flask
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # opcional: sem ele só gzip é oferecido
+    brotli = None
+
 # Carrega variáveis de ambiente
 
 load_dotenv()
@@ -24,6 +82,86 @@ SUPABASE_KEY = os.getenv("SUPABASE_KEY", "").strip()
 
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY", "").strip()
 
+# Verificação local do JWT: segredo HS256 (legado) ou JWKS do projeto
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET", "").strip()
+
+SUPABASE_JWKS_URL = os.getenv("SUPABASE_JWKS_URL", f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json").strip()
+
+AUTH_LOCAL_JWT = os.getenv("AUTH_LOCAL_JWT", "1") == "1"
+
+AUTH_REMOTE_FALLBACK = os.getenv("AUTH_REMOTE_FALLBACK", "1") == "1"
+
+AUTH_EXPIRY_MARGIN_SECONDS = int(os.getenv("AUTH_EXPIRY_MARGIN_SECONDS", "30"))
+
+PROFILE_CACHE_TTL = int(os.getenv("PROFILE_CACHE_TTL", "300"))
+
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+
+# Alterações feitas pela API valem em todos os workers na hora (ver invalidate_business_settings);
+# as gravadas direto no Supabase (ex.: pelo frontend) só depois deste TTL
+BUSINESS_SETTINGS_TTL = int(os.getenv("BUSINESS_SETTINGS_TTL", "300"))
+
+BUSINESS_SETTINGS_CACHE_SIZE = int(os.getenv("BUSINESS_SETTINGS_CACHE_SIZE", "1000"))
+
+SLOT_STEP_MINUTES = int(os.getenv("SLOT_STEP_MINUTES", "15"))
+
+APPOINTMENTS_PAGE_SIZE = int(os.getenv("APPOINTMENTS_PAGE_SIZE", "500"))
+
+APPOINTMENTS_MAX_PAGE_SIZE = int(os.getenv("APPOINTMENTS_MAX_PAGE_SIZE", "1000"))
+
+# GET /api/appointments sem from nem to começa este número de dias atrás (não no histórico mais antigo)
+APPOINTMENTS_DEFAULT_LOOKBACK_DAYS = int(os.getenv("APPOINTMENTS_DEFAULT_LOOKBACK_DAYS", "30"))
+
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
+
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+
+SUPABASE_QUERY_WORKERS = int(os.getenv("SUPABASE_QUERY_WORKERS", "8"))
+
+SUPABASE_QUERY_TIMEOUT = float(os.getenv("SUPABASE_QUERY_TIMEOUT", "10"))
+
+# Opcional: exige "Authorization: Bearer <METRICS_TOKEN>" no /metrics
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "").strip()
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "500"))
+
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+
+# /api/debug/traces só responde com "Authorization: Bearer <DEBUG_API_TOKEN>"
+DEBUG_API_TOKEN = os.getenv("DEBUG_API_TOKEN", "").strip()
+
+# Token bucket por negócio, compartilhado entre os workers do gunicorn pelo arquivo SQLite
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", os.path.join(tempfile.gettempdir(), "fluxo-rate-limit.db"))
+
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "120"))
+
+RATE_LIMIT_PER_SECOND = float(os.getenv("RATE_LIMIT_PER_SECOND", "2"))
+
+# Chamadas simultâneas ao Supabase somando todos os workers do host (vagas no mesmo SQLite do rate limit); 0 desliga
+SUPABASE_MAX_CONCURRENCY = int(os.getenv("SUPABASE_MAX_CONCURRENCY", "16"))
+
+SUPABASE_ACQUIRE_TIMEOUT = float(os.getenv("SUPABASE_ACQUIRE_TIMEOUT", "5"))
+
+# Vaga de um worker que morreu no meio da chamada volta a ficar livre depois disto (segundos)
+SUPABASE_SLOT_LEASE = float(os.getenv("SUPABASE_SLOT_LEASE", "30"))
+
+# Serializa as respostas com orjson quando instalado
+JSON_ORJSON = os.getenv("JSON_ORJSON", "1") == "1"
+
+# Comprime (br/gzip, conforme Accept-Encoding) respostas a partir deste tamanho; 0 desliga
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
+
+# Cabeçalhos X-Supabase-Queries/X-Query-Budget e aviso de orçamento estourado (sempre ligado com app.debug)
+QUERY_BUDGET_DEBUG = os.getenv("QUERY_BUDGET_DEBUG", "0") == "1"
+
 if not all([SUPABASE_URL, SUPABASE_KEY, SUPABASE_SERVICE_KEY]):
 
     raise RuntimeError("Variáveis de ambiente do Supabase não configuradas.")
@@ -40,14 +178,569 @@ CORS(app,
      origins=["https://fluxo-plataforma-de-agendamento-automatizado.lovable.app"],
      methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
      allow_headers=["Content-Type", "Authorization"],
+     expose_headers=["X-Next-Cursor", "X-Total-Count", "X-Request-ID", "X-Supabase-Queries", "X-Query-Budget", "Retry-After"],
      supports_credentials=True)
 
-supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+# ------------------
+# Serialização JSON (orjson)
+# ------------------
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Provider JSON com orjson: mesmas regras do padrão do Flask (chaves ordenadas,
+    datas no formato HTTP, UUID/Decimal/dataclass), mas UTF-8 direto em vez de \\uXXXX
+    """
+
+    def _options(self):
+        # datetime e dataclass passam pelo default do Flask para a saída não mudar
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        return options
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        try:
+            return orjson.dumps(obj, default=self.default, option=self._options()).decode("utf-8")
+        except orjson.JSONEncodeError:
+            # Ex.: inteiros maiores que 64 bits
+            return super().dumps(obj)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        options = self._options()
+
+        if self.compact is False or (self.compact is None and self._app.debug):
+            options |= orjson.OPT_INDENT_2
+
+        try:
+            body = orjson.dumps(obj, default=self.default, option=options)
+        except orjson.JSONEncodeError:
+            return super().response(*args, **kwargs)
+
+        return self._app.response_class(body + b"\n", mimetype=self.mimetype)
+
+if orjson is not None and JSON_ORJSON:
+    app.json = OrjsonProvider(app)
+
+# ------------------
+# Tracing por requisição
+# ------------------
+# Toda requisição coleta spans em memória (barato); só é gravada no ring buffer
+# e no log estruturado quando sorteada (TRACE_SAMPLE_RATE) ou lenta (TRACE_SLOW_MS).
+
+trace_logger = logging.getLogger("fluxo.trace")
+
+if not trace_logger.handlers:
+    trace_logger.addHandler(logging.StreamHandler())
+    trace_logger.setLevel(logging.INFO)
+    trace_logger.propagate = False
+
+_current_trace = contextvars.ContextVar("fluxo_trace", default=None)
+
+_current_span = contextvars.ContextVar("fluxo_span", default=None)
+
+recent_traces = deque(maxlen=TRACE_BUFFER_SIZE)
+
+_recent_traces_lock = threading.Lock()
+
+class Trace:
+    __slots__ = ("request_id", "name", "sampled", "started", "duration_ms", "attrs", "spans", "queries")
+
+    def __init__(self, request_id, name, sampled):
+        self.request_id = request_id
+        self.name = name
+        self.sampled = sampled
+        self.started = time.perf_counter()
+        self.duration_ms = None
+        self.attrs = {}
+        self.spans = []
+        self.queries = []  # (tabela/RPC, operação) de cada round-trip ao Supabase
+
+    def to_dict(self):
+        return {
+            "request_id": self.request_id,
+            "name": self.name,
+            "sampled": self.sampled,
+            "duration_ms": self.duration_ms,
+            "attrs": self.attrs,
+            "queries": len(self.queries),
+            "spans": sorted(self.spans, key=lambda sp: sp["start_ms"])
+        }
+
+def start_trace(name, request_id=None, sampled=None):
+    if sampled is None:
+        sampled = random.random() < TRACE_SAMPLE_RATE
+    trace = Trace(request_id or uuid.uuid4().hex, name, sampled)
+    _current_trace.set(trace)
+    _current_span.set(None)
+    return trace
+
+def finish_trace():
+    trace = _current_trace.get()
+
+    if trace is None:
+        return None
+
+    _current_trace.set(None)
+    trace.duration_ms = round((time.perf_counter() - trace.started) * 1000, 2)
+
+    if trace.sampled or trace.duration_ms >= TRACE_SLOW_MS:
+        with _recent_traces_lock:
+            recent_traces.append(trace)
+        trace_logger.info(json.dumps(trace.to_dict(), default=str, ensure_ascii=False))
+
+    return trace
+
+def trace_annotate(**attrs):
+    """Anexa atributos ao span atual (ou à raiz do trace)"""
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    span = _current_span.get()
+    (span["attrs"] if span else trace.attrs).update(attrs)
+
+@contextmanager
+def trace_span(name, **attrs):
+    trace = _current_trace.get()
+
+    if trace is None:
+        yield None
+        return
+
+    parent = _current_span.get()
+    started = time.perf_counter()
+    span = {
+        "name": name,
+        "parent": parent["name"] if parent else None,
+        "start_ms": round((started - trace.started) * 1000, 2),
+        "duration_ms": None,
+        "attrs": attrs
+    }
+    token = _current_span.set(span)
+
+    try:
+        yield span
+    except Exception as e:
+        span["attrs"]["error"] = str(e)
+        raise
+    finally:
+        span["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        _current_span.reset(token)
+        trace.spans.append(span)
+
+# ------------------
+# Métricas (Prometheus)
+# ------------------
+# Com vários workers do gunicorn, defina PROMETHEUS_MULTIPROC_DIR (ver gunicorn.conf.py)
+
+REQUEST_LATENCY = Histogram(
+    "fluxo_http_request_duration_seconds",
+    "Latência das requisições por endpoint Flask",
+    ["endpoint", "method"]
+)
+
+REQUEST_COUNT = Counter(
+    "fluxo_http_requests_total",
+    "Requisições por endpoint Flask e status",
+    ["endpoint", "method", "status"]
+)
+
+SUPABASE_LATENCY = Histogram(
+    "fluxo_supabase_call_duration_seconds",
+    "Latência das chamadas ao Supabase por tabela/RPC e operação",
+    ["table", "operation"]
+)
+
+SUPABASE_CALLS = Counter(
+    "fluxo_supabase_calls_total",
+    "Chamadas ao Supabase por tabela/RPC, operação e resultado",
+    ["table", "operation", "outcome"]
+)
+
+CACHE_REQUESTS = Counter(
+    "fluxo_cache_requests_total",
+    "Consultas aos caches em memória (hit/miss)",
+    ["cache", "result"]
+)
+
+RATE_LIMITED = Counter(
+    "fluxo_rate_limited_total",
+    "Requisições recusadas com 429 pelo limite por negócio",
+    ["endpoint"]
+)
+
+SUPABASE_SATURATED = Counter(
+    "fluxo_supabase_saturated_total",
+    "Chamadas ao Supabase recusadas por falta de vaga no limite de concorrência"
+)
+
+COMPRESSED_BYTES = Counter(
+    "fluxo_http_compressed_bytes_total",
+    "Bytes dos corpos comprimidos, antes (original) e depois (compressed) da compressão",
+    ["encoding", "stage"]
+)
+
+def observe_supabase_call(table, operation, elapsed, outcome):
+    SUPABASE_LATENCY.labels(table, operation).observe(elapsed)
+    SUPABASE_CALLS.labels(table, operation, outcome).inc()
+
+    # Conta o round-trip na requisição atual (list.append é seguro entre as threads do run_queries)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.queries.append((table, operation))
+
+# ------------------
+# Limite de chamadas simultâneas ao Supabase
+# ------------------
+# Cada chamada em andamento ocupa uma linha em supabase_leases, no mesmo SQLite
+# do rate limit (ver _rate_limit_db): o limite vale para todos os workers do
+# gunicorn juntos. Sem vaga em SUPABASE_ACQUIRE_TIMEOUT a chamada falha com
+# SupabaseSaturated; a requisição vira 429 + Retry-After (ver observe_request),
+# mesmo que a rota tenha capturado a exceção.
+
+SUPABASE_SLOT_POLL = 0.01  # segundos entre tentativas enquanto não há vaga
+
+class SupabaseSaturated(Exception):
+    pass
+
+def acquire_supabase_lease():
+    """Ocupa uma vaga; retorna o id da vaga ou None se todas estão ocupadas"""
+    conn = _rate_limit_db()
+    now = time.time()
+
+    conn.execute("begin immediate")
+    try:
+        conn.execute("delete from supabase_leases where expires < ?", (now,))
+        in_use = conn.execute("select count(*) from supabase_leases").fetchone()[0]
+        lease_id = None
+
+        if in_use < SUPABASE_MAX_CONCURRENCY:
+            lease_id = conn.execute(
+                "insert into supabase_leases (expires) values (?)", (now + SUPABASE_SLOT_LEASE,)
+            ).lastrowid
+
+        conn.execute("commit")
+    except Exception:
+        conn.execute("rollback")
+        raise
+
+    return lease_id
+
+def release_supabase_lease(lease_id):
+    _rate_limit_db().execute("delete from supabase_leases where id = ?", (lease_id,))
+
+@contextmanager
+def supabase_slot():
+    if SUPABASE_MAX_CONCURRENCY <= 0:
+        yield
+        return
+
+    deadline = time.monotonic() + SUPABASE_ACQUIRE_TIMEOUT
+    control_available = True
+
+    try:
+        lease_id = acquire_supabase_lease()
+
+        while lease_id is None and time.monotonic() < deadline:
+            time.sleep(SUPABASE_SLOT_POLL)
+            lease_id = acquire_supabase_lease()
+    except sqlite3.Error as e:
+        # Como no rate limit: falha do arquivo de controle não derruba a API
+        app.logger.warning("Limite de concorrência do Supabase indisponível: %s", e)
+        control_available = False
+
+    if not control_available:
+        yield
+        return
+
+    if lease_id is None:
+        SUPABASE_SATURATED.inc()
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.attrs["supabase_saturated"] = True
+        raise SupabaseSaturated("Limite de chamadas simultâneas ao Supabase atingido")
+
+    try:
+        yield
+    finally:
+        try:
+            release_supabase_lease(lease_id)
+        except sqlite3.Error as e:
+            app.logger.warning("Falha ao liberar vaga do Supabase (expira em %ss): %s", SUPABASE_SLOT_LEASE, e)
+
+def supabase_saturated_response():
+    response = jsonify({"error": "Muitas requisições simultâneas, tente novamente em instantes", "retry_after": 1})
+    response.status_code = 429
+    response.headers["Retry-After"] = "1"
+    return response
+
+@app.errorhandler(SupabaseSaturated)
+def supabase_saturated(e):
+    # Rotas sem try/except: mesma resposta que observe_request dá às que capturam a exceção
+    return supabase_saturated_response()
+
+class _InstrumentedQuery:
+    """Envolve um request builder do postgrest e mede o execute()"""
+
+    _OPERATIONS = {"select", "insert", "update", "upsert", "delete"}
+
+    def __init__(self, builder, table, operation="select"):
+        self._builder = builder
+        self._table = table
+        self._operation = operation
+
+    def __getattr__(self, attr):
+        value = getattr(self._builder, attr)
+        operation = attr if attr in self._OPERATIONS else self._operation
+
+        # Propriedades como .not_ devolvem o próprio builder
+        if not callable(value):
+            return _InstrumentedQuery(value, self._table, operation) if hasattr(value, "execute") else value
+
+        def call(*args, **kwargs):
+            result = value(*args, **kwargs)
+            if hasattr(result, "execute"):
+                return _InstrumentedQuery(result, self._table, operation)
+            return result
+
+        return call
+
+    def execute(self):
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            with supabase_slot(), trace_span("supabase", table=self._table, operation=self._operation):
+                return self._builder.execute()
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            observe_supabase_call(self._table, self._operation, time.perf_counter() - started, outcome)
+
+class _InstrumentedAuth:
+    def __init__(self, auth):
+        self._auth = auth
+
+    def get_user(self, token):
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            with supabase_slot(), trace_span("supabase", table="auth", operation="get_user"):
+                return self._auth.get_user(token)
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            observe_supabase_call("auth", "get_user", time.perf_counter() - started, outcome)
+
+    def __getattr__(self, attr):
+        return getattr(self._auth, attr)
+
+class InstrumentedClient:
+    """Cliente Supabase com métricas em toda chamada de tabela, RPC e auth.get_user"""
+
+    def __init__(self, client):
+        self._client = client
+        self.auth = _InstrumentedAuth(client.auth)
+
+    def table(self, name):
+        return _InstrumentedQuery(self._client.table(name), name)
+
+    def from_(self, name):
+        return self.table(name)
+
+    def rpc(self, fn, params=None, *args, **kwargs):
+        return _InstrumentedQuery(self._client.rpc(fn, params or {}, *args, **kwargs), f"rpc:{fn}", "rpc")
+
+    def __getattr__(self, attr):
+        return getattr(self._client, attr)
+
+supabase = InstrumentedClient(create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY))
+
+# ------------------
+# Consultas concorrentes
+# ------------------
+
+query_executor = ThreadPoolExecutor(max_workers=SUPABASE_QUERY_WORKERS, thread_name_prefix="supabase-query")
+
+class QueryTimeout(Exception):
+    pass
+
+def run_queries(queries, timeout=None):
+    """
+    Dispara consultas independentes ao mesmo tempo e espera todas
+
+    Args:
+        queries: dict nome -> callable, ou nome -> (callable, timeout em segundos)
+        timeout: timeout padrão por consulta (SUPABASE_QUERY_TIMEOUT se None)
+
+    Returns:
+        dict: nome -> resultado de cada callable
+
+    Raises:
+        QueryTimeout: se alguma consulta passar do seu timeout; erros das consultas são propagados
+    """
+    default_timeout = SUPABASE_QUERY_TIMEOUT if timeout is None else timeout
+    started = time.monotonic()
+    futures = {}
+
+    for name, query in queries.items():
+        fn, limit = query if isinstance(query, tuple) else (query, default_timeout)
+        # Cada consulta roda com uma cópia do contexto (trace/span atuais)
+        futures[name] = (query_executor.submit(contextvars.copy_context().run, fn), limit)
+
+    results = {}
+
+    try:
+        for name, (future, limit) in futures.items():
+            remaining = max(0.0, started + limit - time.monotonic())
+            try:
+                results[name] = future.result(timeout=remaining)
+            except FuturesTimeout:
+                raise QueryTimeout(f"Consulta '{name}' excedeu {limit}s")
+    finally:
+        for future, _ in futures.values():
+            future.cancel()
+
+    return results
+
+# ------------------
+# Cache em memória
+# ------------------
+
+class TTLCache:
+    """Cache LRU limitado, com expiração por TTL e seguro entre threads."""
+
+    def __init__(self, maxsize, ttl, name="cache"):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] <= now:
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                CACHE_REQUESTS.labels(self.name, "miss").inc()
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            CACHE_REQUESTS.labels(self.name, "hit").inc()
+            return item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return item[1] if item else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
 
 # ------------------
 # Decorador de Auth
 # ------------------
 
+# user_id -> business_id
+profile_cache = TTLCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL, name="profile")
+
+_jwks_client = None
+
+def invalidate_profile_cache(user_id=None):
+    """Remove um usuário (ou todos, se user_id for None) do cache de perfis"""
+    if user_id is None:
+        profile_cache.clear()
+    else:
+        profile_cache.pop(str(user_id))
+
+def _signing_key(token):
+    """Chave pelo "alg" do cabeçalho: HS* usa o segredo legado, os demais (ES256/RS256) o JWKS"""
+    global _jwks_client
+
+    if jwt.get_unverified_header(token).get("alg", "").startswith("HS"):
+        # Sem o segredo não há como validar HS256 localmente (e o JWKS não teria a chave)
+        return (SUPABASE_JWT_SECRET, ["HS256"]) if SUPABASE_JWT_SECRET else (None, None)
+
+    if _jwks_client is None:
+        _jwks_client = jwt.PyJWKClient(SUPABASE_JWKS_URL, cache_keys=True, lifespan=600)
+
+    key = _jwks_client.get_signing_key_from_jwt(token)
+    return key.key, [key.algorithm_name]
+
+def verify_token_locally(token):
+    """
+    Verifica o JWT do Supabase sem ida ao servidor de Auth
+
+    Returns:
+        str | None: user id (claim "sub"), ou None quando não é possível decidir
+        localmente (kid desconhecido no JWKS, algoritmo não suportado, token perto de expirar)
+
+    Raises:
+        jwt.InvalidTokenError: token com assinatura inválida, expirado ou malformado
+    """
+    try:
+        key, algorithms = _signing_key(token)
+    except (jwt.PyJWKClientError, jwt.PyJWKError):
+        return None
+
+    if key is None:
+        return None
+
+    try:
+        claims = jwt.decode(
+            token,
+            key,
+            algorithms=algorithms,
+            audience="authenticated",
+            options={"require": ["exp", "sub"]}
+        )
+    except jwt.InvalidAlgorithmError:
+        # Ex.: HS384 com o segredo legado -- quem decide é o servidor de Auth
+        return None
+
+    if AUTH_REMOTE_FALLBACK and claims["exp"] - time.time() < AUTH_EXPIRY_MARGIN_SECONDS:
+        return None
+
+    return claims["sub"]
+
+def resolve_user_id(token):
+    """Retorna o user id do token (local quando possível, remoto como fallback) ou None se inválido"""
+    if AUTH_LOCAL_JWT:
+        try:
+            user_id = verify_token_locally(token)
+        except jwt.InvalidTokenError:
+            return None
+
+        if user_id or not AUTH_REMOTE_FALLBACK:
+            return user_id
+
+    user = supabase.auth.get_user(token).user
+    return user.id if user else None
+
 def auth_required(fn):
     @wraps(fn)
     def wrapper(*args, **kwargs):
@@ -58,22 +751,29 @@ def auth_required(fn):
         token = auth.split(" ")[1]
 
         try:
-            user_resp = supabase.auth.get_user(token)
-            user = user_resp.user
+            with trace_span("auth"):
+                user_id = resolve_user_id(token)
 
-            if not user:
-                return jsonify({"error": "Token inválido"}), 401
+                if not user_id:
+                    return jsonify({"error": "Token inválido"}), 401
 
-            prof = supabase.table("profiles") \
-                .select("business_id") \
-                .eq("id", user.id) \
-                .single() \
-                .execute().data
+                business_id = profile_cache.get(user_id)
+
+                if business_id is None:
+                    prof = supabase.table("profiles") \
+                        .select("business_id") \
+                        .eq("id", user_id) \
+                        .single() \
+                        .execute().data
 
-            if not prof:
-                return jsonify({"error": "Perfil não encontrado"}), 403
+                    if not prof:
+                        return jsonify({"error": "Perfil não encontrado"}), 403
 
-            kwargs["business_id"] = prof["business_id"]
+                    business_id = prof["business_id"]
+                    profile_cache.set(user_id, business_id)
+
+            kwargs["business_id"] = business_id
+            trace_annotate(business_id=business_id)
 
         except Exception as e:
             return jsonify({"error": "Falha na autenticação", "details": str(e)}), 500
@@ -82,6 +782,103 @@ def auth_required(fn):
 
     return wrapper
 
+# ------------------
+# Limite de requisições por negócio
+# ------------------
+# Token bucket por business_id: até RATE_LIMIT_BURST fichas, repostas a
+# RATE_LIMIT_PER_SECOND por segundo. Cada rota gasta o custo declarado em
+# @rate_limited (aplicar abaixo do @auth_required). O estado fica num SQLite
+# local, então todos os workers do gunicorn veem o mesmo saldo (o arquivo também
+# guarda as vagas do limite de chamadas ao Supabase e as invalidações de cache).
+
+_rate_limit_local = threading.local()
+
+def _rate_limit_db():
+    conn = getattr(_rate_limit_local, "conn", None)
+
+    if conn is None:
+        conn = sqlite3.connect(RATE_LIMIT_DB, timeout=1.0, isolation_level=None)
+        conn.execute("pragma journal_mode=wal")
+        conn.execute("pragma synchronous=off")
+        conn.execute("""
+            create table if not exists rate_buckets (
+                key text primary key,
+                tokens real not null,
+                updated real not null
+            )
+        """)
+        conn.execute("""
+            create table if not exists cache_invalidations (
+                key text primary key,
+                invalidated real not null
+            )
+        """)
+        conn.execute("""
+            create table if not exists supabase_leases (
+                id integer primary key autoincrement,
+                expires real not null
+            )
+        """)
+        _rate_limit_local.conn = conn
+
+    return conn
+
+def take_tokens(key, cost, burst=None, rate=None):
+    """Consome `cost` fichas do bucket; retorna (permitido, segundos até haver fichas)"""
+    burst = RATE_LIMIT_BURST if burst is None else burst
+    rate = RATE_LIMIT_PER_SECOND if rate is None else rate
+    conn = _rate_limit_db()
+    now = time.time()
+
+    conn.execute("begin immediate")
+    try:
+        row = conn.execute("select tokens, updated from rate_buckets where key = ?", (key,)).fetchone()
+        tokens = burst if row is None else min(burst, row[0] + max(0.0, now - row[1]) * rate)
+        allowed = tokens >= cost
+
+        if allowed:
+            tokens -= cost
+
+        conn.execute(
+            "insert into rate_buckets (key, tokens, updated) values (?, ?, ?) "
+            "on conflict (key) do update set tokens = excluded.tokens, updated = excluded.updated",
+            (key, tokens, now)
+        )
+        conn.execute("commit")
+    except Exception:
+        conn.execute("rollback")
+        raise
+
+    return allowed, 0.0 if allowed else (cost - tokens) / rate
+
+def rate_limited(cost):
+    """Cobra `cost` fichas do negócio por requisição; sem saldo, responde 429 com Retry-After"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not RATE_LIMIT_ENABLED or cost <= 0:
+                return fn(*args, **kwargs)
+
+            try:
+                allowed, retry_after = take_tokens(f"business:{kwargs['business_id']}", cost)
+            except sqlite3.Error as e:
+                # Falha do arquivo de controle não derruba a API: deixa passar
+                app.logger.warning("Rate limit indisponível: %s", e)
+                return fn(*args, **kwargs)
+
+            if not allowed:
+                RATE_LIMITED.labels(request.endpoint or "unmatched").inc()
+                response = jsonify({"error": "Muitas requisições, tente novamente em instantes", "retry_after": math.ceil(retry_after)})
+                response.status_code = 429
+                response.headers["Retry-After"] = str(math.ceil(retry_after))
+                return response
+
+            return fn(*args, **kwargs)
+
+        wrapper.rate_limit_cost = cost
+        return wrapper
+    return decorator
+
 # ------------------
 # Helpers
 # ------------------
@@ -91,10 +888,202 @@ def format_service(s):
         s["duration"] = s.pop("duration_minutes")
     return s
 
+# SQLSTATE de exclusion_violation (constraint appointments_no_overlap)
+BOOKING_CONFLICT_CODE = "23P01"
+
+def is_booking_conflict(e):
+    return isinstance(e, APIError) and e.code == BOOKING_CONFLICT_CODE
+
+def booking_conflict_response():
+    return jsonify({"error": "Profissional já possui agendamento neste horário"}), 409
+
+def parse_timestamp(value):
+    """Converte o timestamp retornado pelo PostgREST em datetime com fuso (UTC se vier sem)"""
+    ts = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=dt_timezone.utc)
+    return ts
+
+def is_uuid(value):
+    """As chaves do banco são uuid: qualquer outra coisa num filtro derruba a consulta inteira"""
+    try:
+        uuid.UUID(str(value))
+        return True
+    except ValueError:
+        return False
+
+def merge_intervals(intervals):
+    """Ordena e funde intervalos (start, end) sobrepostos ou encostados"""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+# ------------------
+# Configurações do negócio (timezone + horários) em cache
+# ------------------
+
+DEFAULT_TIMEZONE = "America/Sao_Paulo"
+
+# 0=segunda ... 6=domingo, conforme a tabela business_hours
+WEEKDAY_NAMES = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+
+DAY_NAMES_PT = {
+    "monday": "segunda-feira",
+    "tuesday": "terça-feira",
+    "wednesday": "quarta-feira",
+    "thursday": "quinta-feira",
+    "friday": "sexta-feira",
+    "saturday": "sábado",
+    "sunday": "domingo"
+}
+
+# business_id -> (carregado em, {"tz": tzinfo, "hours": {day_of_week: {"is_open", "start", "end"}}})
+business_settings_cache = TTLCache(BUSINESS_SETTINGS_CACHE_SIZE, BUSINESS_SETTINGS_TTL, name="business_settings")
+
+def _parse_hhmm(value):
+    if not value:
+        return None
+    try:
+        # Remove segundos se existirem ("09:00:00" -> "09:00")
+        return datetime.strptime(str(value)[:5], "%H:%M").time()
+    except ValueError:
+        return None
+
+def load_business_settings(business_id):
+    """Lê timezone e os 7 dias de business_hours do negócio (2 consultas em paralelo)"""
+    res = run_queries({
+        "business": lambda: supabase.table("businesses")
+            .select("timezone")
+            .eq("id", business_id)
+            .single()
+            .execute().data,
+        "hours": lambda: supabase.table("business_hours")
+            .select("day_of_week, start_time, end_time, is_open")
+            .eq("business_id", business_id)
+            .execute().data
+    })
+
+    tz_row = res["business"]
+    rows = res["hours"] or []
+
+    hours = {
+        row["day_of_week"]: {
+            "is_open": bool(row.get("is_open", False)),
+            "start": _parse_hhmm(row.get("start_time")),
+            "end": _parse_hhmm(row.get("end_time"))
+        }
+        for row in rows
+    }
+
+    return {
+        "tz": timezone(tz_row.get("timezone") or DEFAULT_TIMEZONE),
+        "hours": hours
+    }
+
+def _settings_invalidated_at(business_id):
+    """Última invalidação registrada por qualquer worker (do negócio ou de todos), 0 se nenhuma"""
+    try:
+        row = _rate_limit_db().execute(
+            "select max(invalidated) from cache_invalidations where key in (?, ?)",
+            (f"business_settings:{business_id}", "business_settings:*")
+        ).fetchone()
+    except sqlite3.Error as e:
+        app.logger.warning("Invalidações compartilhadas indisponíveis: %s", e)
+        return 0.0
+
+    return row[0] or 0.0
+
+def get_business_settings(business_id):
+    cached = business_settings_cache.get(business_id)
+
+    if cached is not None and cached[0] > _settings_invalidated_at(business_id):
+        return cached[1]
+
+    loaded_at = time.time()
+    settings = load_business_settings(business_id)
+    business_settings_cache.set(business_id, (loaded_at, settings))
+
+    return settings
+
+def invalidate_business_settings(business_id=None):
+    """
+    Descarta as configurações em cache de um negócio (ou de todos)
+
+    A invalidação também vai para o SQLite compartilhado (o mesmo do rate limit),
+    então os outros workers do gunicorn recarregam na próxima leitura.
+    """
+    if business_id is None:
+        business_settings_cache.clear()
+    else:
+        business_settings_cache.pop(business_id)
+
+    try:
+        _rate_limit_db().execute(
+            "insert into cache_invalidations (key, invalidated) values (?, ?) "
+            "on conflict (key) do update set invalidated = excluded.invalidated",
+            (f"business_settings:{'*' if business_id is None else business_id}", time.time())
+        )
+    except sqlite3.Error as e:
+        app.logger.warning("Falha ao propagar invalidação de configurações: %s", e)
+
 # ------------------
 # Nova Função: Validação de Horário de Funcionamento
 # ------------------
 
+def check_business_hours(settings, start_time):
+    """
+    Valida um horário contra as configurações já carregadas (sem I/O)
+
+    Args:
+        settings: retorno de get_business_settings
+        start_time: datetime (com ou sem fuso)
+
+    Returns:
+        tuple: (is_valid: bool, error_message: str)
+    """
+    local_tz = settings["tz"]
+
+    # Converte para timezone local se necessário
+    if start_time.tzinfo is None:
+        start_time = local_tz.localize(start_time)
+    else:
+        start_time = start_time.astimezone(local_tz)
+
+    day_name = WEEKDAY_NAMES[start_time.weekday()]
+    business_hours = settings["hours"].get(day_name)
+
+    # Se não encontrou configuração para este dia, assume fechado
+    if not business_hours:
+        return False, f"Horário de funcionamento não configurado para {day_name}"
+
+    # Se está marcado como fechado (is_open = FALSE)
+    if not business_hours["is_open"]:
+        return False, f"Estabelecimento fechado às {DAY_NAMES_PT[day_name]}s"
+
+    # Se start_time ou end_time for NULL (quando fechado)
+    start_business = business_hours["start"]
+    end_business = business_hours["end"]
+
+    if not start_business or not end_business:
+        return False, f"Horário de funcionamento não definido"
+
+    # Extrai apenas hora e minuto do agendamento
+    appointment_time = start_time.time()
+
+    # Valida se está dentro do horário
+    if appointment_time < start_business:
+        return False, f"Horário muito cedo. Funcionamento inicia às {start_business.strftime('%H:%M')}"
+
+    if appointment_time >= end_business:
+        return False, f"Horário muito tarde. Funcionamento encerra às {end_business.strftime('%H:%M')}"
+
+    return True, "Horário válido"
+
 def validate_business_hours(business_id, start_time_str):
     """
     Valida se o horário está dentro do funcionamento do negócio
@@ -107,115 +1096,184 @@ def validate_business_hours(business_id, start_time_str):
         tuple: (is_valid: bool, error_message: str)
     """
     try:
-        from pytz import timezone
-        
-        # Converte string para datetime
-        start_time = datetime.fromisoformat(start_time_str)
-        
-        # Busca timezone do negócio
-        tz_row = supabase.table("businesses") \
-            .select("timezone") \
-            .eq("id", business_id) \
-            .single() \
-            .execute().data
-        
-        tz_name = tz_row.get("timezone") or "America/Sao_Paulo"
-        local_tz = timezone(tz_name)
-        
-        # Converte para timezone local se necessário
-        if start_time.tzinfo is None:
-            start_time = local_tz.localize(start_time)
-        else:
-            start_time = start_time.astimezone(local_tz)
-        
-        # Pega o dia da semana (0=segunda, 6=domingo)
-        weekday = start_time.weekday()
-        
-        # Mapear dias da semana conforme sua tabela business_hours
-        weekday_names = {
-            0: "monday",
-            1: "tuesday", 
-            2: "wednesday",
-            3: "thursday",
-            4: "friday",
-            5: "saturday",
-            6: "sunday"
-        }
-        
-        day_name = weekday_names[weekday]
-        
-        # Busca horário de funcionamento para este dia
-        business_hours = supabase.table("business_hours") \
-            .select("start_time, end_time, is_open") \
-            .eq("business_id", business_id) \
-            .eq("day_of_week", day_name) \
-            .single() \
-            .execute().data
-        
-        # Se não encontrou configuração para este dia, assume fechado
-        if not business_hours:
-            return False, f"Horário de funcionamento não configurado para {day_name}"
-        
-        # Se está marcado como fechado (is_open = FALSE)
-        if not business_hours.get("is_open", False):
-            day_names_pt = {
-                "monday": "segunda-feira",
-                "tuesday": "terça-feira",
-                "wednesday": "quarta-feira", 
-                "thursday": "quinta-feira",
-                "friday": "sexta-feira",
-                "saturday": "sábado",
-                "sunday": "domingo"
-            }
-            return False, f"Estabelecimento fechado às {day_names_pt[day_name]}s"
-        
-        # Se start_time ou end_time for NULL (quando fechado)
-        if not business_hours.get("start_time") or not business_hours.get("end_time"):
-            return False, f"Horário de funcionamento não definido"
-        
-        # Extrai apenas hora e minuto do agendamento
-        appointment_time = start_time.time()
-        
-        # Converte horários de funcionamento para objetos time
-        start_business_str = str(business_hours["start_time"])
-        end_business_str = str(business_hours["end_time"])
-        
-        # Remove segundos se existirem e converte para time
-        if len(start_business_str) > 5:
-            start_business = datetime.strptime(start_business_str[:5], "%H:%M").time()
-        else:
-            start_business = datetime.strptime(start_business_str, "%H:%M").time()
-            
-        if len(end_business_str) > 5:
-            end_business = datetime.strptime(end_business_str[:5], "%H:%M").time()
-        else:
-            end_business = datetime.strptime(end_business_str, "%H:%M").time()
-        
-        # Valida se está dentro do horário
-        if appointment_time < start_business:
-            return False, f"Horário muito cedo. Funcionamento inicia às {start_business.strftime('%H:%M')}"
-        
-        if appointment_time >= end_business:
-            return False, f"Horário muito tarde. Funcionamento encerra às {end_business.strftime('%H:%M')}"
-        
-        return True, "Horário válido"
-        
+        with trace_span("validate_business_hours"):
+            # Converte string para datetime
+            start_time = datetime.fromisoformat(start_time_str)
+
+            return check_business_hours(get_business_settings(business_id), start_time)
+
     except Exception as e:
         return False, f"Erro ao validar horário: {str(e)}"
 
+# ------------------
+# Compressão das respostas
+# ------------------
+# Respostas em streaming (export) passam direto: comprimir exigiria juntar o corpo todo.
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "application/x-ndjson", "text/csv", "text/plain", "text/html"}
+
+def compress_body(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0)
+
+def negotiate_encoding():
+    """Melhor codificação aceita pelo cliente; br ganha de gzip no empate"""
+    offered = ["br", "gzip"] if brotli is not None else ["gzip"]
+    return request.accept_encodings.best_match(offered)
+
+def compress_response(response):
+    if COMPRESS_MIN_BYTES <= 0 or response.is_streamed or response.direct_passthrough:
+        return response
+
+    if response.status_code < 200 or response.status_code in (204, 304) or "Content-Encoding" in response.headers:
+        return response
+
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+
+    data = response.get_data()
+
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+
+    # A resposta depende do Accept-Encoding mesmo quando sai sem compressão
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate_encoding()
+
+    if encoding is None:
+        return response
+
+    with trace_span("compress_response", encoding=encoding, bytes=len(data)):
+        compressed = compress_body(data, encoding)
+
+    if len(compressed) >= len(data):
+        return response
+
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    COMPRESSED_BYTES.labels(encoding, "original").inc(len(data))
+    COMPRESSED_BYTES.labels(encoding, "compressed").inc(len(compressed))
+    return response
+
+# ------------------
+# Instrumentação das requisições
+# ------------------
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    start_trace(f"{request.method} {request.path}", request.headers.get("X-Request-ID"))
+
+@app.after_request
+def observe_request(response):
+    trace = _current_trace.get()
+
+    if trace is not None and trace.attrs.get("supabase_saturated"):
+        response = supabase_saturated_response()
+
+    response = compress_response(response)
+    started = g.get("request_started")
+
+    if started is not None:
+        endpoint = request.endpoint or "unmatched"
+        REQUEST_LATENCY.labels(endpoint, request.method).observe(time.perf_counter() - started)
+        REQUEST_COUNT.labels(endpoint, request.method, str(response.status_code)).inc()
+
+    trace_annotate(endpoint=request.endpoint, status=response.status_code)
+    trace = finish_trace()
+
+    if trace is not None:
+        response.headers["X-Request-ID"] = trace.request_id
+
+        if QUERY_BUDGET_DEBUG or app.debug:
+            report_query_budget(trace, response)
+
+    return response
+
+# ------------------
+# Orçamento de round-trips por rota
+# ------------------
+# Cada rota declara quantas chamadas ao Supabase faz com os caches aquecidos
+# (perfil, configurações do negócio). O benchmark.py --check-budgets falha
+# quando uma mudança estoura o orçamento de alguma rota.
+
+def query_budget(limit):
+    """Declara o máximo de round-trips ao Supabase da rota (aplicar abaixo do @auth_required)"""
+    def decorator(fn):
+        fn.query_budget = limit
+        return fn
+    return decorator
+
+def route_query_budget(endpoint):
+    view = app.view_functions.get(endpoint)
+    return getattr(view, "query_budget", None)
+
+def report_query_budget(trace, response):
+    used = len(trace.queries)
+    budget = route_query_budget(request.endpoint)
+
+    response.headers["X-Supabase-Queries"] = str(used)
+
+    if budget is not None:
+        response.headers["X-Query-Budget"] = str(budget)
+
+        if used > budget:
+            app.logger.warning(
+                "Orçamento de consultas estourado em %s: %d de %d (%s)",
+                request.endpoint, used, budget,
+                ", ".join(f"{table}.{op}" for table, op in trace.queries)
+            )
+
 # ------------------
 # Rotas Públicas
 # ------------------
 
-@app.route("/", methods=["GET"])
-def index():
-    return "API Fluxo v28.2 -- OK"
+@app.route("/", methods=["GET"])
+@query_budget(0)
+def index():
+    return "API Fluxo v28.2 -- OK"
+
+@app.route("/api/health", methods=["GET"])
+@query_budget(0)
+def health():
+    return jsonify({"status": "ok"})
+
+@app.route("/metrics", methods=["GET"])
+@query_budget(0)
+def metrics():
+    if METRICS_TOKEN and request.headers.get("Authorization", "") != f"Bearer {METRICS_TOKEN}":
+        return jsonify({"error": "Não autorizado"}), 401
+
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+@app.route("/api/debug/traces", methods=["GET"])
+@query_budget(0)
+def debug_traces():
+    """Traces mais lentos entre os recentes (amostrados ou lentos) deste worker"""
+    if not DEBUG_API_TOKEN:
+        return jsonify({"error": "Não encontrado"}), 404
+
+    if request.headers.get("Authorization", "") != f"Bearer {DEBUG_API_TOKEN}":
+        return jsonify({"error": "Não autorizado"}), 401
+
+    limit = request.args.get("limit", 20, type=int)
+
+    with _recent_traces_lock:
+        traces = list(recent_traces)
 
-@app.route("/api/health", methods=["GET"])
-def health():
-    return jsonify({"status": "ok"})
+    slowest = sorted(traces, key=lambda t: t.duration_ms, reverse=True)[:limit]
+
+    return jsonify({"pid": os.getpid(), "traces": [t.to_dict() for t in slowest]}), 200
 
 @app.route("/api/on-signup", methods=["POST"])
+@query_budget(1)
 def on_signup():
     data = request.get_json(force=True)
 
@@ -229,6 +1287,8 @@ def on_signup():
             }
         ).execute()
 
+        invalidate_profile_cache(data["user_id"])
+
         return jsonify({"message": "Usuário e negócio criados"}), 200
 
     except Exception as e:
@@ -240,19 +1300,12 @@ def on_signup():
 
 @app.route("/api/dashboard/stats", methods=["GET"])
 @auth_required
+@rate_limited(10)
+@query_budget(4)
 def dashboard_stats(business_id):
     try:
-        from pytz import timezone
-
-        # --- Time-zone do negócio
-        tz_row = supabase.table("businesses") \
-            .select("timezone") \
-            .eq("id", business_id) \
-            .single() \
-            .execute().data
-
-        tz_name = tz_row.get("timezone") or "America/Sao_Paulo"
-        local_tz = timezone(tz_name)
+        # --- Time-zone do negócio (cache de configurações)
+        local_tz = get_business_settings(business_id)["tz"]
 
         # --- Data selecionada (query param ?date=YYYY-MM-DD) ou hoje
         date_str = request.args.get("date")
@@ -268,94 +1321,108 @@ def dashboard_stats(business_id):
         now_local = datetime.now(local_tz)
         start_of_month = now_local.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
 
+        # --- Janelas dos gráficos (mesmos limites de antes, agora calculados em memória)
+        days_7d = []
+
+        for i in range(6, -1, -1):
+            start = (now_local - timedelta(days=i)).replace(hour=0, minute=0, second=0, microsecond=0)
+            days_7d.append((start, start + timedelta(days=1)))
+
+        weeks_4w = []
+
+        for w in range(4):
+            start = (now_local - timedelta(weeks=w)).replace(hour=0, minute=0, second=0, microsecond=0)
+            start -= timedelta(days=start.weekday())  # segunda-feira da semana
+            weeks_4w.append((start, start + timedelta(days=7)))
+
+        window_start = min(start_of_month, days_7d[0][0], weeks_4w[-1][0])
+
         # ----------------------------------------------------------------
-        # Carrega **uma única vez** os serviços do negócio
+        # Consultas independentes em paralelo: serviços, rollup diário da
+        # janela (4 semanas ∪ mês corrente ∪ futuro), dia selecionado e
+        # novos clientes do mês (RPC dashboard_new_clients)
         # ----------------------------------------------------------------
 
-        services = supabase.table("services") \
-            .select("id, name, price") \
-            .eq("business_id", business_id) \
-            .execute().data or []
-
-        price_map = {s["id"]: s.get("price", 0.0) for s in services}
-        service_map = {s["id"]: s.get("name", "") for s in services}
+        res = run_queries({
+            "services": lambda: supabase.table("services")
+                .select("id, name, price")
+                .eq("business_id", business_id)
+                .execute().data,
+            "rollups": lambda: supabase.table("appointment_daily_rollups")
+                .select("day, appointment_count, service_counts")
+                .eq("business_id", business_id)
+                .gte("day", window_start.date().isoformat())
+                .execute().data,
+            "today": lambda: supabase.table("appointments")
+                .select("""
+                    id,
+                    customer_name,
+                    start_time,
+                    service_id,
+                    service:services(name),
+                    professional:professionals(name)
+                """)
+                .eq("business_id", business_id)
+                .gte("start_time", start_of_day.isoformat())
+                .lt("start_time", end_of_day.isoformat())
+                .execute().data,
+            "new_clients": lambda: supabase.rpc(
+                "dashboard_new_clients",
+                {"p_business_id": business_id, "p_since": start_of_month.isoformat()}
+            ).execute().data
+        })
+
+        services = res["services"] or []
+
+        # Chaves em texto: service_counts do rollup é um jsonb indexado pelo id do serviço
+        price_map = {str(s["id"]): s.get("price", 0.0) for s in services}
+        service_map = {str(s["id"]): s.get("name", "") for s in services}
+
+        rollup_by_day = {date.fromisoformat(r["day"]): r for r in res["rollups"] or []}
+
+        def rollup_days(start, end=None):
+            return [r for d, r in rollup_by_day.items() if d >= start and (end is None or d < end)]
+
+        def rollup_revenue(rows):
+            return sum(
+                price_map.get(sid, 0) * n
+                for r in rows
+                for sid, n in (r.get("service_counts") or {}).items()
+            )
 
         # ----------------------------------------------------------------
         # Agendamentos do dia selecionado
         # ----------------------------------------------------------------
 
-        appts_today = supabase.table("appointments") \
-            .select("""
-                id,
-                customer_name,
-                start_time,
-                service_id,
-                service:services(name),
-                professional:professionals(name)
-            """) \
-            .eq("business_id", business_id) \
-            .gte("start_time", start_of_day.isoformat()) \
-            .lt("start_time", end_of_day.isoformat()) \
-            .execute().data
+        appts_today = res["today"] or []
 
-        revenue_today = sum(price_map.get(a["service_id"], 0) for a in appts_today)
+        revenue_today = sum(price_map.get(str(a["service_id"]), 0) for a in appts_today)
 
         # ----------------------------------------------------------------
         # Agendamentos do mês corrente
         # ----------------------------------------------------------------
 
-        appts_month = supabase.table("appointments") \
-            .select("service_id") \
-            .eq("business_id", business_id) \
-            .gte("start_time", start_of_month.isoformat()) \
-            .execute().data
+        month_rollups = rollup_days(start_of_month.date())
 
-        revenue_month = sum(price_map.get(a["service_id"], 0) for a in appts_month)
+        revenue_month = rollup_revenue(month_rollups)
 
         # ----------------------------------------------------------------
         # Novos clientes no mês
         # ----------------------------------------------------------------
 
-        old_clients = supabase.table("appointments") \
-            .select("customer_phone") \
-            .eq("business_id", business_id) \
-            .lt("start_time", start_of_month.isoformat()) \
-            .execute().data
-
-        old_phones = {c["customer_phone"] for c in old_clients if c.get("customer_phone")}
-
-        this_month = supabase.table("appointments") \
-            .select("customer_phone") \
-            .eq("business_id", business_id) \
-            .gte("start_time", start_of_month.isoformat()) \
-            .execute().data
-
-        new_phones = {
-            c["customer_phone"] for c in this_month
-            if c.get("customer_phone") and c["customer_phone"] not in old_phones
-        }
-
-        new_clients = len(new_phones)
+        new_clients = res["new_clients"] or 0
 
         # ----------------------------------------------------------------
         # Últimos 7 dias (contagem de agendamentos)
         # ----------------------------------------------------------------
 
-        appts_7d = []
-
-        for i in range(6, -1, -1):
-            day = now_local - timedelta(days=i)
-            start = day.replace(hour=0, minute=0, second=0, microsecond=0)
-            end = start + timedelta(days=1)
-
-            count = supabase.table("appointments") \
-                .select("id") \
-                .eq("business_id", business_id) \
-                .gte("start_time", start.isoformat()) \
-                .lt("start_time", end.isoformat()) \
-                .execute().data
-
-            appts_7d.append({"date": start.date().isoformat(), "count": len(count)})
+        appts_7d = [
+            {
+                "date": start.date().isoformat(),
+                "count": sum(r["appointment_count"] for r in rollup_days(start.date(), end.date()))
+            }
+            for start, end in days_7d
+        ]
 
         # ----------------------------------------------------------------
         # Faturamento das últimas 4 semanas
@@ -363,23 +1430,10 @@ def dashboard_stats(business_id):
 
         revenue_4w = []
 
-        for w in range(4):
-            start = (now_local - timedelta(weeks=w)).replace(hour=0, minute=0, second=0, microsecond=0)
-            start -= timedelta(days=start.weekday())  # segunda-feira da semana
-            end = start + timedelta(days=7)
-
-            appts = supabase.table("appointments") \
-                .select("service_id") \
-                .eq("business_id", business_id) \
-                .gte("start_time", start.isoformat()) \
-                .lt("start_time", end.isoformat()) \
-                .execute().data
-
-            total = sum(price_map.get(a["service_id"], 0) for a in appts)
-
+        for start, end in weeks_4w:
             revenue_4w.append({
                 "weekLabel": f"{start.strftime('%d/%m')} -- {end.strftime('%d/%m')}",
-                "revenue": total
+                "revenue": rollup_revenue(rollup_days(start.date(), end.date()))
             })
 
         # ----------------------------------------------------------------
@@ -388,9 +1442,9 @@ def dashboard_stats(business_id):
 
         svc_counter = {}
 
-        for a in appts_month:
-            sid = a["service_id"]
-            svc_counter[sid] = svc_counter.get(sid, 0) + 1
+        for r in month_rollups:
+            for sid, n in (r.get("service_counts") or {}).items():
+                svc_counter[sid] = svc_counter.get(sid, 0) + n
 
         top = sorted(svc_counter.items(), key=lambda x: x[1], reverse=True)[:5]
 
@@ -435,6 +1489,8 @@ def dashboard_stats(business_id):
 
 @app.route("/api/services", methods=["GET"])
 @auth_required
+@rate_limited(1)
+@query_budget(1)
 def list_services(business_id):
     resp = supabase.table("services") \
         .select("*") \
@@ -446,6 +1502,8 @@ def list_services(business_id):
 
 @app.route("/api/services", methods=["POST"])
 @auth_required
+@rate_limited(1)
+@query_budget(1)
 def create_service(business_id):
     req = request.get_json(force=True)
 
@@ -473,6 +1531,8 @@ def create_service(business_id):
 
 @app.route("/api/services/<sid>", methods=["PUT"])
 @auth_required
+@rate_limited(1)
+@query_budget(1)
 def update_service(sid, business_id):
     req = request.get_json(force=True)
 
@@ -506,6 +1566,8 @@ def update_service(sid, business_id):
 
 @app.route("/api/services/<sid>", methods=["DELETE"])
 @auth_required
+@rate_limited(1)
+@query_budget(1)
 def delete_service(sid, business_id):
     r = supabase.table("services") \
         .delete() \
@@ -524,6 +1586,8 @@ def delete_service(sid, business_id):
 
 @app.route("/api/professionals", methods=["GET"])
 @auth_required
+@rate_limited(1)
+@query_budget(1)
 def list_professionals(business_id):
     resp = supabase.table("professionals") \
         .select("*, services(*)") \
@@ -535,6 +1599,8 @@ def list_professionals(business_id):
 
 @app.route("/api/professionals", methods=["POST"])
 @auth_required
+@rate_limited(1)
+@query_budget(1)
 def create_professional(business_id):
     req = request.get_json(force=True)
 
@@ -555,6 +1621,8 @@ def create_professional(business_id):
 
 @app.route("/api/professionals/<pid>", methods=["DELETE"])
 @auth_required
+@rate_limited(1)
+@query_budget(1)
 def delete_professional(pid, business_id):
     r = supabase.table("professionals") \
         .delete() \
@@ -569,6 +1637,8 @@ def delete_professional(pid, business_id):
 
 @app.route("/api/professionals/<pid>/services", methods=["POST"])
 @auth_required
+@rate_limited(1)
+@query_budget(1)
 def add_prof_service(pid, business_id):
     sid = request.get_json(force=True).get("service_id")
 
@@ -587,6 +1657,8 @@ def add_prof_service(pid, business_id):
 
 @app.route("/api/professionals/<pid>/services/<sid>", methods=["DELETE"])
 @auth_required
+@rate_limited(1)
+@query_budget(1)
 def remove_prof_service(pid, sid, business_id):
     r = supabase.table("professional_services") \
         .delete() \
@@ -600,6 +1672,8 @@ def remove_prof_service(pid, sid, business_id):
 
 @app.route("/api/professionals/<pid>", methods=["PUT"])
 @auth_required
+@rate_limited(1)
+@query_budget(1)
 def update_professional(pid, business_id):
     req = request.get_json(force=True)
 
@@ -627,46 +1701,244 @@ def update_professional(pid, business_id):
 # Agenda / Agendamentos
 # ------------------
 
+APPOINTMENT_COLUMNS = """
+    id,
+    customer_name,
+    customer_phone,
+    service_id,
+    professional_id,
+    start_time,
+    end_time,
+    service:services(name),
+    professional:professionals(name)
+"""
+
+def encode_cursor(row):
+    raw = json.dumps([row["start_time"], str(row["id"])]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    """Cursor opaco -> (start_time, id); levanta ValueError se for inválido"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        start_time, aid = json.loads(raw)
+    except Exception:
+        raise ValueError("cursor inválido")
+    return start_time, aid
+
+def parse_range_bound(value, local_tz):
+    """Aceita YYYY-MM-DD (meia-noite local) ou ISO completo; sem fuso assume o do negócio"""
+    if len(value) == 10:
+        return local_tz.localize(datetime.strptime(value, "%Y-%m-%d"))
+
+    ts = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return local_tz.localize(ts) if ts.tzinfo is None else ts
+
+def parse_range_args(business_id):
+    """from/to da query string; o timezone do negócio só é consultado quando algum deles veio"""
+    start_from = request.args.get("from")
+    start_to = request.args.get("to")
+
+    if not start_from and not start_to:
+        return None, None
+
+    local_tz = get_business_settings(business_id)["tz"]
+
+    return (
+        parse_range_bound(start_from, local_tz) if start_from else None,
+        parse_range_bound(start_to, local_tz) if start_to else None
+    )
+
+def fetch_appointments_page(business_id, start_from=None, start_to=None, cursor=None, limit=APPOINTMENTS_PAGE_SIZE,
+                            with_count=False, columns=APPOINTMENT_COLUMNS):
+    """
+    Uma página de agendamentos em ordem (start_time, id), paginada por keyset
+
+    Returns:
+        tuple: (rows, next_cursor | None, total | None)
+    """
+    def ranged(query):
+        query = query.eq("business_id", business_id)
+        if start_from:
+            query = query.gte("start_time", start_from.isoformat())
+        if start_to:
+            query = query.lt("start_time", start_to.isoformat())
+        return query
+
+    total = None
+
+    # O total é do intervalo inteiro; com cursor a contagem embutida veria só o restante
+    if with_count and cursor:
+        total = ranged(supabase.table("appointments").select("id", count="exact", head=True)).execute().count
+
+    query = ranged(
+        supabase.table("appointments").select(columns, count="exact" if with_count and not cursor else None)
+    )
+
+    if cursor:
+        last_start, last_id = decode_cursor(cursor)
+        query = query.or_(
+            f'start_time.gt."{last_start}",and(start_time.eq."{last_start}",id.gt."{last_id}")'
+        )
+
+    # Um registro a mais só para saber se existe próxima página
+    resp = query.order("start_time").order("id").limit(limit + 1).execute()
+    rows = resp.data or []
+
+    next_cursor = None
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1])
+
+    return rows, next_cursor, resp.count if total is None else total
+
 @app.route("/api/appointments", methods=["GET"])
 @auth_required
+@rate_limited(2)
+@query_budget(2)  # página + contagem total quando há cursor
 def get_appointments(business_id):
+    """
+    Agendamentos do negócio, paginados
+
+    Query params: from, to (intervalo de start_time, to exclusivo), cursor,
+    limit (máx. APPOINTMENTS_MAX_PAGE_SIZE) e count=true. Sem from nem to, a
+    lista começa APPOINTMENTS_DEFAULT_LOOKBACK_DAYS dias atrás; para o histórico
+    inteiro, envie um from antigo.
+    O corpo continua sendo a lista; a próxima página vem em X-Next-Cursor e o total em X-Total-Count.
+    """
     try:
-        r = supabase.table("appointments") \
-            .select("""
-                id,
-                customer_name,
-                customer_phone,
-                service_id,
-                professional_id,
-                start_time,
-                end_time,
-                service:services(name),
-                professional:professionals(name)
-            """) \
-            .eq("business_id", business_id) \
-            .execute().data
+        limit = min(int(request.args.get("limit") or APPOINTMENTS_PAGE_SIZE), APPOINTMENTS_MAX_PAGE_SIZE)
+        cursor = request.args.get("cursor")
 
-        return jsonify(r), 200
+        if cursor:
+            decode_cursor(cursor)
+    except ValueError as e:
+        return jsonify({"error": "Parâmetros de paginação inválidos", "details": str(e)}), 400
+
+    if limit <= 0:
+        return jsonify({"error": "limit deve ser positivo"}), 400
+
+    try:
+        start_from, start_to = parse_range_args(business_id)
+    except ValueError as e:
+        return jsonify({"error": "Parâmetros de paginação inválidos", "details": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": "Falha ao buscar agendamentos", "details": str(e)}), 500
+
+    if start_from is None and start_to is None:
+        start_from = datetime.now(dt_timezone.utc) - timedelta(days=APPOINTMENTS_DEFAULT_LOOKBACK_DAYS)
+
+    try:
+        rows, next_cursor, total = fetch_appointments_page(
+            business_id,
+            start_from=start_from,
+            start_to=start_to,
+            cursor=cursor,
+            limit=limit,
+            with_count=request.args.get("count") == "true"
+        )
+
+        resp = jsonify(rows)
+
+        if next_cursor:
+            resp.headers["X-Next-Cursor"] = next_cursor
+
+        if total is not None:
+            resp.headers["X-Total-Count"] = str(total)
+
+        return resp, 200
 
     except Exception as e:
         return jsonify({"error": "Falha ao buscar agendamentos", "details": str(e)}), 500
 
+EXPORT_CSV_FIELDS = [
+    "id", "start_time", "end_time", "customer_name", "customer_phone",
+    "service_id", "service_name", "professional_id", "professional_name"
+]
+
+def _export_row(a):
+    return {
+        **{k: a.get(k) for k in EXPORT_CSV_FIELDS if k in a},
+        "service_name": (a.get("service") or {}).get("name"),
+        "professional_name": (a.get("professional") or {}).get("name")
+    }
+
+@app.route("/api/appointments/export", methods=["GET"])
+@auth_required
+@rate_limited(20)
+@query_budget(1)  # só a primeira página; as demais saem durante o streaming
+def export_appointments(business_id):
+    """
+    Exporta os agendamentos em streaming (NDJSON ou CSV), página a página
+
+    Query params: format=ndjson|csv, from, to. A memória fica constante: só uma
+    página (EXPORT_PAGE_SIZE) é mantida por vez.
+    """
+    fmt = request.args.get("format", "ndjson")
+
+    if fmt not in ("ndjson", "csv"):
+        return jsonify({"error": "format deve ser ndjson ou csv"}), 400
+
+    try:
+        start_from, start_to = parse_range_args(business_id)
+    except ValueError as e:
+        return jsonify({"error": "Intervalo inválido", "details": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": "Falha ao exportar agendamentos", "details": str(e)}), 500
+
+    try:
+        # A primeira página é buscada antes de abrir o stream, para erros ainda virarem 500
+        first_page, next_cursor, _ = fetch_appointments_page(
+            business_id, start_from=start_from, start_to=start_to, limit=EXPORT_PAGE_SIZE
+        )
+    except Exception as e:
+        return jsonify({"error": "Falha ao exportar agendamentos", "details": str(e)}), 500
+
+    def pages():
+        rows, cursor = first_page, next_cursor
+        while True:
+            yield rows
+            if not cursor:
+                return
+            rows, cursor, _ = fetch_appointments_page(
+                business_id, start_from=start_from, start_to=start_to, cursor=cursor, limit=EXPORT_PAGE_SIZE
+            )
+
+    def generate_ndjson():
+        for rows in pages():
+            yield "".join(json.dumps(_export_row(a), ensure_ascii=False) + "\n" for a in rows)
+
+    def generate_csv():
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=EXPORT_CSV_FIELDS)
+        writer.writeheader()
+
+        for rows in pages():
+            writer.writerows(_export_row(a) for a in rows)
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+
+    if fmt == "csv":
+        body, mimetype = generate_csv(), "text/csv"
+    else:
+        body, mimetype = generate_ndjson(), "application/x-ndjson"
+
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=agendamentos.{fmt}"}
+    )
+
 @app.route("/api/appointments/<aid>", methods=["GET"])
 @auth_required
+@rate_limited(1)
+@query_budget(1)
 def get_appointment_by_id(aid, business_id):
     try:
         result = supabase.table("appointments") \
-            .select("""
-                id,
-                customer_name,
-                customer_phone,
-                service_id,
-                professional_id,
-                start_time,
-                end_time,
-                service:services(name),
-                professional:professionals(name)
-            """) \
+            .select(APPOINTMENT_COLUMNS) \
             .eq("id", aid) \
             .eq("business_id", business_id) \
             .single() \
@@ -682,6 +1954,8 @@ def get_appointment_by_id(aid, business_id):
 
 @app.route("/api/appointments", methods=["POST"])
 @auth_required
+@rate_limited(2)
+@query_budget(2)
 def create_appointment(business_id):
     data = request.get_json(force=True)
     required = ["professional_id", "service_id", "customer_name", "customer_phone", "start_time"]
@@ -722,10 +1996,15 @@ def create_appointment(business_id):
         return jsonify(appt), 201
 
     except Exception as e:
+        if is_booking_conflict(e):
+            return booking_conflict_response()
+
         return jsonify({"error": "Falha ao criar agendamento", "details": str(e)}), 500
 
 @app.route("/api/appointments/<aid>", methods=["PUT"])
 @auth_required
+@rate_limited(2)
+@query_budget(2)
 def update_appointment(aid, business_id):
     data = request.get_json(force=True)
     required = ["professional_id", "service_id", "customer_name", "customer_phone", "start_time"]
@@ -770,10 +2049,251 @@ def update_appointment(aid, business_id):
         return jsonify(updated[0]), 200
 
     except Exception as e:
+        if is_booking_conflict(e):
+            return booking_conflict_response()
+
         return jsonify({"error": "Falha ao atualizar agendamento", "details": str(e)}), 500
 
+def overlaps_any(intervals, start, end):
+    """intervals: lista ordenada de [start, end] disjuntos"""
+    i = bisect_left(intervals, [end])
+    return i > 0 and intervals[i - 1][1] > start
+
+@app.route("/api/appointments/batch", methods=["POST"])
+@auth_required
+@rate_limited(10)
+@query_budget(5)
+def batch_appointments(business_id):
+    """
+    Cria/atualiza vários agendamentos de uma vez (itens com "id" são atualizações)
+
+    Horários e durações são resolvidos uma vez por lote; conflitos são checados
+    dentro do lote e contra o banco; as escritas saem em um upsert (atualizações,
+    primeiro, para liberar os horários antigos) e um insert. Se o banco recusar
+    um comando por conflito de horário, as linhas dele são regravadas uma a uma.
+    Retorna um relatório por item, na ordem recebida.
+    """
+    payload = request.get_json(force=True)
+    items = payload.get("appointments") if isinstance(payload, dict) else payload
+    required = ["professional_id", "service_id", "customer_name", "customer_phone", "start_time"]
+
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Envie uma lista de agendamentos"}), 400
+
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"Máximo de {BATCH_MAX_ITEMS} agendamentos por lote"}), 400
+
+    # O upsert recusa atualizar a mesma linha duas vezes no mesmo comando
+    item_ids = [str(d["id"]) for d in items if isinstance(d, dict) and d.get("id")]
+
+    if len(item_ids) != len(set(item_ids)):
+        return jsonify({"error": "O mesmo agendamento aparece mais de uma vez no lote"}), 400
+
+    results = [None] * len(items)
+
+    def fail(i, status, error):
+        results[i] = {"index": i, "status": status, "error": error}
+
+    try:
+        settings = get_business_settings(business_id)
+
+        service_ids = list({str(d["service_id"]) for d in items if isinstance(d, dict) and d.get("service_id")})
+        durations = {}
+
+        if service_ids:
+            svcs = supabase.table("services") \
+                .select("id, duration_minutes") \
+                .eq("business_id", business_id) \
+                .in_("id", service_ids) \
+                .execute().data
+
+            durations = {str(s["id"]): s["duration_minutes"] for s in svcs}
+
+        # --- Validação individual (sem I/O)
+        candidates = []
+
+        for i, d in enumerate(items):
+            if not isinstance(d, dict) or not all(k in d for k in required):
+                fail(i, 400, "Campos obrigatórios faltando")
+                continue
+
+            if d.get("id") and not is_uuid(d["id"]):
+                fail(i, 400, "Identificador de agendamento inválido")
+                continue
+
+            try:
+                start = datetime.fromisoformat(d["start_time"])
+                is_valid, error_msg = check_business_hours(settings, start)
+            except Exception as e:
+                fail(i, 400, f"Erro ao validar horário: {str(e)}")
+                continue
+
+            if not is_valid:
+                fail(i, 400, error_msg)
+                continue
+
+            duration = durations.get(str(d["service_id"]))
+
+            if duration is None:
+                fail(i, 404, "Serviço não existe")
+                continue
+
+            end = start + timedelta(minutes=duration)
+
+            rec = {
+                "professional_id": d["professional_id"],
+                "service_id": d["service_id"],
+                "business_id": business_id,
+                "customer_name": d["customer_name"],
+                "customer_phone": d["customer_phone"],
+                "start_time": start.isoformat(),
+                "end_time": end.isoformat()
+            }
+
+            if d.get("id"):
+                rec["id"] = d["id"]
+
+            candidates.append((i, rec, parse_timestamp(rec["start_time"]), parse_timestamp(rec["end_time"])))
+
+        # --- Atualizações só de agendamentos do próprio negócio
+        update_ids = [str(rec["id"]) for _, rec, _, _ in candidates if "id" in rec]
+
+        if update_ids:
+            found = supabase.table("appointments") \
+                .select("id") \
+                .eq("business_id", business_id) \
+                .in_("id", update_ids) \
+                .execute().data
+
+            found_ids = {str(a["id"]) for a in found}
+
+            for i, rec, _, _ in candidates:
+                if "id" in rec and str(rec["id"]) not in found_ids:
+                    fail(i, 404, "Agendamento não encontrado")
+
+            candidates = [c for c in candidates if results[c[0]] is None]
+
+        # --- Conflitos contra o banco (uma consulta cobrindo a janela do lote) e dentro do lote
+        booked = {}
+        held = {}  # horários atuais das atualizações: professional_id -> {id: [start, end]}
+
+        if candidates:
+            stored = supabase.table("appointments") \
+                .select("id, professional_id, start_time, end_time") \
+                .eq("business_id", business_id) \
+                .in_("professional_id", list({str(rec["professional_id"]) for _, rec, _, _ in candidates})) \
+                .lt("start_time", max(c[3] for c in candidates).isoformat()) \
+                .gt("end_time", min(c[2] for c in candidates).isoformat()) \
+                .execute().data
+
+            moving = set(update_ids)
+            by_prof = {}
+
+            for a in stored:
+                interval = (parse_timestamp(a["start_time"]), parse_timestamp(a["end_time"]))
+
+                if str(a["id"]) in moving:
+                    held.setdefault(str(a["professional_id"]), {})[str(a["id"])] = interval
+                else:
+                    by_prof.setdefault(str(a["professional_id"]), []).append(interval)
+
+            booked = {pid: merge_intervals(intervals) for pid, intervals in by_prof.items()}
+
+        def overlaps_held(pid, start, end, own_id=None):
+            return any(
+                s < end and start < e
+                for aid, (s, e) in held.get(pid, {}).items()
+                if aid != own_id
+            )
+
+        # Atualizações primeiro, na ordem recebida: o horário antigo só fica livre
+        # depois que a atualização é aceita (é a ordem em que o banco as aplica)
+        accepted = []
+        released = {}  # id -> (professional_id, start, end) do horário antigo
+
+        for i, rec, start, end in sorted(candidates, key=lambda c: "id" not in c[1]):
+            pid = str(rec["professional_id"])
+            own_id = str(rec["id"]) if "id" in rec else None
+            intervals = booked.setdefault(pid, [])
+
+            if overlaps_any(intervals, start, end) or overlaps_held(pid, start, end, own_id):
+                fail(i, 409, "Profissional já possui agendamento neste horário")
+                continue
+
+            for old_pid, slots in held.items():
+                if own_id in slots:
+                    released[own_id] = (old_pid, *slots.pop(own_id))
+                    break
+
+            insort(intervals, [start, end])
+            accepted.append((i, rec))
+
+        def save(chunk, is_update):
+            rows = [rec for _, rec in chunk]
+            table = supabase.table("appointments")
+            saved = (table.upsert(rows, on_conflict="id") if is_update else table.insert(rows)).execute().data
+
+            for (i, _), appt in zip(chunk, saved):
+                results[i] = {"index": i, "status": 200 if is_update else 201, "appointment": appt}
+
+        def reject(chunk, e):
+            for i, _ in chunk:
+                if is_booking_conflict(e):
+                    fail(i, 409, "Profissional já possui agendamento neste horário")
+                else:
+                    fail(i, 500, f"Falha ao gravar: {str(e)}")
+
+        # --- Escritas em lote: um upsert para as atualizações, depois um insert para os novos
+        for is_update in (True, False):
+            group = [(i, rec) for i, rec in accepted if ("id" in rec) == is_update]
+
+            if not is_update:
+                # Atualização que não foi gravada mantém o horário antigo ocupado
+                still_held = [released[str(rec["id"])] for i, rec in accepted
+                              if "id" in rec and results[i]["status"] != 200]
+
+                for i, rec in group:
+                    start, end = parse_timestamp(rec["start_time"]), parse_timestamp(rec["end_time"])
+
+                    if any(pid == str(rec["professional_id"]) and s < end and start < e for pid, s, e in still_held):
+                        fail(i, 409, "Profissional já possui agendamento neste horário")
+
+                group = [(i, rec) for i, rec in group if results[i] is None]
+
+            if not group:
+                continue
+
+            try:
+                save(group, is_update)
+
+            except Exception as e:
+                if not is_booking_conflict(e) or len(group) == 1:
+                    reject(group, e)
+                    continue
+
+                # Um conflito derruba o comando inteiro (ex.: agendamento gravado por
+                # outra requisição depois da checagem): regrava linha a linha para
+                # que só os itens em conflito recebam 409
+                for item in group:
+                    try:
+                        save([item], is_update)
+                    except Exception as row_error:
+                        reject([item], row_error)
+
+        return jsonify({
+            "results": results,
+            "created": sum(1 for r in results if r["status"] == 201),
+            "updated": sum(1 for r in results if r["status"] == 200),
+            "failed": sum(1 for r in results if "error" in r)
+        }), 200
+
+    except Exception as e:
+        return jsonify({"error": "Falha ao processar lote", "details": str(e)}), 500
+
 @app.route("/api/appointments/<aid>", methods=["DELETE"])
 @auth_required
+@rate_limited(1)
+@query_budget(1)
 def delete_appointment(aid, business_id):
     try:
         deleted = supabase.table("appointments") \
@@ -792,14 +2312,14 @@ def delete_appointment(aid, business_id):
 
 @app.route("/api/available-professionals", methods=["GET"])
 @auth_required
+@rate_limited(3)
+@query_budget(4)
 def available_professionals(business_id):
     svc_id = request.args.get("service_id")
     start_str = request.args.get("start_time")
     appt_id = request.args.get("appointment_id")  # opcional: usado na edição
 
-    print(f"🔍 DEBUG - service_id: {svc_id}")
-    print(f"🔍 DEBUG - start_time: {start_str}")
-    print(f"🔍 DEBUG - business_id: {business_id}")
+    trace_annotate(service_id=svc_id, start_time=start_str, appointment_id=appt_id)
 
     if not svc_id or not start_str:
         return jsonify({"error": "service_id e start_time obrigatórios", "available_professionals": []}), 400
@@ -807,37 +2327,40 @@ def available_professionals(business_id):
     try:
         # ✅ VALIDAÇÃO: Verifica horário de funcionamento primeiro
         is_valid, error_msg = validate_business_hours(business_id, start_str)
-        print(f"🔍 DEBUG - Horário válido: {is_valid}, Erro: {error_msg}")
-        
+
         if not is_valid:
             return jsonify({"error": error_msg, "available_professionals": []}), 200
 
         start = datetime.fromisoformat(start_str.replace('Z', '+00:00'))
-        print(f"🔍 DEBUG - start datetime: {start}")
 
-        # Buscar serviço
-        svc = supabase.table("services") \
-            .select("duration_minutes") \
-            .eq("id", svc_id) \
-            .single() \
-            .execute().data
+        # Serviço, vínculos e profissionais do negócio não dependem entre si. Os
+        # profissionais vêm todos (poucas dezenas por negócio) para a consulta sair
+        # em paralelo com a dos vínculos, em vez de esperar os ids para um .in_()
+        res = run_queries({
+            "svc": lambda: supabase.table("services")
+                .select("duration_minutes")
+                .eq("id", svc_id)
+                .maybe_single()
+                .execute(),
+            "link": lambda: supabase.table("professional_services")
+                .select("professional_id")
+                .eq("service_id", svc_id)
+                .execute().data,
+            "pros": lambda: supabase.table("professionals")
+                .select("id, name")
+                .eq("business_id", business_id)
+                .execute().data
+        })
+
+        svc = res["svc"].data if res["svc"] else None
 
         if not svc:
             return jsonify({"error": "Serviço não existe", "available_professionals": []}), 404
 
-        print(f"🔍 DEBUG - Serviço encontrado: {svc}")
-
         end = start + timedelta(minutes=svc["duration_minutes"])
-        print(f"🔍 DEBUG - end datetime: {end}")
-
-        # Buscar profissionais que fazem este serviço
-        link = supabase.table("professional_services") \
-            .select("professional_id") \
-            .eq("service_id", svc_id) \
-            .execute().data
 
-        prof_ids = [l["professional_id"] for l in link]
-        print(f"🔍 DEBUG - Profissionais do serviço: {prof_ids}")
+        # Profissionais que fazem este serviço
+        prof_ids = {l["professional_id"] for l in res["link"]}
 
         if not prof_ids:
             return jsonify({"error": "Nenhum profissional cadastrado para este serviço", "available_professionals": []}), 200
@@ -850,44 +2373,166 @@ def available_professionals(business_id):
             .gt("end_time", start.isoformat()) \
             .execute().data
 
-        print(f"🔍 DEBUG - Agendamentos conflitantes: {busy}")
-
         # Exclui o próprio agendamento da checagem de conflitos
         if appt_id:
             busy = [b for b in busy if str(b["id"]) != str(appt_id)]
-            print(f"🔍 DEBUG - Após excluir agendamento atual: {busy}")
 
         busy_ids = {b["professional_id"] for b in busy}
-        print(f"🔍 DEBUG - IDs dos profissionais ocupados: {busy_ids}")
-
-        # Buscar todos os profissionais do serviço
-        pros = supabase.table("professionals") \
-            .select("id, name") \
-            .eq("business_id", business_id) \
-            .in_("id", prof_ids) \
-            .execute().data
 
-        print(f"🔍 DEBUG - Todos profissionais: {pros}")
+        # Todos os profissionais do serviço
+        pros = [p for p in res["pros"] if p["id"] in prof_ids]
 
         # Filtrar apenas os livres
         free = [p for p in pros if p["id"] not in busy_ids]
-        print(f"🔍 DEBUG - Profissionais livres: {free}")
+
+        trace_annotate(candidates=len(pros), busy=len(busy_ids), free=len(free))
 
         # ✅ RETORNO CORRETO: Estrutura que o frontend espera
         return jsonify({"available_professionals": free}), 200
 
     except Exception as e:
-        print(f"❌ ERRO: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        app.logger.exception("Falha ao buscar disponíveis")
         return jsonify({"error": "Falha ao buscar disponíveis", "details": str(e), "available_professionals": []}), 500
 
+@app.route("/api/available-slots", methods=["GET"])
+@auth_required
+@rate_limited(4)
+@query_budget(4)
+def available_slots(business_id):
+    """Todos os horários livres de um dia para um serviço, com os profissionais livres em cada um"""
+    svc_id = request.args.get("service_id")
+    date_str = request.args.get("date")
+    only_prof = request.args.get("professional_id")  # opcional
+
+    if not svc_id or not date_str:
+        return jsonify({"error": "service_id e date obrigatórios", "slots": []}), 400
+
+    try:
+        day = datetime.strptime(date_str, "%Y-%m-%d").date()
+        step = int(request.args.get("step") or SLOT_STEP_MINUTES)
+    except ValueError:
+        return jsonify({"error": "date (YYYY-MM-DD) ou step inválido", "slots": []}), 400
+
+    if step <= 0:
+        return jsonify({"error": "step deve ser positivo", "slots": []}), 400
+
+    try:
+        settings = get_business_settings(business_id)
+        local_tz = settings["tz"]
+        hours = settings["hours"].get(WEEKDAY_NAMES[day.weekday()])
+
+        # Dia fechado / sem configuração: reaproveita a mensagem da validação
+        if not hours or not hours["is_open"] or not hours["start"] or not hours["end"]:
+            _, error_msg = check_business_hours(settings, datetime.combine(day, datetime.min.time()))
+            return jsonify({"error": error_msg, "slots": []}), 200
+
+        # Janela do expediente em UTC (aritmética segura em dias de troca de horário)
+        open_at = local_tz.localize(datetime.combine(day, hours["start"])).astimezone(dt_timezone.utc)
+        close_at = local_tz.localize(datetime.combine(day, hours["end"])).astimezone(dt_timezone.utc)
+
+        # Tudo que o cálculo precisa, em paralelo; os agendamentos do dia numa única consulta
+        res = run_queries({
+            "svc": lambda: supabase.table("services")
+                .select("duration_minutes")
+                .eq("id", svc_id)
+                .eq("business_id", business_id)
+                .maybe_single()
+                .execute(),
+            "link": lambda: supabase.table("professional_services")
+                .select("professional_id")
+                .eq("service_id", svc_id)
+                .execute().data,
+            "pros": lambda: supabase.table("professionals")
+                .select("id, name")
+                .eq("business_id", business_id)
+                .order("name")
+                .execute().data,
+            "appts": lambda: supabase.table("appointments")
+                .select("professional_id, start_time, end_time")
+                .eq("business_id", business_id)
+                .lt("start_time", close_at.isoformat())
+                .gt("end_time", open_at.isoformat())
+                .execute().data
+        })
+
+        # maybe_single devolve None (em vez de erro) quando o serviço não existe ou é de outro negócio
+        svc = res["svc"].data if res["svc"] else None
+
+        if not svc:
+            return jsonify({"error": "Serviço não existe", "slots": []}), 404
+
+        duration = timedelta(minutes=svc["duration_minutes"])
+
+        prof_ids = {l["professional_id"] for l in res["link"]}
+
+        if only_prof:
+            prof_ids &= {only_prof}
+
+        pros = [p for p in res["pros"] if p["id"] in prof_ids]
+
+        if not pros:
+            return jsonify({"error": "Nenhum profissional cadastrado para este serviço", "slots": []}), 200
+
+        busy = {p["id"]: [] for p in pros}
+
+        for a in res["appts"]:
+            if a["professional_id"] in busy:
+                busy[a["professional_id"]].append((parse_timestamp(a["start_time"]), parse_timestamp(a["end_time"])))
+
+        busy = {pid: merge_intervals(intervals) for pid, intervals in busy.items()}
+
+        # Varredura: candidatos em ordem crescente, um ponteiro por profissional
+        cursor = {p["id"]: 0 for p in pros}
+        now = datetime.now(dt_timezone.utc)
+        slots = []
+
+        start = open_at
+        while start + duration <= close_at:
+            end = start + duration
+
+            if start >= now:
+                free = []
+
+                for p in pros:
+                    intervals = busy[p["id"]]
+                    i = cursor[p["id"]]
+
+                    while i < len(intervals) and intervals[i][1] <= start:
+                        i += 1
+
+                    cursor[p["id"]] = i
+
+                    if i == len(intervals) or intervals[i][0] >= end:
+                        free.append(p)
+
+                if free:
+                    slots.append({
+                        "start_time": start.astimezone(local_tz).isoformat(),
+                        "end_time": end.astimezone(local_tz).isoformat(),
+                        "available_professionals": free
+                    })
+
+            start += timedelta(minutes=step)
+
+        return jsonify({
+            "date": day.isoformat(),
+            "service_id": svc_id,
+            "duration": svc["duration_minutes"],
+            "step": step,
+            "slots": slots
+        }), 200
+
+    except Exception as e:
+        return jsonify({"error": "Falha ao calcular horários", "details": str(e), "slots": []}), 500
+
 # ------------------
 # Horários de Funcionamento (Opcional)
 # ------------------
 
 @app.route("/api/business-hours", methods=["GET"])
 @auth_required
+@rate_limited(1)
+@query_budget(1)
 def get_business_hours(business_id):
     """Busca horários de funcionamento do negócio"""
     try:
@@ -909,8 +2554,68 @@ def get_business_hours(business_id):
     except Exception as e:
         return jsonify({"error": "Falha ao buscar horários", "details": str(e)}), 500
 
+@app.route("/api/business-hours", methods=["PUT"])
+@auth_required
+@rate_limited(1)
+@query_budget(1)
+def update_business_hours(business_id):
+    """Grava os horários de funcionamento (lista de dias) e renova o cache de configurações"""
+    days = request.get_json(force=True)
+
+    if not isinstance(days, list) or not days:
+        return jsonify({"error": "Envie a lista de dias com day_of_week"}), 400
+
+    if not all(isinstance(d, dict) for d in days):
+        return jsonify({"error": "Cada dia deve ser um objeto com day_of_week"}), 400
+
+    if any(d.get("day_of_week") not in WEEKDAY_NAMES for d in days):
+        return jsonify({"error": "day_of_week inválido"}), 400
+
+    # O upsert não aceita o mesmo dia duas vezes no mesmo comando
+    if len({d["day_of_week"] for d in days}) != len(days):
+        return jsonify({"error": "day_of_week repetido"}), 400
+
+    rows = []
+
+    for d in days:
+        day = d["day_of_week"]
+        is_open = bool(d.get("is_open", False))
+        start, end = _parse_hhmm(d.get("start_time")), _parse_hhmm(d.get("end_time"))
+
+        if (d.get("start_time") and start is None) or (d.get("end_time") and end is None):
+            return jsonify({"error": f"{DAY_NAMES_PT[day]}: horário inválido (use HH:MM)"}), 400
+
+        if is_open and (start is None or end is None):
+            return jsonify({"error": f"{DAY_NAMES_PT[day]}: start_time e end_time são obrigatórios quando aberto"}), 400
+
+        # check_business_hours não trata expediente que passa da meia-noite
+        if is_open and start >= end:
+            return jsonify({"error": f"{DAY_NAMES_PT[day]}: start_time deve ser antes de end_time"}), 400
+
+        rows.append({
+            "business_id": business_id,
+            "day_of_week": day,
+            "is_open": is_open,
+            "start_time": start.strftime("%H:%M:%S") if start else None,
+            "end_time": end.strftime("%H:%M:%S") if end else None
+        })
+
+    try:
+        saved = supabase.table("business_hours") \
+            .upsert(rows, on_conflict="business_id,day_of_week") \
+            .execute().data
+
+        invalidate_business_settings(business_id)
+
+        return jsonify(saved), 200
+
+    except Exception as e:
+        return jsonify({"error": "Falha ao salvar horários", "details": str(e)}), 500
+
 @app.route("/api/business-hours/validate", methods=["POST"])
 @auth_required
+@rate_limited(1)
+@query_budget(0)
 def validate_appointment_time(business_id):
     """Valida se um horário específico está dentro do funcionamento"""
     data = request.get_json(force=True)
@@ -930,6 +2635,17 @@ def validate_appointment_time(business_id):
     except Exception as e:
         return jsonify({"error": "Falha na validação", "details": str(e)}), 500
 
+# ------------------
+# Manutenção (flask --app app <comando>)
+# ------------------
+
+@app.cli.command("rebuild-rollups")
+@click.option("--business-id", default=None, help="Recalcula apenas este negócio")
+def rebuild_rollups_command(business_id):
+    """Recalcula appointment_daily_rollups a partir de appointments (backfill)"""
+    rows = supabase.rpc("rebuild_appointment_rollups", {"p_business_id": business_id}).execute().data
+    click.echo(f"Rollups reconstruídos: {rows} dia(s)")
+
 # ------------------
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
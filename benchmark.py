@@ -0,0 +1,554 @@
+"""
+Benchmark offline da API Fluxo
+
+Sobe o app.py contra o FakeSupabase (em memória, latência por chamada
+injetável), semeia um negócio realista e mede throughput e p50/p95/p99 dos
+endpoints principais. A saída é JSON, para comparar execuções:
+
+    python benchmark.py --appointments 200000 --latency-ms 5 --output bench.json
+
+Com --check-budgets, chama cada rota uma vez (caches aquecidos) e sai com
+código 1 se alguma fizer mais round-trips ao Supabase que o @query_budget
+declarado no app.py:
+
+    python benchmark.py --appointments 2000 --check-budgets
+
+(o pytest roda a mesma verificação em test_query_budgets.py)
+
+Com --serialization, mede nas maiores respostas (agendamentos, profissionais
+com serviços, dashboard) a CPU de serialização (json padrão do Flask x orjson)
+e os bytes na rede sem compressão, com gzip e com brotli:
+
+    python benchmark.py --appointments 200000 --serialization
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+
+import pytz
+
+from fake_supabase import FakeSupabase
+
+BUSINESS_ID = "00000000-0000-0000-0000-00000000b001"
+USER_ID = "00000000-0000-0000-0000-00000000a001"
+JWT_SECRET = "benchmark-jwt-secret-com-pelo-menos-32-bytes"
+TIMEZONE = "America/Sao_Paulo"
+OPEN_HOUR, CLOSE_HOUR = 8, 20
+
+SCENARIO_NAMES = ["dashboard_stats", "available_professionals", "available_slots", "get_appointments", "create_appointment"]
+
+
+def rebuild_rollups(client, p_business_id=None):
+    """Versão Python de rebuild_appointment_rollups (o fake não roda triggers)"""
+    tzs = {b["id"]: pytz.timezone(b.get("timezone") or TIMEZONE) for b in client.tables.get("businesses", [])}
+    prices = {s["id"]: s.get("price") or 0 for s in client.tables.get("services", [])}
+    agg = {}
+
+    for a in client.tables.get("appointments", []):
+        if p_business_id and a["business_id"] != p_business_id:
+            continue
+        start = datetime.fromisoformat(a["start_time"])
+        start = start if start.tzinfo else start.replace(tzinfo=timezone.utc)
+        day = start.astimezone(tzs[a["business_id"]]).date().isoformat()
+        r = agg.setdefault((a["business_id"], day), {
+            "business_id": a["business_id"], "day": day,
+            "appointment_count": 0, "revenue": 0, "service_counts": {}
+        })
+        key = str(a["service_id"])
+        r["appointment_count"] += 1
+        r["revenue"] += prices.get(a["service_id"], 0)
+        r["service_counts"][key] = r["service_counts"].get(key, 0) + 1
+
+    rows = client.tables.setdefault("appointment_daily_rollups", [])
+    rows[:] = [r for r in rows if p_business_id and r["business_id"] != p_business_id] + list(agg.values())
+    client._changed("appointment_daily_rollups")
+    return len(agg)
+
+
+def dashboard_new_clients(client, p_business_id, p_since):
+    """Versão Python da RPC dashboard_new_clients"""
+    since = datetime.fromisoformat(p_since)
+    before, after = set(), set()
+
+    for a in client.tables.get("appointments", []):
+        if a["business_id"] != p_business_id or not a.get("customer_phone"):
+            continue
+        start = datetime.fromisoformat(a["start_time"])
+        start = start if start.tzinfo else start.replace(tzinfo=timezone.utc)
+        (after if start >= since else before).add(a["customer_phone"])
+
+    return len(after - before)
+
+
+def appointment_id(n):
+    """Id (uuid, como no banco) do n-ésimo agendamento semeado"""
+    return str(uuid.UUID(int=n + 1))
+
+
+def build_fake(professionals=50, appointments=200_000, services=20, latency_ms=0.0, seed=42):
+    """Semeia um negócio com profissionais, serviços, horários e histórico de agendamentos"""
+    rnd = random.Random(seed)
+    fake = FakeSupabase(latency=latency_ms / 1000.0)
+    tz = pytz.timezone(TIMEZONE)
+
+    fake.rpcs["rebuild_appointment_rollups"] = rebuild_rollups
+    fake.rpcs["dashboard_new_clients"] = dashboard_new_clients
+    fake.seed("businesses", [{"id": BUSINESS_ID, "name": "Salão Benchmark", "timezone": TIMEZONE}])
+    fake.seed("profiles", [{"id": USER_ID, "business_id": BUSINESS_ID}])
+    fake.seed("business_hours", [
+        {
+            "business_id": BUSINESS_ID,
+            "day_of_week": day,
+            "is_open": day != "sunday",
+            "start_time": None if day == "sunday" else f"{OPEN_HOUR:02d}:00:00",
+            "end_time": None if day == "sunday" else f"{CLOSE_HOUR:02d}:00:00"
+        }
+        for day in ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+    ])
+
+    svc_rows = [
+        {
+            "id": f"svc-{i:03d}",
+            "business_id": BUSINESS_ID,
+            "name": f"Serviço {i}",
+            "price": float(rnd.choice([30, 45, 60, 80, 120, 150])),
+            "duration_minutes": rnd.choice([30, 45, 60])
+        }
+        for i in range(services)
+    ]
+    fake.seed("services", svc_rows)
+
+    pro_rows = [{"id": f"pro-{i:03d}", "business_id": BUSINESS_ID, "name": f"Profissional {i:03d}"} for i in range(professionals)]
+    fake.seed("professionals", pro_rows)
+
+    offers = {p["id"]: rnd.sample(svc_rows, k=min(len(svc_rows), 5)) for p in pro_rows}
+    fake.seed("professional_services", [
+        {"professional_id": pid, "service_id": s["id"]} for pid, svcs in offers.items() for s in svcs
+    ])
+
+    # Agenda: até um atendimento por hora cheia por profissional, nunca sobrepostos
+    per_day = max(1, min(CLOSE_HOUR - OPEN_HOUR, round(appointments / max(1, professionals) / 600)))
+    today = date.today()
+    day = today + timedelta(days=60)
+    rows = []
+    phones = [f"55119{n:08d}" for n in range(max(100, appointments // 10))]
+
+    while len(rows) < appointments:
+        if day.weekday() != 6:
+            for p in pro_rows:
+                for hour in rnd.sample(range(OPEN_HOUR, CLOSE_HOUR), k=per_day):
+                    svc = rnd.choice(offers[p["id"]])
+                    start = tz.localize(datetime(day.year, day.month, day.day, hour)).astimezone(timezone.utc)
+                    rows.append({
+                        "id": appointment_id(len(rows)),
+                        "business_id": BUSINESS_ID,
+                        "professional_id": p["id"],
+                        "service_id": svc["id"],
+                        "customer_name": f"Cliente {len(rows)}",
+                        "customer_phone": rnd.choice(phones),
+                        "start_time": start.isoformat(),
+                        "end_time": (start + timedelta(minutes=svc["duration_minutes"])).isoformat()
+                    })
+                    if len(rows) >= appointments:
+                        break
+                if len(rows) >= appointments:
+                    break
+        day -= timedelta(days=1)
+
+    fake.seed("appointments", rows)
+    rebuild_rollups(fake)
+
+    ctx = {"rnd": rnd, "services": svc_rows, "professionals": pro_rows, "offers": offers, "tz": tz}
+    return fake, ctx
+
+
+def load_app(fake):
+    """Importa o app.py com variáveis fictícias e troca o cliente Supabase pelo fake"""
+    os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+    os.environ.setdefault("SUPABASE_KEY", "bench.anon.key")
+    os.environ.setdefault("SUPABASE_SERVICE_KEY", "bench.service.key")
+    os.environ.setdefault("SUPABASE_JWT_SECRET", JWT_SECRET)
+    os.environ.setdefault("TRACE_SAMPLE_RATE", "0")
+    os.environ.setdefault("TRACE_SLOW_MS", "1e9")
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "0")  # o benchmark mede a API, não o limite por negócio
+
+    import app as app_module
+
+    app_module.supabase = app_module.InstrumentedClient(fake)
+    app_module.invalidate_profile_cache()
+    app_module.invalidate_business_settings()
+    return app_module
+
+
+def auth_headers(user_id=USER_ID):
+    import jwt
+
+    token = jwt.encode(
+        {"sub": user_id, "aud": "authenticated", "role": "authenticated", "exp": int(time.time()) + 24 * 3600},
+        os.environ.get("SUPABASE_JWT_SECRET", JWT_SECRET),
+        algorithm="HS256"
+    )
+    return {"Authorization": f"Bearer {token}"}
+
+
+def _future_start(ctx, rnd, offset_days=0):
+    """Horário aleatório (local, sem fuso) dentro do expediente de um dia útil futuro"""
+    while True:
+        day = date.today() + timedelta(days=offset_days + rnd.randint(1, 45))
+        if day.weekday() != 6:
+            break
+    minute = rnd.randrange(OPEN_HOUR * 60, (CLOSE_HOUR - 1) * 60, 15)
+    return datetime(day.year, day.month, day.day, minute // 60, minute % 60)
+
+
+def make_request(name, ctx, rnd):
+    """(método, url, kwargs) de uma requisição sintética do cenário"""
+    if name == "dashboard_stats":
+        return "get", "/api/dashboard/stats", {}
+
+    if name == "available_professionals":
+        svc = rnd.choice(ctx["services"])
+        return "get", f"/api/available-professionals?service_id={svc['id']}&start_time={_future_start(ctx, rnd).isoformat()}", {}
+
+    if name == "available_slots":
+        svc = rnd.choice(ctx["services"])
+        return "get", f"/api/available-slots?service_id={svc['id']}&date={_future_start(ctx, rnd).date().isoformat()}", {}
+
+    if name == "get_appointments":
+        return "get", "/api/appointments", {}
+
+    if name == "create_appointment":
+        pro = rnd.choice(ctx["professionals"])
+        svc = rnd.choice(ctx["offers"][pro["id"]])
+        return "post", "/api/appointments", {"json": {
+            "professional_id": pro["id"],
+            "service_id": svc["id"],
+            "customer_name": "Cliente Benchmark",
+            "customer_phone": f"55119{rnd.randrange(10 ** 8):08d}",
+            "start_time": _future_start(ctx, rnd, offset_days=60).isoformat()
+        }}
+
+    raise ValueError(f"cenário desconhecido: {name}")
+
+
+def percentile(sorted_values, pct):
+    """Percentil por posto mais próximo (sorted_values já ordenado)"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def run_scenario(app_module, fake, ctx, name, requests_count, warmup=5, concurrency=1, seed=0):
+    """Executa um cenário e devolve as estatísticas de latência/throughput"""
+    headers = auth_headers()
+    rnd = random.Random(seed)
+    plans = [make_request(name, ctx, rnd) for _ in range(warmup + requests_count)]
+
+    client = app_module.app.test_client()
+    for method, url, kwargs in plans[:warmup]:
+        getattr(client, method)(url, headers=headers, **kwargs)
+
+    latencies = []
+    statuses = {}
+    calls_before = fake.calls
+
+    def one(plan):
+        method, url, kwargs = plan
+        c = app_module.app.test_client()
+        started = time.perf_counter()
+        resp = getattr(c, method)(url, headers=headers, **kwargs)
+        resp.get_data()
+        return time.perf_counter() - started, resp.status_code
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(one, plans[warmup:]))
+    else:
+        outcomes = [one(plan) for plan in plans[warmup:]]
+    elapsed = time.perf_counter() - started
+
+    for latency, status in outcomes:
+        latencies.append(latency * 1000)
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    latencies.sort()
+    return {
+        "requests": requests_count,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 4),
+        "throughput_rps": round(requests_count / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "max_ms": round(latencies[-1], 3),
+        "supabase_calls_per_request": round((fake.calls - calls_before) / requests_count, 2),
+        "status_counts": statuses
+    }
+
+
+def budget_requests(ctx, debug_token):
+    """(endpoint, método, url, kwargs) de uma chamada bem-sucedida por rota; escritas destrutivas por último"""
+    pro = ctx["professionals"][0]
+    svc = ctx["offers"][pro["id"]][0]
+    other = ctx["professionals"][1]
+    other_svc = ctx["offers"][other["id"]][0]
+
+    day = date.today() + timedelta(days=70)
+    while day.weekday() == 6:
+        day += timedelta(days=1)
+
+    def at(hour, extra_days=0):
+        return datetime(day.year, day.month, day.day, hour) + timedelta(days=extra_days)
+
+    def booking(p, s, start):
+        return {
+            "professional_id": p["id"],
+            "service_id": s["id"],
+            "customer_name": "Cliente Orçamento",
+            "customer_phone": "5511900000000",
+            "start_time": start.isoformat()
+        }
+
+    hours = [
+        {"day_of_week": d, "is_open": d != "sunday",
+         "start_time": None if d == "sunday" else f"{OPEN_HOUR:02d}:00:00",
+         "end_time": None if d == "sunday" else f"{CLOSE_HOUR:02d}:00:00"}
+        for d in ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+    ]
+
+    return [
+        ("index", "get", "/", {}),
+        ("health", "get", "/api/health", {}),
+        ("metrics", "get", "/metrics", {}),
+        ("debug_traces", "get", "/api/debug/traces", {"headers": {"Authorization": f"Bearer {debug_token}"}}),
+        ("on_signup", "post", "/api/on-signup", {"json": {
+            "user_id": "00000000-0000-0000-0000-00000000a002", "full_name": "Dona", "business_name": "Outro Salão"
+        }}),
+        ("dashboard_stats", "get", "/api/dashboard/stats", {}),
+        ("list_services", "get", "/api/services", {}),
+        ("create_service", "post", "/api/services", {"json": {"name": "Novo", "price": 50, "duration": 30}}),
+        ("update_service", "put", f"/api/services/{svc['id']}", {"json": {
+            "name": svc["name"], "price": svc["price"], "duration": svc["duration_minutes"]
+        }}),
+        ("list_professionals", "get", "/api/professionals", {}),
+        ("create_professional", "post", "/api/professionals", {"json": {"name": "Nova Profissional"}}),
+        ("update_professional", "put", f"/api/professionals/{pro['id']}", {"json": {"name": pro["name"]}}),
+        ("add_prof_service", "post", f"/api/professionals/{other['id']}/services", {"json": {"service_id": svc["id"]}}),
+        ("remove_prof_service", "delete", f"/api/professionals/{other['id']}/services/{svc['id']}", {}),
+        ("get_appointments", "get", "/api/appointments", {}),
+        ("export_appointments", "get", "/api/appointments/export?format=ndjson", {}),
+        ("get_appointment_by_id", "get", f"/api/appointments/{appointment_id(0)}", {}),
+        ("available_professionals", "get",
+         f"/api/available-professionals?service_id={svc['id']}&start_time={at(10).isoformat()}", {}),
+        ("available_slots", "get", f"/api/available-slots?service_id={svc['id']}&date={day.isoformat()}", {}),
+        ("create_appointment", "post", "/api/appointments", {"json": booking(pro, svc, at(10))}),
+        ("update_appointment", "put", f"/api/appointments/{appointment_id(0)}", {"json": booking(pro, svc, at(14))}),
+        ("batch_appointments", "post", "/api/appointments/batch", {"json": {"appointments": [
+            booking(other, other_svc, at(10, 1)),
+            {**booking(pro, svc, at(16)), "id": appointment_id(0)}
+        ]}}),
+        ("delete_appointment", "delete", f"/api/appointments/{appointment_id(1)}", {}),
+        ("get_business_hours", "get", "/api/business-hours", {}),
+        ("validate_appointment_time", "post", "/api/business-hours/validate", {"json": {"start_time": at(11).isoformat()}}),
+        ("update_business_hours", "put", "/api/business-hours", {"json": hours}),
+        ("delete_service", "delete", f"/api/services/{ctx['services'][-1]['id']}", {}),
+        ("delete_professional", "delete", f"/api/professionals/{ctx['professionals'][-1]['id']}", {})
+    ]
+
+
+def check_query_budgets(app_module, fake, ctx):
+    """Confere os round-trips de cada rota contra o @query_budget; devolve (relatório, falhas)"""
+    fake.rpcs.setdefault("handle_new_user", lambda client, **params: None)
+    app_module.DEBUG_API_TOKEN = app_module.DEBUG_API_TOKEN or "benchmark-debug-token"
+
+    headers = auth_headers()
+    client = app_module.app.test_client()
+    client.get("/api/dashboard/stats", headers=headers)  # aquece perfil e configurações
+    app_module.QUERY_BUDGET_DEBUG = True
+
+    plans = budget_requests(ctx, app_module.DEBUG_API_TOKEN)
+    report, failures = {}, []
+
+    for endpoint, method, url, kwargs in plans:
+        resp = getattr(client, method)(url, **{"headers": headers, **kwargs})
+        resp.get_data()
+        header = resp.headers.get("X-Supabase-Queries")
+        used = int(header) if header is not None else None
+        budget = app_module.route_query_budget(endpoint)
+        report[endpoint] = {"status": resp.status_code, "queries": used, "budget": budget}
+
+        if resp.status_code >= 400:
+            failures.append(f"{endpoint}: HTTP {resp.status_code} (a chamada de referência deve ter sucesso)")
+        elif used is None:
+            failures.append(f"{endpoint}: resposta sem X-Supabase-Queries (consultas não medidas)")
+        elif budget is None:
+            failures.append(f"{endpoint}: sem @query_budget")
+        elif used > budget:
+            failures.append(f"{endpoint}: {used} consultas, orçamento {budget}")
+
+    covered = {p[0] for p in plans}
+    for rule in app_module.app.url_map.iter_rules():
+        if rule.endpoint != "static" and rule.endpoint not in covered:
+            failures.append(f"{rule.endpoint}: sem chamada de referência em budget_requests()")
+
+    return report, failures
+
+
+def serialization_requests():
+    """(nome, url) das respostas grandes: uma página cheia, profissionais com services(*) e o dashboard de hoje"""
+    return [
+        ("get_appointments", "/api/appointments"),
+        ("list_professionals", "/api/professionals"),
+        ("dashboard_stats", f"/api/dashboard/stats?date={date.today().isoformat()}")
+    ]
+
+
+def _cpu_ms(fn, rounds):
+    """CPU (process_time) média por execução, em ms, e o último resultado"""
+    started = time.process_time()
+    for _ in range(rounds):
+        result = fn()
+    return (time.process_time() - started) * 1000 / rounds, result
+
+
+def measure_serialization(app_module, rounds=50):
+    """CPU e bytes por resposta: providers JSON isolados, compressão isolada e a requisição inteira"""
+    from flask.json.provider import DefaultJSONProvider
+
+    flask_app = app_module.app
+    active = flask_app.json
+    providers = {"default": DefaultJSONProvider(flask_app)}
+    if app_module.orjson is not None:
+        providers["orjson"] = app_module.OrjsonProvider(flask_app)
+    encodings = ["gzip"] + (["br"] if app_module.brotli is not None else [])
+
+    headers = auth_headers()
+    client = flask_app.test_client()
+    report = {}
+
+    for name, url in serialization_requests():
+        payload = client.get(url, headers={**headers, "Accept-Encoding": "identity"}).get_json()
+        items = payload if isinstance(payload, list) else payload.get("upcomingAppointments", [])
+        entry = {"items": len(items), "json": {}, "compression": {}, "end_to_end": {}}
+
+        for provider_name, provider in providers.items():
+            cpu, body = _cpu_ms(lambda: provider.response(payload).get_data(), rounds)
+            entry["json"][provider_name] = {"cpu_ms": round(cpu, 3), "bytes": len(body)}
+
+        body = active.response(payload).get_data()
+        for encoding in encodings:
+            cpu, compressed = _cpu_ms(lambda: app_module.compress_body(body, encoding), rounds)
+            entry["compression"][encoding] = {
+                "cpu_ms": round(cpu, 3),
+                "bytes": len(compressed),
+                "ratio": round(len(compressed) / len(body), 3)
+            }
+
+        # Antes (json padrão, sem compressão) x provider ativo com cada codificação
+        active_name = "orjson" if isinstance(active, app_module.OrjsonProvider) else "default"
+        configs = [("default", "identity")] + [(active_name, e) for e in ["identity"] + encodings]
+        for provider_name, encoding in configs:
+            flask_app.json = providers[provider_name]
+            try:
+                cpu, resp = _cpu_ms(lambda: client.get(url, headers={**headers, "Accept-Encoding": encoding}), rounds)
+            finally:
+                flask_app.json = active
+            entry["end_to_end"][f"{provider_name}+{encoding}"] = {
+                "cpu_ms": round(cpu, 3),
+                "wire_bytes": len(resp.get_data()),
+                "content_encoding": resp.headers.get("Content-Encoding", "identity")
+            }
+
+        report[name] = entry
+
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--professionals", type=int, default=50)
+    parser.add_argument("--services", type=int, default=20)
+    parser.add_argument("--appointments", type=int, default=200_000)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="latência injetada por chamada ao Supabase")
+    parser.add_argument("--requests", type=int, default=200, help="requisições medidas por cenário")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--scenarios", default=",".join(SCENARIO_NAMES))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="arquivo JSON de saída (padrão: stdout)")
+    parser.add_argument("--check-budgets", action="store_true", help="só confere os @query_budget das rotas")
+    parser.add_argument("--serialization", action="store_true",
+                        help="só mede serialização JSON e compressão das maiores respostas")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+
+    seed_started = time.perf_counter()
+    fake, ctx = build_fake(args.professionals, args.appointments, args.services, args.latency_ms, args.seed)
+    seed_elapsed = time.perf_counter() - seed_started
+    app_module = load_app(fake)
+
+    if args.check_budgets:
+        report, failures = check_query_budgets(app_module, fake, ctx)
+        for endpoint, r in report.items():
+            print(f"{endpoint}: {r['queries']}/{r['budget']} (HTTP {r['status']})", file=sys.stderr)
+        for failure in failures:
+            print(f"FALHA {failure}", file=sys.stderr)
+        sys.exit(1 if failures else 0)
+
+    if args.serialization:
+        results = {"serialization": measure_serialization(app_module, args.requests)}
+        for name, r in results["serialization"].items():
+            smallest = min(r["end_to_end"].items(), key=lambda kv: kv[1]["wire_bytes"])
+            print(f"{name}: {r['items']} itens, json " +
+                  ", ".join(f"{p}={v['cpu_ms']}ms/{v['bytes']}B" for p, v in r["json"].items()) +
+                  f"; na rede: default+identity={r['end_to_end']['default+identity']['wire_bytes']}B "
+                  f"{smallest[0]}={smallest[1]['wire_bytes']}B", file=sys.stderr)
+    else:
+        results = {}
+        for i, name in enumerate(scenarios):
+            results[name] = run_scenario(
+                app_module, fake, ctx, name, args.requests, args.warmup, args.concurrency, seed=args.seed + i
+            )
+            print(f"{name}: p50={results[name]['p50_ms']}ms p95={results[name]['p95_ms']}ms "
+                  f"{results[name]['throughput_rps']} req/s", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "professionals": args.professionals,
+            "services": args.services,
+            "appointments": args.appointments,
+            "latency_ms": args.latency_ms,
+            "seed": args.seed,
+            "seed_elapsed_s": round(seed_elapsed, 2)
+        },
+        "results": results
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -1,113 +1,475 @@
+import os
+import queue
 import requests
+import threading
 import time
-from selenium import webdriver
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import NoSuchElementException
+from collections import deque
+from estado_conversas import criar_armazenamento
+from sessao_whatsapp import esperar_pronto, iniciar_sessao, verificar_sessao
+from transportes import Despachante, TransporteWebhook
+from fluxo_conversa import MaquinaConversa, montar_catalogo
 
 # --- Configurações e Variáveis Globais ---
 API_BASE_URL = "https://35d7-2804-d59-f728-ac00-9c12-976e-cbf6-3034.ngrok-free.app" # URL atualizada do ngrok
-conversas = {}
-driver = webdriver.Chrome()
+API_TOKEN = os.getenv("FLUXO_API_TOKEN", "").strip() # JWT do usuário do negócio (as rotas exigem Bearer); expira em ~1h
+# Com e-mail/senha do usuário do robô o token é renovado no Supabase Auth a cada 401
+API_EMAIL = os.getenv("FLUXO_API_EMAIL", "").strip()
+API_SENHA = os.getenv("FLUXO_API_SENHA", "")
+SUPABASE_URL = os.getenv("SUPABASE_URL", "").strip()
+SUPABASE_KEY = os.getenv("SUPABASE_KEY", "").strip() # anon key, a mesma do app.py
+API_TIMEOUT = (3.05, 10) # Segundos: (conexão, leitura)
+CATALOGO_TTL = int(os.getenv("CATALOGO_TTL", "60")) # Segundos que serviços/profissionais ficam em cache
+INTERVALO_FILA = 0.2 # Segundos entre as leituras da fila de mensagens no navegador
+INTERVALO_VARREDURA = 1.0 # Segundos entre as varreduras de conversas não lidas no #pane-side
+TEMPO_ABRIR_CONVERSA = 5 # Segundos máximos para a conversa clicada carregar
+INTERVALO_SAUDE = 5.0 # Segundos entre as atualizações do arquivo de saúde da sessão
+CHATBOT_TRANSPORTE = os.getenv("CHATBOT_TRANSPORTE", "selenium") # "selenium" (WhatsApp Web) ou "webhook"
+conversas = criar_armazenamento() # SQLite em CONVERSAS_DB (sobrevive a reinícios)
+driver = None # Criado em iniciar_sessao() no ponto de partida (importar o módulo não abre o Chrome)
 
-# --- Funções de Lógica (As mesmas que já testamos) ---
-def obter_servicos():
+# --- Detecção de Mensagens (MutationObserver no WhatsApp Web) ---
+# O observador roda dentro da página: cada mensagem recebida que aparece no DOM
+# entra em window.__fluxoFila com o data-id do WhatsApp (único por mensagem).
+# O Python só esvazia essa fila, com custo constante por leitura.
+OBSERVADOR_JS = """
+if (window.__fluxoObservador) { return false; }
+window.__fluxoFila = [];
+window.__fluxoVistos = new Set();
+
+function mensagensEm(no) {
+    if (no.nodeType !== 1) { return []; }
+    if (no.matches('.message-in')) { return [no]; }
+    return Array.from(no.querySelectorAll('.message-in'));
+}
+
+function idDaMensagem(el) {
+    var linha = el.closest('[data-id]') || el.querySelector('[data-id]');
+    return linha ? linha.getAttribute('data-id') : null;
+}
+
+// Mensagens já na tela antes do robô iniciar não são respondidas
+document.querySelectorAll('.message-in').forEach(function (el) {
+    var id = idDaMensagem(el);
+    if (id) { window.__fluxoVistos.add(id); }
+});
+
+window.__fluxoObservador = new MutationObserver(function (mutacoes) {
+    mutacoes.forEach(function (m) {
+        m.addedNodes.forEach(function (no) {
+            mensagensEm(no).forEach(function (el) {
+                var id = idDaMensagem(el);
+                var span = el.querySelector('span.selectable-text');
+                if (!id || !span || window.__fluxoVistos.has(id)) { return; }
+                window.__fluxoVistos.add(id);
+                window.__fluxoFila.push({id: id, texto: span.innerText});
+            });
+        });
+    });
+});
+window.__fluxoObservador.observe(document.body, {childList: true, subtree: true});
+return true;
+"""
+
+DRENAR_FILA_JS = "return window.__fluxoFila ? window.__fluxoFila.splice(0) : null;"
+
+def instalar_observador():
+    """Injeta o observador (não faz nada se ele já estiver na página)."""
+    return driver.execute_script(OBSERVADOR_JS)
+
+def drenar_mensagens():
+    """Retorna e remove as mensagens novas da fila ([{id, texto}, ...])."""
+    mensagens = driver.execute_script(DRENAR_FILA_JS)
+    if mensagens is None:
+        # A página recarregou e perdeu o observador: injeta de novo
+        instalar_observador()
+        return []
+    return mensagens
+
+def contato_da_mensagem(data_id):
+    """Extrai o contato do data-id ("false_5511999999999@c.us_3EB0...") ou None para grupos."""
+    partes = (data_id or "").split("_", 2)
+    if len(partes) < 3 or not partes[1].endswith("@c.us"):
+        return None
+    return partes[1]
+
+# --- Agendador de Conversas (todas as não lidas, em rodízio) ---
+LISTAR_NAO_LIDAS_JS = """
+var conversas = [];
+document.querySelectorAll('#pane-side [role="listitem"], #pane-side [role="row"]').forEach(function (linha) {
+    var selo = Array.from(linha.querySelectorAll('span[aria-label]')).find(function (el) {
+        return /unread|não lida/i.test(el.getAttribute('aria-label'));
+    });
+    var titulo = linha.querySelector('span[title]');
+    if (!selo || !titulo) { return; }
+    conversas.push({elemento: linha, titulo: titulo.getAttribute('title'), nao_lidas: parseInt(selo.innerText, 10) || 1});
+});
+return conversas;
+"""
+
+CONTATO_ABERTO_JS = """
+var linhas = document.querySelectorAll('#main [data-id]');
+return linhas.length ? linhas[linhas.length - 1].getAttribute('data-id') : null;
+"""
+
+TITULO_ABERTO_JS = """
+var titulo = document.querySelector('#main header span[title]');
+return titulo ? titulo.getAttribute('title') : null;
+"""
+
+CONVERSA_POR_TITULO_JS = """
+var titulo = arguments[0];
+var linhas = document.querySelectorAll('#pane-side [role="listitem"], #pane-side [role="row"]');
+return Array.from(linhas).find(function (linha) {
+    var el = linha.querySelector('span[title]');
+    return el && el.getAttribute('title') === titulo;
+}) || null;
+"""
+
+fila_conversas = deque() # Títulos das conversas não lidas aguardando a vez
+nao_lidas = {} # título -> {"elemento", "nao_lidas"} da última varredura
+pendentes = {} # contato -> mensagens que chegaram quando a conversa não estava aberta
+titulos = {} # contato -> título da conversa no #pane-side (para voltar a ela e responder)
+saida = queue.Queue() # (contato, texto) gerados pelos workers; só a thread do Selenium envia
+despachante = None
+contato_atual = None
+
+def varrer_nao_lidas():
+    """Coloca no fim da fila as conversas com selo de não lidas que ainda não estão nela."""
+    nao_lidas.clear()
+    for conversa in driver.execute_script(LISTAR_NAO_LIDAS_JS) or []:
+        nao_lidas[conversa["titulo"]] = conversa
+        if conversa["titulo"] not in fila_conversas:
+            fila_conversas.append(conversa["titulo"])
+
+def abrir_conversa(conversa):
+    """Clica na conversa e espera o painel #main mostrar mensagens de outro contato."""
+    anterior = driver.execute_script(CONTATO_ABERTO_JS)
+    driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", conversa["elemento"])
+    conversa["elemento"].click()
+    WebDriverWait(driver, TEMPO_ABRIR_CONVERSA).until(
+        lambda d: d.execute_script(CONTATO_ABERTO_JS) not in (None, anterior)
+    )
+    contato = contato_da_mensagem(driver.execute_script(CONTATO_ABERTO_JS))
+    if contato:
+        titulos[contato] = driver.execute_script(TITULO_ABERTO_JS) or conversa.get("titulo")
+    return contato
+
+def atender(contato, mensagens):
+    """Entrega as mensagens ao pool; as respostas voltam pela fila de saída."""
+    for mensagem in mensagens:
+        print(f"Nova mensagem de {contato}: '{mensagem['texto']}'")
+        despachante.entregar(contato, mensagem["texto"], lambda texto, c=contato: saida.put((c, texto)))
+
+def enviar_respostas_pendentes():
+    """Envia as respostas prontas, voltando à conversa do cliente quando outra estiver aberta."""
+    global contato_atual
+
+    while True:
+        try:
+            contato, texto = saida.get_nowait()
+        except queue.Empty:
+            return
+
+        if contato != contato_atual:
+            elemento = driver.execute_script(CONVERSA_POR_TITULO_JS, titulos.get(contato))
+            if elemento is None:
+                print(f"Conversa de {contato} não encontrada; resposta descartada.")
+                continue
+            atender_conversa_aberta() # Não mistura mensagens da conversa anterior com as da nova
+            contato_atual = abrir_conversa({"elemento": elemento})
+
+        if contato == contato_atual:
+            enviar_mensagem_whatsapp(texto)
+
+def separar_por_contato(mensagens):
+    por_contato = {}
+    for mensagem in mensagens:
+        contato = contato_da_mensagem(mensagem["id"])
+        if contato:
+            por_contato.setdefault(contato, []).append(mensagem)
+    return por_contato
+
+def atender_conversa_aberta():
+    """Responde o que chegou na conversa aberta; o resto espera a vez do seu contato."""
+    for contato, mensagens in separar_por_contato(drenar_mensagens()).items():
+        if contato == contato_atual:
+            atender(contato, mensagens)
+        else:
+            pendentes.setdefault(contato, []).extend(mensagens)
+
+def atender_proxima_conversa():
+    """Abre a próxima conversa não lida da fila e responde só as mensagens não lidas dela."""
+    global contato_atual
+
+    while fila_conversas:
+        conversa = nao_lidas.get(fila_conversas.popleft())
+        if conversa is None:
+            continue # Já foi lida (ou sumiu da lista) desde a varredura
+
+        atender_conversa_aberta() # Não mistura mensagens da conversa anterior com as da nova
+        contato_atual = abrir_conversa(conversa)
+        if contato_atual is None:
+            return
+
+        # Ao abrir a conversa o histórico inteiro entra no DOM (e na fila):
+        # só as últimas `nao_lidas` mensagens do contato são novas
+        por_contato = separar_por_contato(drenar_mensagens())
+        novas = por_contato.pop(contato_atual, [])[-conversa["nao_lidas"]:]
+        for contato, mensagens in por_contato.items():
+            pendentes.setdefault(contato, []).extend(mensagens)
+
+        atender(contato_atual, pendentes.pop(contato_atual, []) + novas)
+        return
+
+# --- Cliente da API (conexões reaproveitadas + cache do catálogo) ---
+def criar_sessao_api():
+    """Session com keep-alive, retentativas em GETs e o token da API."""
+    sessao = requests.Session()
+    retentativas = Retry(total=3, backoff_factor=0.3, status_forcelist=(429, 502, 503, 504), allowed_methods=frozenset({"GET"}))
+    adaptador = HTTPAdapter(max_retries=retentativas, pool_connections=2, pool_maxsize=10)
+    sessao.mount("https://", adaptador)
+    sessao.mount("http://", adaptador)
+    if API_TOKEN:
+        sessao.headers["Authorization"] = f"Bearer {API_TOKEN}"
+    return sessao
+
+sessao_api = criar_sessao_api()
+token_lock = threading.Lock()
+
+# versao é um hash do conteúdo (as conversas guardam só a versão, inclusive entre reinícios)
+catalogo = montar_catalogo([], [])
+catalogo_carregado = False
+catalogo_expira_em = 0
+catalogo_lock = threading.Lock() # Só um thread busca o catálogo por vez
+
+def renovar_token(token_recusado):
+    """Login do usuário do robô no Supabase Auth; True se há um token novo na sessao_api."""
+    with token_lock:
+        if sessao_api.headers.get("Authorization") != token_recusado:
+            return True # Outro thread já renovou enquanto este esperava
+        if not (API_EMAIL and API_SENHA and SUPABASE_URL and SUPABASE_KEY):
+            return False
+        try:
+            response = requests.post(
+                f"{SUPABASE_URL}/auth/v1/token",
+                params={"grant_type": "password"},
+                headers={"apikey": SUPABASE_KEY},
+                json={"email": API_EMAIL, "password": API_SENHA},
+                timeout=API_TIMEOUT
+            )
+        except Exception as e:
+            print(f"Erro ao renovar o token da API: {e}")
+            return False
+        if response.status_code != 200:
+            print(f"Supabase Auth recusou o login do robô ({response.status_code}).")
+            return False
+        sessao_api.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+        return True
+
+def requisitar_api(metodo, caminho, **kwargs):
+    """Requisição à API do Fluxo; num 401 renova o token (se configurado) e tenta de novo uma vez."""
+    token_usado = sessao_api.headers.get("Authorization")
+    response = sessao_api.request(metodo, f"{API_BASE_URL}{caminho}", timeout=API_TIMEOUT, **kwargs)
+    if response.status_code == 401:
+        if renovar_token(token_usado):
+            return sessao_api.request(metodo, f"{API_BASE_URL}{caminho}", timeout=API_TIMEOUT, **kwargs)
+        print(f"API recusou o token (401) em {caminho}: FLUXO_API_TOKEN expirou? "
+              "Configure FLUXO_API_EMAIL/FLUXO_API_SENHA para renovar sozinho.")
+    return response
+
+def buscar_api(caminho, params=None):
     try:
-        response = requests.get(f"{API_BASE_URL}/api/services")
+        response = requisitar_api("GET", caminho, params=params)
         return response.json() if response.status_code == 200 else None
-    except: return None
+    except Exception as e:
+        print(f"Erro ao consultar {caminho}: {e}")
+        return None
+
+def obter_catalogo():
+    """
+    Serviços e profissionais em cache por CATALOGO_TTL; se a API falhar, mantém o último catálogo bom.
+    Com o cache vencido, um thread atualiza e os demais seguem com o catálogo anterior.
+    """
+    global catalogo, catalogo_carregado, catalogo_expira_em
+
+    if time.time() < catalogo_expira_em:
+        return catalogo
+
+    # Antes do primeiro catálogo não há o que servir: espera quem estiver buscando
+    if not catalogo_lock.acquire(blocking=not catalogo_carregado):
+        return catalogo
+
+    try:
+        if time.time() < catalogo_expira_em:
+            return catalogo # Outro thread atualizou enquanto este esperava
+
+        servicos = buscar_api("/api/services")
+        profissionais = buscar_api("/api/professionals")
+
+        if servicos is not None and profissionais is not None:
+            if (servicos, profissionais) != (catalogo["servicos"], catalogo["profissionais"]):
+                # Catálogo novo (com índice serviço -> profissionais); quem já leu o antigo não é afetado
+                catalogo = montar_catalogo(servicos, profissionais)
+            catalogo_carregado = True
+            catalogo_expira_em = time.time() + CATALOGO_TTL
+
+        return catalogo
+    finally:
+        catalogo_lock.release()
+
+# --- Funções de Lógica (As mesmas que já testamos) ---
+def obter_servicos():
+    return obter_catalogo()["servicos"]
 
 def obter_profissionais():
+    return obter_catalogo()["profissionais"]
+
+def obter_horarios(servico_id, data, profissional_id=None):
+    """Horários livres do dia (GET /api/available-slots) ou None se a API falhar."""
+    params = {"service_id": servico_id, "date": data}
+    if profissional_id:
+        params["professional_id"] = profissional_id
+    resposta = buscar_api("/api/available-slots", params)
+    return None if resposta is None else resposta.get("slots", [])
+
+def criar_agendamento(agendamento):
+    """POST /api/appointments; devolve (status, corpo) -- (None, None) se a API não respondeu."""
     try:
-        response = requests.get(f"{API_BASE_URL}/api/professionals")
-        return response.json() if response.status_code == 200 else None
-    except: return None
+        response = requisitar_api("POST", "/api/appointments", json=agendamento)
+        return response.status_code, response.json()
+    except Exception as e:
+        print(f"Erro ao criar agendamento: {e}")
+        return None, None
 
 # --- Funções de Comunicação (Atualizadas e Robustas) ---
+CAIXA_DE_TEXTO_SELECTOR = "div[contenteditable='true'][data-tab='10']"
+
+# Insere o texto inteiro de uma vez no editor (quebras de linha incluídas) e
+# confere se ele chegou na caixa; false faz o Python cair na digitação
+INSERIR_TEXTO_JS = """
+var caixa = arguments[0], texto = arguments[1];
+caixa.focus();
+document.execCommand('selectAll', false, null);
+document.execCommand('delete', false, null);
+if (!document.execCommand('insertText', false, texto)) { return false; }
+var normalizar = function (t) { return t.replace(/\\s+/g, ' ').trim(); };
+return normalizar(caixa.innerText) === normalizar(texto);
+"""
+
+tempos_envio = deque(maxlen=500) # (método, milissegundos) dos últimos envios
+
+def digitar_mensagem(caixa_de_texto, texto):
+    """Caminho lento: uma chamada ao WebDriver por linha + SHIFT+ENTER."""
+    caixa_de_texto.clear()
+    for linha in texto.split('\n'):
+        caixa_de_texto.send_keys(linha)
+        caixa_de_texto.send_keys(Keys.SHIFT, Keys.ENTER)
+
 def enviar_mensagem_whatsapp(texto):
-    """Encontra a caixa de texto, digita e envia a mensagem."""
+    """Encontra a caixa de texto, insere a mensagem inteira por JS (ou digita, se falhar) e envia."""
+    inicio = time.perf_counter()
     try:
-        # Usando o seletor que testamos e funcionou!
-        caixa_de_texto_selector = "div[contenteditable='true'][data-tab='10']"
-        caixa_de_texto = driver.find_element(By.CSS_SELECTOR, caixa_de_texto_selector)
-        caixa_de_texto.clear()
-        for linha in texto.split('\n'):
-            caixa_de_texto.send_keys(linha)
-            caixa_de_texto.send_keys(Keys.SHIFT, Keys.ENTER)
+        caixa_de_texto = driver.find_element(By.CSS_SELECTOR, CAIXA_DE_TEXTO_SELECTOR)
+        metodo = "insertText"
+        try:
+            inserido = driver.execute_script(INSERIR_TEXTO_JS, caixa_de_texto, texto)
+        except Exception:
+            inserido = False
+        if not inserido:
+            metodo = "digitação"
+            digitar_mensagem(caixa_de_texto, texto)
         caixa_de_texto.send_keys(Keys.ENTER)
+        tempos_envio.append((metodo, (time.perf_counter() - inicio) * 1000))
+        if metodo != "insertText":
+            print(f"Envio por digitação (insertText falhou): {tempos_envio[-1][1]:.0f} ms")
         return True
     except Exception as e:
         print(f"Erro ao enviar mensagem: {e}")
         return False
 
-# --- O Motor Principal do Chatbot (com a nova lógica de leitura) ---
-def processar_mensagem(cliente_id, texto_recebido):
-    estado_atual = conversas.get(cliente_id, {"etapa": "inicio"})
-    etapa = estado_atual.get("etapa")
-    print(f"Processando para {cliente_id} na etapa {etapa}...")
-
-    # A lógica de conversa continua a mesma...
-    if etapa == "inicio":
-        servicos = obter_servicos()
-        if servicos:
-            mensagem = "Olá! Bem-vindo ao agendamento Fluxo. Qual serviço deseja agendar?\n"
-            for i, s in enumerate(servicos, start=1):
-                mensagem += f"\n*{i}* - {s['name']}"
-            enviar_mensagem_whatsapp(mensagem)
-            conversas[cliente_id] = {"etapa": "aguardando_servico", "dados_servicos": servicos}
-    
-    elif etapa == "aguardando_servico":
-        try:
-            escolha_idx = int(texto_recebido) - 1
-            servico_escolhido = estado_atual["dados_servicos"][escolha_idx]
-            profissionais = obter_profissionais()
-            profissionais_disponiveis = [p for p in profissionais if any(s['id'] == servico_escolhido['id'] for s in p.get('services', []))]
-            
-            if profissionais_disponiveis:
-                mensagem = f"Ótima escolha: *{servico_escolhido['name']}*.\n\nCom qual profissional você gostaria de agendar?\n"
-                for i, p in enumerate(profissionais_disponiveis, start=1):
-                    mensagem += f"\n*{i}* - {p['name']}"
-                enviar_mensagem_whatsapp(mensagem)
-                conversas[cliente_id]["etapa"] = "aguardando_profissional"
-                # ... (aqui continuaria a lógica para as próximas etapas)
-            else:
-                enviar_mensagem_whatsapp("Desculpe, não há profissionais que realizam este serviço.")
-                conversas.pop(cliente_id, None)
-        except (ValueError, IndexError):
-            enviar_mensagem_whatsapp("Opção inválida. Por favor, digite apenas o número de um dos serviços listados.")
+def resumo_envios():
+    """Quantidade e mediana/p95 (ms) dos últimos envios por método."""
+    por_metodo = {}
+    for metodo, ms in tempos_envio:
+        por_metodo.setdefault(metodo, []).append(ms)
+    resumo = {}
+    for metodo, tempos in por_metodo.items():
+        tempos.sort()
+        resumo[metodo] = {
+            "envios": len(tempos),
+            "p50_ms": round(tempos[len(tempos) // 2], 1),
+            "p95_ms": round(tempos[min(len(tempos) - 1, int(len(tempos) * 0.95))], 1)
+        }
+    return resumo
+
+# --- O Motor Principal do Chatbot (máquina de estados em fluxo_conversa.py) ---
+maquina = MaquinaConversa(
+    obter_catalogo,
+    {"buscar_horarios": obter_horarios, "criar_agendamento": criar_agendamento},
+    armazenamento=conversas
+)
+
+def processar_mensagem(cliente_id, texto_recebido, enviar=None):
+    """Avança a conversa do cliente; `enviar(texto)` responde a ele (padrão: conversa aberta no WhatsApp Web)."""
+    etapa = maquina.processar(cliente_id, texto_recebido, enviar or enviar_mensagem_whatsapp)
+    print(f"Conversa de {cliente_id} agora na etapa {etapa}.")
 
 # --- Ponto de Partida e Loop Principal ---
-if __name__ == '__main__':
-    driver.get('https://web.whatsapp.com')
-    print("--- Robô do Fluxo Iniciado ---")
-    print("Por favor, escaneie o QR Code com o telemóvel que será o número do robô.")
-    
-    # Espera até que o usuário escaneie o QR Code e a página principal carregue
-    wait = WebDriverWait(driver, 60)
-    wait.until(EC.presence_of_element_located((By.ID, "pane-side"))) # Espera o painel lateral carregar
-    
-    print("Login bem-sucedido! A escutar por novas mensagens na conversa aberta...")
-    
-    ultima_mensagem_processada = "" # Guarda o texto da última mensagem que processamos
+def rodar_webhook():
+    """Sem navegador: mensagens chegam por HTTP e vão para o pool de workers."""
+    transporte = TransporteWebhook().iniciar(Despachante(processar_mensagem))
+    print(f"Webhook do robô ouvindo na porta {transporte.porta}...")
+    threading.Event().wait()
+
+def rodar_selenium():
+    global driver, despachante, contato_atual
+
+    # Perfil persistente: só pede o QR Code na primeira vez; depois sobe headless
+    driver = iniciar_sessao()
+    despachante = Despachante(processar_mensagem)
+
+    print("Login bem-sucedido! A atender todas as conversas não lidas...")
+
+    instalar_observador()
+    contato_atual = contato_da_mensagem(driver.execute_script(CONTATO_ABERTO_JS))
+    if contato_atual:
+        titulos[contato_atual] = driver.execute_script(TITULO_ABERTO_JS)
+    ultima_varredura = 0
+    ultima_saude = 0
 
     while True:
         try:
-            # Pega TODAS as mensagens na conversa aberta
-            mensagens = driver.find_elements(By.CSS_SELECTOR, ".message-in span.selectable-text")
-            if mensagens:
-                # Pega o texto da última mensagem
-                texto_ultima_mensagem = mensagens[-1].text
-                
-                # Se a última mensagem for diferente da que já processamos...
-                if texto_ultima_mensagem != ultima_mensagem_processada:
-                    print(f"Nova mensagem detectada: '{texto_ultima_mensagem}'")
-                    # Usamos 'cliente_ativo' como ID, já que estamos a olhar para a conversa aberta
-                    processar_mensagem("cliente_ativo", texto_ultima_mensagem)
-                    ultima_mensagem_processada = texto_ultima_mensagem # Atualiza a última mensagem
+            atender_conversa_aberta()
+            enviar_respostas_pendentes()
+
+            # Uma conversa por vez, em rodízio: quem espera há mais tempo é atendido primeiro
+            if time.time() - ultima_varredura >= INTERVALO_VARREDURA:
+                varrer_nao_lidas()
+                ultima_varredura = time.time()
+            atender_proxima_conversa()
+
+            if time.time() - ultima_saude >= INTERVALO_SAUDE:
+                ultima_saude = time.time()
+                if not verificar_sessao(driver, conversas_na_fila=len(fila_conversas), respostas_na_fila=saida.qsize()):
+                    print("Sessão do WhatsApp caiu; aguardando reconexão...")
+                    esperar_pronto(driver)
+                    instalar_observador()
         except Exception as e:
-            # Se ocorrer um erro (ex: a conversa não tem mensagens), apenas ignoramos e tentamos de novo
-            pass
-        
-        time.sleep(3) # Verifica por novas mensagens a cada 3 segundos
\ No newline at end of file
+            print(f"Erro no atendimento: {e}")
+
+        time.sleep(INTERVALO_FILA)
+
+if __name__ == '__main__':
+    print("--- Robô do Fluxo Iniciado ---")
+    print(f"{conversas.limpar_ociosas()} conversas ociosas expiradas.")
+
+    if CHATBOT_TRANSPORTE == "webhook":
+        rodar_webhook()
+    else:
+        rodar_selenium()
@@ -0,0 +1,2 @@
+# test_sender.py é um script manual (abre o Chrome ao ser importado), não um teste do pytest
+collect_ignore = ["test_sender.py"]
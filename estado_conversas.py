@@ -0,0 +1,125 @@
+"""
+Armazenamento do estado das conversas do robô
+
+Cada conversa é um registro pequeno (etapa + ids escolhidos + versão do
+catálogo), nunca uma cópia dos serviços/profissionais. Dois backends com a
+mesma interface (obter / salvar / remover / limpar_ociosas):
+
+    ArmazenamentoSQLite  -- padrão; sobrevive a reinícios do robô
+    ArmazenamentoMemoria -- LRU limitado, para testes e simulações
+
+Conversas paradas há mais de `ociosidade` segundos expiram nos dois.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+CONVERSAS_DB = os.getenv("CONVERSAS_DB", "conversas.db") # ":memoria:" usa o LRU em memória
+
+CONVERSAS_OCIOSIDADE = int(os.getenv("CONVERSAS_OCIOSIDADE", str(24 * 3600))) # Segundos sem mensagem até a conversa expirar
+
+CONVERSAS_MAX_MEMORIA = int(os.getenv("CONVERSAS_MAX_MEMORIA", "10000"))
+
+
+class ArmazenamentoMemoria:
+    """LRU em memória: ao passar de `max_conversas`, descarta a menos recente."""
+
+    def __init__(self, max_conversas=CONVERSAS_MAX_MEMORIA, ociosidade=CONVERSAS_OCIOSIDADE):
+        self.max_conversas = max_conversas
+        self.ociosidade = ociosidade
+        self._dados = OrderedDict() # cliente_id -> (atualizado_em, estado)
+        self._lock = threading.Lock()
+
+    def obter(self, cliente_id):
+        with self._lock:
+            item = self._dados.get(cliente_id)
+            if item is None:
+                return None
+            if time.time() - item[0] > self.ociosidade:
+                del self._dados[cliente_id]
+                return None
+            return dict(item[1])
+
+    def salvar(self, cliente_id, estado):
+        with self._lock:
+            self._dados[cliente_id] = (time.time(), dict(estado))
+            self._dados.move_to_end(cliente_id)
+            while len(self._dados) > self.max_conversas:
+                self._dados.popitem(last=False)
+
+    def remover(self, cliente_id):
+        with self._lock:
+            self._dados.pop(cliente_id, None)
+
+    def limpar_ociosas(self):
+        limite = time.time() - self.ociosidade
+        with self._lock:
+            # A ordem do OrderedDict é a do último salvar(): as ociosas estão no começo
+            removidas = 0
+            while self._dados and next(iter(self._dados.values()))[0] < limite:
+                self._dados.popitem(last=False)
+                removidas += 1
+            return removidas
+
+    def __len__(self):
+        return len(self._dados)
+
+
+class ArmazenamentoSQLite:
+    """Uma linha por conversa (estado em JSON); seguro entre threads."""
+
+    def __init__(self, caminho=CONVERSAS_DB, ociosidade=CONVERSAS_OCIOSIDADE):
+        self.ociosidade = ociosidade
+        self._lock = threading.Lock()
+        self._conexao = sqlite3.connect(caminho, check_same_thread=False, isolation_level=None)
+        self._conexao.execute("pragma journal_mode=wal")
+        self._conexao.execute("pragma synchronous=normal")
+        self._conexao.execute("""
+            create table if not exists conversas (
+                cliente_id text primary key,
+                estado text not null,
+                atualizado_em real not null
+            )
+        """)
+        self._conexao.execute("create index if not exists conversas_atualizado_em on conversas (atualizado_em)")
+
+    def obter(self, cliente_id):
+        with self._lock:
+            linha = self._conexao.execute(
+                "select estado, atualizado_em from conversas where cliente_id = ?", (cliente_id,)
+            ).fetchone()
+        if linha is None or time.time() - linha[1] > self.ociosidade:
+            return None
+        return json.loads(linha[0])
+
+    def salvar(self, cliente_id, estado):
+        with self._lock:
+            self._conexao.execute(
+                "insert into conversas (cliente_id, estado, atualizado_em) values (?, ?, ?) "
+                "on conflict (cliente_id) do update set estado = excluded.estado, atualizado_em = excluded.atualizado_em",
+                (cliente_id, json.dumps(estado, separators=(",", ":")), time.time())
+            )
+
+    def remover(self, cliente_id):
+        with self._lock:
+            self._conexao.execute("delete from conversas where cliente_id = ?", (cliente_id,))
+
+    def limpar_ociosas(self):
+        with self._lock:
+            return self._conexao.execute(
+                "delete from conversas where atualizado_em < ?", (time.time() - self.ociosidade,)
+            ).rowcount
+
+    def __len__(self):
+        with self._lock:
+            return self._conexao.execute("select count(*) from conversas").fetchone()[0]
+
+
+def criar_armazenamento(caminho=CONVERSAS_DB):
+    if caminho == ":memoria:":
+        return ArmazenamentoMemoria()
+    return ArmazenamentoSQLite(caminho)
@@ -0,0 +1,540 @@
+"""
+Cliente Supabase falso, em memória, para benchmarks e checagens offline
+
+Implementa o subconjunto da API do supabase-py / postgrest-py que o app.py usa:
+table().select/insert/update/upsert/delete, filtros (eq, neq, gt, gte, lt, lte,
+in_, or_, match), order, limit, range, single, maybe_single, rpc() e auth.get_user().
+"""
+
+import re
+import threading
+import time
+import uuid
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from types import SimpleNamespace
+
+from postgrest.exceptions import APIError
+
+
+@lru_cache(maxsize=1_000_000)
+def _parse_ts_str(value):
+    if len(value) >= 16 and value[4] == "-" and value[10] in "T ":
+        try:
+            dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+        return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+    return None
+
+
+def _norm(value):
+    """Normaliza valores para comparação (timestamps viram datetime UTC)"""
+    if isinstance(value, str):
+        dt = _parse_ts_str(value)
+        return value if dt is None else dt
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def _cmp(op, left, right):
+    if left is None:
+        return op == "is" and right is None
+    left, right = _norm(left), _norm(right)
+    if isinstance(left, datetime) != isinstance(right, datetime):
+        left, right = str(left), str(right)
+    elif not isinstance(left, datetime) and type(left) is not type(right):
+        left, right = str(left), str(right)
+    if op == "eq":
+        return left == right
+    if op == "neq":
+        return left != right
+    if op == "gt":
+        return left > right
+    if op == "gte":
+        return left >= right
+    if op == "lt":
+        return left < right
+    if op == "lte":
+        return left <= right
+    raise ValueError(op)
+
+
+def _split_top(text, sep=","):
+    parts, depth, cur, quoted = [], 0, "", False
+    for ch in text:
+        if ch == '"':
+            quoted = not quoted
+        if not quoted:
+            if ch == "(":
+                depth += 1
+            elif ch == ")":
+                depth -= 1
+            elif ch == sep and depth == 0:
+                parts.append(cur.strip())
+                cur = ""
+                continue
+        cur += ch
+    if cur.strip():
+        parts.append(cur.strip())
+    return parts
+
+
+_KEYSET_RE = re.compile(r'^start_time\.gt\."?([^",]+)"?,and\(start_time\.eq\.')
+
+
+def _parse_or(expr):
+    """Converte a sintaxe de or=(...) do PostgREST em um predicado"""
+    preds = []
+    for part in _split_top(expr):
+        if part.startswith("and(") and part.endswith(")"):
+            inner = _parse_or(part[4:-1])
+            preds.append(lambda row, inner=inner: all(p(row) for p in inner.preds))
+            continue
+        col, op, val = part.split(".", 2)
+        val = val.strip('"')
+        preds.append(lambda row, col=col, op=op, val=val: _cmp(op, row.get(col), val))
+    # Cursor keyset (start_time, id): todo resultado tem start_time >= valor
+    keyset = _KEYSET_RE.match(expr)
+    lower = _norm(keyset.group(1)) if keyset else None
+    return SimpleNamespace(preds=preds, lower=lower, match=lambda row: any(p(row) for p in preds))
+
+
+_EMBED_RE = re.compile(r"^(?:(\w+):)?(\w+)(?:!\w+)?\((.*)\)$", re.S)
+
+
+@lru_cache(maxsize=256)
+def _parse_columns(cols):
+    """'id, service:services(name)' -> tuplas (tipo, nome, tabela, colunas internas); None = todas"""
+    cols = " ".join(cols.split())
+    if not cols or cols == "*":
+        return None
+    spec = []
+    for col in _split_top(cols):
+        col = col.strip()
+        m = _EMBED_RE.match(col)
+        if col == "*":
+            spec.append(("*", None, None, None))
+        elif m:
+            alias, target, inner = m.groups()
+            spec.append(("embed", alias or target, target, inner))
+        else:
+            spec.append(("col", col, None, None))
+    return tuple(spec)
+
+
+class FakeSupabase:
+    """Cliente em memória com latência por chamada injetável"""
+
+    def __init__(self, latency=0.0, exclusion=True):
+        self.tables = {}
+        self.latency = latency
+        self.exclusion = exclusion
+        self.rpcs = {}
+        self.users = {}
+        self.calls = 0
+        self._lock = threading.RLock()
+        self._indexes = {}
+        self._by_id = {}
+        self._by_value = {}
+        self.auth = SimpleNamespace(get_user=self._get_user)
+
+    # --- infraestrutura ---
+
+    def _sleep(self):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _get_user(self, token):
+        self._sleep()
+        uid = self.users.get(token)
+        return SimpleNamespace(user=SimpleNamespace(id=uid) if uid else None)
+
+    def seed(self, name, rows):
+        table = self.tables.setdefault(name, [])
+        for r in rows:
+            r.setdefault("id", str(uuid.uuid4()))
+            table.append(r)
+        self._changed(name)
+
+    def _index(self, name):
+        """Índice ordenado por (start_time, id) para filtros de intervalo e keyset"""
+        idx = self._indexes.get(name)
+        if idx is None:
+            rows = [r for r in self.tables.get(name, []) if r.get("start_time")]
+            rows.sort(key=lambda r: (_norm(r["start_time"]), str(r.get("id"))))
+            spans = [_norm(r["end_time"]) - _norm(r["start_time"]) for r in rows if r.get("end_time")]
+            idx = SimpleNamespace(
+                keys=[_norm(r["start_time"]) for r in rows],
+                rows=rows,
+                complete=len(rows) == len(self.tables.get(name, [])),
+                max_span=max(spans, default=timedelta(0))
+            )
+            self._indexes[name] = idx
+        return idx
+
+    def _index_add(self, name, row):
+        idx = self._indexes.get(name)
+        if idx is None:
+            return
+        if not row.get("start_time") or not idx.complete:
+            self._indexes.pop(name, None)
+            return
+        key = _norm(row["start_time"])
+        pos = bisect_right(idx.keys, key)
+        idx.keys.insert(pos, key)
+        idx.rows.insert(pos, row)
+        if row.get("end_time"):
+            idx.max_span = max(idx.max_span, _norm(row["end_time"]) - key)
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def from_(self, name):
+        return self.table(name)
+
+    def rpc(self, name, params=None):
+        return FakeRpc(self, name, params or {})
+
+    # --- embeds ---
+
+    def _find(self, table, key, value):
+        if key == "id":
+            by_id = self._by_id.get(table)
+            if by_id is None:
+                by_id = self._by_id[table] = {r.get("id"): r for r in self.tables.get(table, [])}
+            return by_id.get(value)
+        for r in self.tables.get(table, []):
+            if r.get(key) == value:
+                return r
+        return None
+
+    def _changed(self, name):
+        self._indexes.pop(name, None)
+        self._by_id.pop(name, None)
+        for key in [k for k in self._by_value if k[0] == name]:
+            del self._by_value[key]
+
+    def _value_index(self, name, col):
+        """str(valor) -> linhas, para filtros in_ em tabelas grandes"""
+        key = (name, col)
+        index = self._by_value.get(key)
+        if index is None:
+            index = {}
+            for r in self.tables.get(name, []):
+                index.setdefault(str(r.get(col)), []).append(r)
+            self._by_value[key] = index
+        return index
+
+    def _embed(self, row, parent, alias, target, cols):
+        single = target[:-1] if target.endswith("s") else target
+        parent_single = parent[:-1] if parent.endswith("s") else parent
+        fk = f"{single}_id"
+        if fk in row:
+            found = self._find(target, "id", row[fk])
+            return self._project(found, target, cols) if found else None
+        link = f"{parent_single}_{target}"
+        for jname, jrows in self.tables.items():
+            if jname in (link, f"{single}_{parent}") or (
+                jrows and f"{parent_single}_id" in jrows[0] and fk in jrows[0]
+            ):
+                ids = [j[fk] for j in jrows if j.get(f"{parent_single}_id") == row.get("id")]
+                return [self._project(self._find(target, "id", i), target, cols)
+                        for i in ids if self._find(target, "id", i)]
+        return [self._project(r, target, cols)
+                for r in self.tables.get(target, []) if r.get(f"{parent_single}_id") == row.get("id")]
+
+    def _project(self, row, table, cols):
+        spec = _parse_columns(cols)
+        if spec is None:
+            return dict(row)
+        out = {}
+        for kind, name, target, inner in spec:
+            if kind == "*":
+                out.update(row)
+            elif kind == "embed":
+                out[name] = self._embed(row, table, name, target, inner)
+            else:
+                out[name] = row.get(name)
+        return out
+
+
+class FakeResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class FakeRpc:
+    def __init__(self, client, name, params):
+        self.client = client
+        self.name = name
+        self.params = params
+
+    def execute(self):
+        self.client._sleep()
+        fn = self.client.rpcs.get(self.name)
+        if fn is None:
+            raise APIError({"code": "PGRST202", "message": f"function {self.name} not found"})
+        return FakeResponse(fn(self.client, **self.params))
+
+
+class FakeQuery:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.op = "select"
+        self.cols = "*"
+        self.payload = None
+        self.filters = []
+        self.orders = []
+        self.lim = None
+        self.off = 0
+        self.want_single = None
+        self.count = None
+        self.on_conflict = "id"
+
+    # --- operações ---
+
+    def select(self, *cols, count=None, head=None):
+        self.cols = ",".join(cols) or "*"
+        self.count = count
+        return self
+
+    def insert(self, json, **kwargs):
+        self.op, self.payload = "insert", json
+        return self
+
+    def upsert(self, json, on_conflict="", **kwargs):
+        self.op, self.payload = "upsert", json
+        self.on_conflict = on_conflict or "id"
+        return self
+
+    def update(self, json, **kwargs):
+        self.op, self.payload = "update", json
+        return self
+
+    def delete(self, **kwargs):
+        self.op = "delete"
+        return self
+
+    # --- filtros ---
+
+    def _add(self, col, op, val):
+        self.filters.append((col, op, val))
+        return self
+
+    def eq(self, col, val):
+        return self._add(col, "eq", val)
+
+    def neq(self, col, val):
+        return self._add(col, "neq", val)
+
+    def gt(self, col, val):
+        return self._add(col, "gt", val)
+
+    def gte(self, col, val):
+        return self._add(col, "gte", val)
+
+    def lt(self, col, val):
+        return self._add(col, "lt", val)
+
+    def lte(self, col, val):
+        return self._add(col, "lte", val)
+
+    def in_(self, col, vals):
+        return self._add(col, "in", {str(v) for v in vals})
+
+    def match(self, query):
+        for k, v in query.items():
+            self.eq(k, v)
+        return self
+
+    def or_(self, expr, reference_table=None):
+        return self._add(None, "or", _parse_or(expr))
+
+    def order(self, col, desc=False, nullsfirst=None, foreign_table=None):
+        if " " not in col.strip():
+            self.orders.append((col, desc))
+        return self
+
+    def limit(self, n, foreign_table=None):
+        self.lim = n
+        return self
+
+    def range(self, start, end, foreign_table=None):
+        self.off, self.lim = start, end - start + 1
+        return self
+
+    def single(self):
+        self.want_single = "single"
+        return self
+
+    def maybe_single(self):
+        self.want_single = "maybe"
+        return self
+
+    # --- execução ---
+
+    def _match(self, row):
+        for col, op, val in self.filters:
+            if "." in (col or ""):
+                continue
+            if op == "in":
+                if str(row.get(col)) not in val:
+                    return False
+            elif op == "or":
+                if not val.match(row):
+                    return False
+            elif not _cmp(op, row.get(col), val):
+                return False
+        return True
+
+    def _candidates(self):
+        """Linhas candidatas e se já estão na ordem (start_time, id) do índice"""
+        rows = self.client.tables.get(self.name, [])
+        if self.op != "select" or len(rows) < 1000 or not rows or "start_time" not in rows[0]:
+            return rows, False
+        # Filtro in_ seletivo: usa índice de valores da coluna
+        for col, op, val in self.filters:
+            if op == "in" and col and "." not in col and len(val) * 20 < len(rows):
+                by_value = self.client._value_index(self.name, col)
+                picked = [r for v in val for r in by_value.get(v, ())]
+                return picked, False
+        idx = self.client._index(self.name)
+        if not idx.complete:
+            return rows, False
+        lo = hi = None
+        for col, op, val in self.filters:
+            if col == "start_time" and op in ("gte", "gt", "eq"):
+                lo = bisect_left(idx.keys, _norm(val))
+            elif col == "end_time" and op in ("gt", "gte"):
+                # end > X implica start > X - maior duração
+                bound = bisect_left(idx.keys, _norm(val) - idx.max_span)
+                lo = bound if lo is None else max(lo, bound)
+            elif op == "or" and val.lower is not None:
+                bound = bisect_left(idx.keys, val.lower)
+                lo = bound if lo is None else max(lo, bound)
+            if col == "start_time" and op in ("lt", "lte", "eq"):
+                hi = (bisect_left if op == "lt" else bisect_right)(idx.keys, _norm(val))
+        return idx.rows[lo or 0:len(idx.rows) if hi is None else hi], True
+
+    def _check_overlap(self, row, ignore_id=None):
+        if not (self.client.exclusion and self.name == "appointments"):
+            return
+        s, e = _norm(row.get("start_time")), _norm(row.get("end_time"))
+        if s is None or e is None:
+            return
+        table = self.client.tables.get(self.name, [])
+        others = table
+        if len(table) >= 1000:
+            idx = self.client._index(self.name)
+            if idx.complete:
+                others = idx.rows[bisect_left(idx.keys, s - idx.max_span):bisect_left(idx.keys, e)]
+        for other in others:
+            if other.get("id") == ignore_id or other.get("professional_id") != row.get("professional_id"):
+                continue
+            if _norm(other["start_time"]) < e and _norm(other["end_time"]) > s:
+                raise APIError({
+                    "code": "23P01",
+                    "message": 'conflicting key value violates exclusion constraint "appointments_no_overlap"',
+                })
+
+    def execute(self):
+        c = self.client
+        c._sleep()
+        with c._lock:
+            table = c.tables.setdefault(self.name, [])
+
+            if self.op == "insert":
+                rows = self.payload if isinstance(self.payload, list) else [self.payload]
+                out = []
+                for r in rows:
+                    r = dict(r)
+                    r.setdefault("id", str(uuid.uuid4()))
+                    self._check_overlap(r)
+                    out.append(r)
+                table.extend(out)
+                c._by_id.pop(self.name, None)
+                for key in [k for k in c._by_value if k[0] == self.name]:
+                    del c._by_value[key]
+                for r in out:
+                    c._index_add(self.name, r)
+                return FakeResponse([dict(r) for r in out])
+
+            if self.op == "upsert":
+                rows = self.payload if isinstance(self.payload, list) else [self.payload]
+                keys = [k.strip() for k in self.on_conflict.split(",")]
+                out = []
+                for r in rows:
+                    existing = next((t for t in table if all(t.get(k) == r.get(k) for k in keys)), None)
+                    if existing is not None:
+                        merged = {**existing, **r}
+                        self._check_overlap(merged, ignore_id=existing.get("id"))
+                        existing.update(r)
+                        out.append(dict(existing))
+                    else:
+                        r = dict(r)
+                        r.setdefault("id", str(uuid.uuid4()))
+                        self._check_overlap(r)
+                        table.append(r)
+                        out.append(dict(r))
+                c._changed(self.name)
+                return FakeResponse(out)
+
+            candidates, ordered = self._candidates()
+
+            # Já em ordem (start_time, id) e sem contagem: pode parar no limite
+            stop = None
+            if ordered and not self.count and self.lim is not None \
+                    and self.orders in ([("start_time", False)], [("start_time", False), ("id", False)]):
+                stop = self.off + self.lim
+
+            matched = []
+            for r in candidates:
+                if self._match(r):
+                    matched.append(r)
+                    if stop is not None and len(matched) >= stop:
+                        break
+
+            if self.op == "update":
+                for r in matched:
+                    self._check_overlap({**r, **self.payload}, ignore_id=r.get("id"))
+                for r in matched:
+                    r.update(self.payload)
+                c._changed(self.name)
+                return FakeResponse([dict(r) for r in matched])
+
+            if self.op == "delete":
+                ids = {id(r) for r in matched}
+                table[:] = [r for r in table if id(r) not in ids]
+                c._changed(self.name)
+                return FakeResponse([dict(r) for r in matched])
+
+            if stop is None:
+                for col, desc in reversed(self.orders):
+                    matched.sort(key=lambda r: (_norm(r.get(col)) is None, _norm(r.get(col))), reverse=desc)
+
+            total = len(matched) if self.count else None
+            if self.lim is not None or self.off:
+                end = None if self.lim is None else self.off + self.lim
+                matched = matched[self.off:end]
+
+            data = [c._project(r, self.name, self.cols) for r in matched]
+
+        if self.want_single:
+            if len(data) != 1:
+                if self.want_single == "maybe" and not data:
+                    return None
+                raise APIError({
+                    "code": "PGRST116",
+                    "message": "JSON object requested, multiple (or no) rows returned",
+                    "details": f"The result contains {len(data)} rows",
+                })
+            return FakeResponse(data[0], total)
+
+        return FakeResponse(data, total)
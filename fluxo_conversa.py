@@ -0,0 +1,372 @@
+"""
+Máquina de estados da conversa de agendamento
+
+Cada etapa da tabela ETAPAS tem um tratador puro -- (sessão, texto, contexto)
+-> Passo -- e a lista de etapas para onde pode ir. O Passo diz a próxima
+etapa, as respostas, os campos da sessão a atualizar e, se for o caso, uma
+ação de I/O ("buscar_horarios", "criar_agendamento"). A MaquinaConversa
+executa a ação e entrega o resultado ao tratador em APOS_ACAO, também puro.
+Assim o fluxo inteiro roda sem rede em simulações e testes.
+
+    inicio -> serviço -> profissional -> data -> horário -> nome -> confirmação
+           -> POST /api/appointments
+
+O catálogo esperado pelos tratadores vem de montar_catalogo().
+"""
+
+import hashlib
+import json
+import re
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+MAX_HORARIOS = 12 # Horários oferecidos por data (os primeiros livres do dia)
+
+COMANDOS_CANCELAR = {"cancelar", "sair", "parar"}
+
+Passo = namedtuple("Passo", "etapa respostas dados acao", defaults=((), None, None))
+
+Contexto = namedtuple("Contexto", "catalogo hoje cliente_id")
+
+Etapa = namedtuple("Etapa", "tratar proximas")
+
+
+class Sessao:
+    """Estado compacto de uma conversa; o catálogo é referenciado só pela versão."""
+
+    __slots__ = ("etapa", "versao", "servico_id", "profissional_escolhido", "profissional_id", "data", "horarios", "inicio", "nome",
+                 "atualizado_em")
+
+    def __init__(self, etapa="inicio"):
+        self.etapa = etapa
+        self.versao = None
+        self.servico_id = None
+        self.profissional_escolhido = None # Escolha do cliente (None = qualquer um); usada em toda busca de horários
+        self.profissional_id = None # Profissional do horário escolhido (vai no agendamento)
+        self.data = None
+        self.horarios = None # ((start_time, profissional_id), ...) oferecidos, na ordem numerada
+        self.inicio = None
+        self.nome = None
+        self.atualizado_em = 0.0
+
+    def para_dict(self):
+        return {campo: getattr(self, campo) for campo in self.__slots__ if getattr(self, campo) is not None}
+
+    @classmethod
+    def de_dict(cls, dados):
+        sessao = cls()
+        for campo, valor in dados.items():
+            if campo in cls.__slots__:
+                setattr(sessao, campo, tuple(map(tuple, valor)) if campo == "horarios" else valor)
+        return sessao
+
+
+def versao_do_catalogo(servicos, profissionais):
+    """
+    Hash do conteúdo (na ordem em que os menus são numerados): a mesma versão
+    significa o mesmo catálogo também entre reinícios do robô, já que as
+    sessões ficam gravadas no SQLite
+    """
+    conteudo = json.dumps([servicos, profissionais], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha1(conteudo.encode("utf-8")).hexdigest()[:16]
+
+
+def montar_catalogo(servicos, profissionais, versao=None):
+    """Catálogo imutável com os índices que os tratadores usam."""
+    if versao is None:
+        versao = versao_do_catalogo(servicos, profissionais)
+    por_servico = {}
+    for p in profissionais:
+        for s in p.get("services") or []:
+            por_servico.setdefault(s["id"], []).append(p)
+    return {
+        "versao": versao,
+        "servicos": servicos,
+        "profissionais": profissionais,
+        "profissionais_por_servico": por_servico,
+        "servicos_por_id": {s["id"]: s for s in servicos},
+        "profissionais_por_id": {p["id"]: p for p in profissionais}
+    }
+
+# --- Auxiliares de texto ---
+
+def ler_opcao(texto, maximo, minimo=1):
+    try:
+        opcao = int(texto.strip().strip("*"))
+    except (ValueError, AttributeError):
+        return None
+    return opcao if minimo <= opcao <= maximo else None
+
+
+def ler_data(texto, hoje):
+    texto = texto.strip().lower()
+    if texto == "hoje":
+        return hoje
+    if texto in ("amanhã", "amanha"):
+        return hoje + timedelta(days=1)
+    m = re.fullmatch(r"(\d{1,2})/(\d{1,2})(?:/(\d{2,4}))?", texto)
+    if not m:
+        return None
+    dia, mes = int(m.group(1)), int(m.group(2))
+    ano = int(m.group(3)) if m.group(3) else hoje.year
+    ano += 2000 if ano < 100 else 0
+    try:
+        escolhida = date(ano, mes, dia)
+    except ValueError:
+        return None
+    if not m.group(3) and escolhida < hoje:
+        escolhida = escolhida.replace(year=hoje.year + 1) # "05/01" em dezembro é o ano que vem
+    return escolhida
+
+
+def hora(start_time):
+    return datetime.fromisoformat(start_time).strftime("%H:%M")
+
+
+def menu(titulo, nomes, inicio=1):
+    return titulo + "\n" + "".join(f"\n*{i}* - {nome}" for i, nome in enumerate(nomes, start=inicio))
+
+
+def menu_servicos(catalogo, titulo="Olá! Bem-vindo ao agendamento Fluxo. Qual serviço deseja agendar?\n"):
+    return menu(titulo, [s["name"] for s in catalogo["servicos"]])
+
+
+def profissionais_do_servico(catalogo, servico_id):
+    return catalogo["profissionais_por_servico"].get(servico_id, [])
+
+
+def pedir_servico_de_novo(catalogo):
+    return Passo("aguardando_servico", (menu_servicos(catalogo, "Nossa lista de serviços foi atualizada. Qual serviço deseja agendar?\n"),),
+                 {"versao": catalogo["versao"]})
+
+
+def buscar_horarios(sessao, data):
+    return ("buscar_horarios", {"servico_id": sessao.servico_id, "data": data, "profissional_id": sessao.profissional_escolhido})
+
+# --- Tratadores (puros) ---
+
+def ao_iniciar(sessao, texto, ctx):
+    if not ctx.catalogo["servicos"]:
+        return Passo("fim", ("Desculpe, o agendamento está indisponível no momento. Tente novamente mais tarde.",))
+    return Passo("aguardando_servico", (menu_servicos(ctx.catalogo),), {"versao": ctx.catalogo["versao"]})
+
+
+def escolher_servico(sessao, texto, ctx):
+    servicos = ctx.catalogo["servicos"]
+    if sessao.versao != ctx.catalogo["versao"]:
+        # A numeração mudou desde que o menu foi enviado: reenvia em vez de adivinhar
+        return pedir_servico_de_novo(ctx.catalogo)
+
+    opcao = ler_opcao(texto, len(servicos))
+    if opcao is None:
+        return Passo("aguardando_servico", ("Opção inválida. Por favor, digite apenas o número de um dos serviços listados.",))
+
+    servico = servicos[opcao - 1]
+    profissionais = profissionais_do_servico(ctx.catalogo, servico["id"])
+    if not profissionais:
+        return Passo("fim", ("Desculpe, não há profissionais que realizam este serviço.",))
+
+    mensagem = menu(
+        f"Ótima escolha: *{servico['name']}*.\n\nCom qual profissional você gostaria de agendar?\n",
+        ["Qualquer profissional"] + [p["name"] for p in profissionais],
+        inicio=0
+    )
+    return Passo("aguardando_profissional", (mensagem,), {"servico_id": servico["id"]})
+
+
+def escolher_profissional(sessao, texto, ctx):
+    if sessao.versao != ctx.catalogo["versao"]:
+        return pedir_servico_de_novo(ctx.catalogo)
+
+    profissionais = profissionais_do_servico(ctx.catalogo, sessao.servico_id)
+    opcao = ler_opcao(texto, len(profissionais), minimo=0)
+    if opcao is None:
+        return Passo("aguardando_profissional", ("Opção inválida. Digite o número de um dos profissionais listados (ou 0 para qualquer um).",))
+
+    return Passo(
+        "aguardando_data",
+        ("Para qual dia? Responda com a data (DD/MM), *hoje* ou *amanhã*.",),
+        {"profissional_escolhido": profissionais[opcao - 1]["id"] if opcao else None, "profissional_id": None}
+    )
+
+
+def escolher_data(sessao, texto, ctx):
+    dia = ler_data(texto, ctx.hoje)
+    if dia is None:
+        return Passo("aguardando_data", ("Não entendi a data. Use DD/MM (por exemplo 25/10), *hoje* ou *amanhã*.",))
+    if dia < ctx.hoje:
+        return Passo("aguardando_data", ("Essa data já passou. Escolha hoje ou um dia futuro.",))
+    return Passo("aguardando_data", (), {"data": dia.isoformat()}, buscar_horarios(sessao, dia.isoformat()))
+
+
+def horarios_recebidos(sessao, slots, ctx):
+    dia = date.fromisoformat(sessao.data).strftime("%d/%m")
+    if slots is None:
+        return Passo("aguardando_data", ("Não consegui consultar os horários agora. Envie a data de novo em instantes.",))
+    if not slots:
+        return Passo("aguardando_data", (f"Não há horários livres em {dia}. Escolha outra data.",))
+
+    horarios = tuple(
+        (s["start_time"], sessao.profissional_escolhido or s["available_professionals"][0]["id"])
+        for s in slots[:MAX_HORARIOS]
+    )
+    mensagem = menu(f"Horários livres em {dia}:\n", ["Escolher outra data"] + [hora(h[0]) for h in horarios], inicio=0)
+    return Passo("aguardando_horario", (mensagem,), {"horarios": horarios})
+
+
+def escolher_horario(sessao, texto, ctx):
+    opcao = ler_opcao(texto, len(sessao.horarios), minimo=0)
+    if opcao is None:
+        return Passo("aguardando_horario", ("Opção inválida. Digite o número de um dos horários listados.",))
+    if opcao == 0:
+        return Passo("aguardando_data", ("Para qual dia? Responda com a data (DD/MM), *hoje* ou *amanhã*.",), {"horarios": None})
+
+    inicio, profissional_id = sessao.horarios[opcao - 1]
+    return Passo("aguardando_nome", ("Qual o seu nome?",), {"inicio": inicio, "profissional_id": profissional_id, "horarios": None})
+
+
+def informar_nome(sessao, texto, ctx):
+    nome = " ".join(texto.split())[:80]
+    if len(nome) < 2:
+        return Passo("aguardando_nome", ("Por favor, digite o seu nome.",))
+
+    servico = ctx.catalogo["servicos_por_id"].get(sessao.servico_id, {})
+    profissional = ctx.catalogo["profissionais_por_id"].get(sessao.profissional_id, {})
+    quando = datetime.fromisoformat(sessao.inicio)
+    mensagem = (
+        "Confirma o agendamento?\n\n"
+        f"*Serviço:* {servico.get('name', '-')}\n"
+        f"*Profissional:* {profissional.get('name', '-')}\n"
+        f"*Quando:* {quando.strftime('%d/%m')} às {quando.strftime('%H:%M')}\n"
+        f"*Nome:* {nome}\n\n"
+        "*1* - Confirmar\n*2* - Cancelar"
+    )
+    return Passo("aguardando_confirmacao", (mensagem,), {"nome": nome})
+
+
+def confirmar(sessao, texto, ctx):
+    resposta = texto.strip().lower()
+    if resposta in ("2", "não", "nao", "n"):
+        return Passo("fim", ("Agendamento cancelado. Mande qualquer mensagem para começar de novo.",))
+    if resposta not in ("1", "sim", "s"):
+        return Passo("aguardando_confirmacao", ("Responda *1* para confirmar ou *2* para cancelar.",))
+
+    agendamento = {
+        "professional_id": sessao.profissional_id,
+        "service_id": sessao.servico_id,
+        "customer_name": sessao.nome,
+        "customer_phone": ctx.cliente_id.split("@", 1)[0],
+        "start_time": sessao.inicio
+    }
+    return Passo("aguardando_confirmacao", (), None, ("criar_agendamento", {"agendamento": agendamento}))
+
+
+def agendamento_criado(sessao, resultado, ctx):
+    status, corpo = resultado
+    if status == 201:
+        quando = datetime.fromisoformat(sessao.inicio)
+        return Passo("fim", (f"Pronto, {sessao.nome}! Seu horário em {quando.strftime('%d/%m')} às {quando.strftime('%H:%M')} está confirmado.",))
+    if status == 409:
+        return Passo(
+            "aguardando_data",
+            ("Esse horário acabou de ser reservado por outra pessoa. Veja os horários que ainda estão livres:",),
+            {"inicio": None, "profissional_id": None},
+            buscar_horarios(sessao, sessao.data)
+        )
+    return Passo("aguardando_confirmacao", ("Não consegui concluir o agendamento agora. Responda *1* para tentar de novo ou *2* para cancelar.",))
+
+
+def cancelar(sessao, texto, ctx):
+    return Passo("fim", ("Tudo bem, atendimento encerrado. Mande qualquer mensagem para começar de novo.",))
+
+# --- Tabela de transições ---
+
+ETAPAS = {
+    "inicio": Etapa(ao_iniciar, {"aguardando_servico", "fim"}),
+    "aguardando_servico": Etapa(escolher_servico, {"aguardando_servico", "aguardando_profissional", "fim"}),
+    "aguardando_profissional": Etapa(escolher_profissional, {"aguardando_profissional", "aguardando_servico", "aguardando_data"}),
+    "aguardando_data": Etapa(escolher_data, {"aguardando_data", "aguardando_horario"}),
+    "aguardando_horario": Etapa(escolher_horario, {"aguardando_horario", "aguardando_data", "aguardando_nome"}),
+    "aguardando_nome": Etapa(informar_nome, {"aguardando_nome", "aguardando_confirmacao"}),
+    "aguardando_confirmacao": Etapa(confirmar, {"aguardando_confirmacao", "aguardando_data", "fim"})
+}
+
+APOS_ACAO = {
+    "buscar_horarios": horarios_recebidos,
+    "criar_agendamento": agendamento_criado
+}
+
+
+class MaquinaConversa:
+    """
+    Executa a tabela ETAPAS
+
+    obter_catalogo: () -> catálogo de montar_catalogo()
+    acoes: {"buscar_horarios": fn(servico_id, data, profissional_id) -> slots | None,
+            "criar_agendamento": fn(agendamento) -> (status, corpo)}
+    armazenamento: opcional (interface do estado_conversas); sem ele as
+    sessões ficam em memória como objetos Sessao
+    """
+
+    def __init__(self, obter_catalogo, acoes, armazenamento=None, hoje=date.today, relogio=time.time):
+        self.obter_catalogo = obter_catalogo
+        self.acoes = acoes
+        self.armazenamento = armazenamento
+        self.hoje = hoje
+        self.relogio = relogio
+        self.sessoes = {}
+
+    def carregar(self, cliente_id):
+        if self.armazenamento is None:
+            return self.sessoes.get(cliente_id) or Sessao()
+        dados = self.armazenamento.obter(cliente_id)
+        return Sessao.de_dict(dados) if dados else Sessao()
+
+    def guardar(self, cliente_id, sessao):
+        if sessao.etapa == "fim":
+            if self.armazenamento is None:
+                self.sessoes.pop(cliente_id, None)
+            else:
+                self.armazenamento.remover(cliente_id)
+            return
+        sessao.atualizado_em = self.relogio()
+        if self.armazenamento is None:
+            self.sessoes[cliente_id] = sessao
+        else:
+            self.armazenamento.salvar(cliente_id, sessao.para_dict())
+
+    def aplicar(self, sessao, passo, enviar):
+        if passo.etapa != sessao.etapa and passo.etapa != "fim" and passo.etapa not in ETAPAS[sessao.etapa].proximas:
+            raise ValueError(f"Transição não prevista: {sessao.etapa} -> {passo.etapa}")
+        for campo, valor in (passo.dados or {}).items():
+            setattr(sessao, campo, valor)
+        sessao.etapa = passo.etapa
+        for resposta in passo.respostas:
+            enviar(resposta)
+
+    def processar(self, cliente_id, texto, enviar):
+        sessao = self.carregar(cliente_id)
+        ctx = Contexto(self.obter_catalogo(), self.hoje(), cliente_id)
+
+        if sessao.etapa != "inicio" and texto.strip().lower() in COMANDOS_CANCELAR:
+            passo = cancelar(sessao, texto, ctx)
+        else:
+            passo = ETAPAS[sessao.etapa].tratar(sessao, texto, ctx)
+
+        self.aplicar(sessao, passo, enviar)
+        while passo.acao is not None and sessao.etapa != "fim":
+            nome, parametros = passo.acao
+            passo = APOS_ACAO[nome](sessao, self.acoes[nome](**parametros), ctx)
+            self.aplicar(sessao, passo, enviar)
+
+        self.guardar(cliente_id, sessao)
+        return sessao.etapa
+
+    def limpar_ociosas(self, ociosidade):
+        """Remove as sessões em memória paradas há mais de `ociosidade` segundos."""
+        limite = self.relogio() - ociosidade
+        antigas = [c for c, s in list(self.sessoes.items()) if s.atualizado_em < limite]
+        for cliente_id in antigas:
+            self.sessoes.pop(cliente_id, None)
+        return len(antigas)
@@ -0,0 +1,18 @@
+# Configuração lida automaticamente pelo gunicorn (Procfile: gunicorn --bind 0.0.0.0:$PORT app:app)
+#
+# Métricas com vários workers: defina PROMETHEUS_MULTIPROC_DIR apontando para um
+# diretório gravável; cada worker escreve ali e o /metrics agrega todos.
+
+import os
+import shutil
+
+def on_starting(server):
+    path = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+def child_exit(server, worker):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
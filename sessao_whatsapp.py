@@ -0,0 +1,154 @@
+"""
+Sessão do WhatsApp Web compartilhada pelo chatbot.py e pelo test_sender.py
+
+O Chrome usa um perfil persistente (WHATSAPP_PERFIL_DIR), então o QR Code só
+precisa ser lido uma vez; depois disso o robô sobe sozinho, em modo headless.
+Em vez de esperas fixas, a página é observada até mostrar o painel de
+conversas (pronto) ou o QR Code (login necessário). O estado vai para um
+arquivo de saúde (WHATSAPP_SAUDE_ARQUIVO) que um supervisor pode ler.
+
+Dois processos não podem abrir o mesmo perfil ao mesmo tempo: pare o robô
+antes de rodar o test_sender.py.
+"""
+
+import json
+import os
+import time
+
+from selenium import webdriver
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+
+WHATSAPP_URL = "https://web.whatsapp.com"
+
+WHATSAPP_PERFIL_DIR = os.path.abspath(os.getenv("WHATSAPP_PERFIL_DIR", ".whatsapp-perfil"))
+
+# "1" sempre headless, "0" sempre visível, "auto" headless só se o perfil já tem login
+WHATSAPP_HEADLESS = os.getenv("WHATSAPP_HEADLESS", "auto").strip().lower()
+
+WHATSAPP_LOGIN_TIMEOUT = int(os.getenv("WHATSAPP_LOGIN_TIMEOUT", "300")) # Segundos esperando a leitura do QR Code
+
+WHATSAPP_CARREGAR_TIMEOUT = int(os.getenv("WHATSAPP_CARREGAR_TIMEOUT", "60")) # Segundos até aparecer o painel ou o QR Code
+
+WHATSAPP_SAUDE_ARQUIVO = os.getenv("WHATSAPP_SAUDE_ARQUIVO", "whatsapp-saude.json")
+
+WHATSAPP_QR_ARQUIVO = os.getenv("WHATSAPP_QR_ARQUIVO", "whatsapp-qr.png") # Print do QR Code quando headless
+
+WHATSAPP_QR_INTERVALO = float(os.getenv("WHATSAPP_QR_INTERVALO", "5")) # Segundos entre prints (o QR muda a cada ~20s)
+
+# Gravado no perfil quando o painel aparece; "auto" só vai headless com ele
+MARCADOR_LOGIN = os.path.join(WHATSAPP_PERFIL_DIR, ".fluxo-login-ok")
+
+# Sem isso o WhatsApp Web recusa o Chrome headless ("HeadlessChrome" no user agent)
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36"
+)
+
+PAINEL_SELECTOR = "#pane-side"
+QR_SELECTOR = "canvas[aria-label], div[data-ref]"
+
+
+def registrar_saude(estado, **extra):
+    """Grava o estado da sessão no arquivo de saúde (escrita atômica)."""
+    dados = {"estado": estado, "atualizado_em": time.time(), "pid": os.getpid(), **extra}
+    temporario = f"{WHATSAPP_SAUDE_ARQUIVO}.tmp"
+    with open(temporario, "w", encoding="utf-8") as f:
+        json.dump(dados, f, ensure_ascii=False)
+    os.replace(temporario, WHATSAPP_SAUDE_ARQUIVO)
+
+
+def perfil_tem_login():
+    # A pasta Default existe desde a primeira execução, mesmo sem ninguém ter lido o QR Code
+    return os.path.isfile(MARCADOR_LOGIN)
+
+
+def marcar_login(feito):
+    if feito:
+        with open(MARCADOR_LOGIN, "w", encoding="utf-8") as f:
+            f.write(str(time.time()))
+    elif os.path.exists(MARCADOR_LOGIN):
+        os.remove(MARCADOR_LOGIN)
+
+
+def salvar_qr(driver):
+    """Print da página com o QR Code atual (escrita atômica, para quem estiver lendo o arquivo)."""
+    temporario = f"{WHATSAPP_QR_ARQUIVO}.tmp"
+    with open(temporario, "wb") as f:
+        f.write(driver.get_screenshot_as_png())
+    os.replace(temporario, WHATSAPP_QR_ARQUIVO)
+
+
+def criar_driver(headless=None):
+    if headless is None:
+        headless = WHATSAPP_HEADLESS == "1" or (WHATSAPP_HEADLESS == "auto" and perfil_tem_login())
+
+    opcoes = webdriver.ChromeOptions()
+    opcoes.add_argument(f"--user-data-dir={WHATSAPP_PERFIL_DIR}")
+    opcoes.add_argument("--window-size=1280,900")
+    if headless:
+        opcoes.add_argument("--headless=new")
+        opcoes.add_argument(f"--user-agent={USER_AGENT}")
+    return webdriver.Chrome(options=opcoes)
+
+
+def estado_da_pagina(driver):
+    """"pronto", "aguardando_qr" ou None (ainda carregando)."""
+    if driver.find_elements(By.CSS_SELECTOR, PAINEL_SELECTOR):
+        return "pronto"
+    if driver.find_elements(By.CSS_SELECTOR, QR_SELECTOR):
+        return "aguardando_qr"
+    return None
+
+
+def esperar_pronto(driver):
+    """Espera o painel de conversas; se aparecer o QR Code, espera o login."""
+    registrar_saude("carregando")
+    estado = WebDriverWait(driver, WHATSAPP_CARREGAR_TIMEOUT, poll_frequency=0.25).until(estado_da_pagina)
+
+    if estado == "aguardando_qr":
+        marcar_login(False) # O login do perfil caiu (ou nunca existiu)
+        salvar_qr(driver)
+        registrar_saude("aguardando_qr", qr=os.path.abspath(WHATSAPP_QR_ARQUIVO))
+        print(f"Escaneie o QR Code (na janela do Chrome ou em {WHATSAPP_QR_ARQUIVO}).")
+        proximo_print = [time.monotonic() + WHATSAPP_QR_INTERVALO]
+
+        def logado(d):
+            if estado_da_pagina(d) == "pronto":
+                return True
+            if time.monotonic() >= proximo_print[0]:
+                salvar_qr(d) # O WhatsApp troca o QR Code periodicamente
+                proximo_print[0] = time.monotonic() + WHATSAPP_QR_INTERVALO
+            return False
+
+        WebDriverWait(driver, WHATSAPP_LOGIN_TIMEOUT, poll_frequency=0.5).until(logado)
+
+    marcar_login(True)
+    registrar_saude("pronto")
+
+
+def iniciar_sessao(headless=None):
+    """Abre o Chrome com o perfil persistente e devolve o driver já logado."""
+    inicio = time.perf_counter()
+    driver = criar_driver(headless)
+    try:
+        driver.get(WHATSAPP_URL)
+        esperar_pronto(driver)
+    except Exception as e:
+        registrar_saude("erro", erro=str(e))
+        driver.quit()
+        raise
+    print(f"WhatsApp pronto em {time.perf_counter() - inicio:.1f}s.")
+    return driver
+
+
+def verificar_sessao(driver, **extra):
+    """Atualiza o arquivo de saúde com o estado atual da página (para o loop principal)."""
+    try:
+        estado = estado_da_pagina(driver) or "carregando"
+    except Exception as e:
+        estado, extra = "erro", {**extra, "erro": str(e)}
+    if estado == "aguardando_qr":
+        marcar_login(False) # Próximo início abre o Chrome visível para ler o QR Code
+    registrar_saude("pronto" if estado == "pronto" else f"desconectado:{estado}", **extra)
+    return estado == "pronto"
@@ -0,0 +1,235 @@
+"""
+Simulador de carga do robô de agendamento
+
+Milhares de clientes sintéticos seguem os roteiros do simulador_conversas.py
+ao mesmo tempo, passando pelo mesmo caminho do robô em produção: pool de
+workers (transportes.Despachante) -> MaquinaConversa -> envio. O envio e a
+API (catálogo, horários, agendamento) são stubs locais com latência
+configurável. Cada cliente manda a próxima mensagem assim que recebe a
+resposta da anterior (carga em laço fechado, sem tempo de leitura).
+
+    python simulador_carga.py --clientes 5000 --workers 16 --latencia-api-ms 40 --latencia-envio-ms 15
+
+Relata mensagens/s, percentis de latência por etapa (do envio da mensagem do
+cliente até o fim do processamento) e memória por sessão.
+"""
+
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+import time
+import tracemalloc
+
+from fluxo_conversa import MaquinaConversa
+from simulador_conversas import ROTEIROS, ApiSimulada, catalogo_exemplo, preencher
+from transportes import Despachante
+
+
+def percentil(valores_ordenados, pct):
+    """Percentil por posto mais próximo (lista já ordenada)"""
+    if not valores_ordenados:
+        return None
+    return valores_ordenados[max(1, math.ceil(pct / 100.0 * len(valores_ordenados))) - 1]
+
+
+class ApiComLatencia:
+    """Stub da API do Fluxo: cada chamada espera `latencia` segundos antes de responder."""
+
+    def __init__(self, api, catalogo, latencia, catalogo_ttl):
+        self.api = api
+        self.catalogo = catalogo
+        self.latencia = latencia
+        self.catalogo_ttl = catalogo_ttl
+        self.catalogo_expira_em = 0
+        self.chamadas = 0
+        self._lock = threading.Lock()
+
+    def _esperar(self):
+        with self._lock:
+            self.chamadas += 1
+        if self.latencia:
+            time.sleep(self.latencia)
+
+    def obter_catalogo(self):
+        # Como no chatbot.py: serviços + profissionais (2 GETs) só quando o cache expira
+        with self._lock:
+            expirado = time.monotonic() >= self.catalogo_expira_em
+            if expirado:
+                self.catalogo_expira_em = time.monotonic() + self.catalogo_ttl
+        if expirado:
+            self._esperar()
+            self._esperar()
+        return self.catalogo
+
+    def buscar_horarios(self, **parametros):
+        self._esperar()
+        return self.api.buscar_horarios(**parametros)
+
+    def criar_agendamento(self, **parametros):
+        self._esperar()
+        return self.api.criar_agendamento(**parametros)
+
+    def acoes(self):
+        return {"buscar_horarios": self.buscar_horarios, "criar_agendamento": self.criar_agendamento}
+
+
+def simular(clientes=2000, workers=8, latencia_api_ms=0.0, latencia_envio_ms=0.0, catalogo_ttl=60.0, semente=0):
+    rnd = random.Random(semente)
+    catalogo = catalogo_exemplo()
+    api = ApiComLatencia(ApiSimulada(catalogo), catalogo, latencia_api_ms / 1000.0, catalogo_ttl)
+    maquina = MaquinaConversa(api.obter_catalogo, api.acoes())
+    latencia_envio = latencia_envio_ms / 1000.0
+
+    roteiros = {
+        f"55119{n:08d}@c.us": preencher(rnd.choice(list(ROTEIROS.values())), rnd)
+        for n in range(clientes)
+    }
+    total_mensagens = sum(len(r) for r in roteiros.values())
+    por_etapa = {} # etapa antes da mensagem -> [latências em ms]
+    respostas = [0]
+    erros = [0]
+    lock = threading.Lock()
+    terminou = threading.Event()
+    restantes = [total_mensagens]
+
+    def enviar(texto):
+        if latencia_envio:
+            time.sleep(latencia_envio)
+        with lock:
+            respostas[0] += 1
+
+    def processar(cliente_id, texto, responder):
+        enviado_em, etapa = responder
+        ok = False
+        try:
+            maquina.processar(cliente_id, texto, enviar)
+            ok = True
+        finally:
+            # Mesmo com exceção (o Despachante só a imprime) a mensagem conta como
+            # processada; senão terminou.wait() nunca retorna
+            latencia = (time.perf_counter() - enviado_em) * 1000
+            with lock:
+                if ok:
+                    por_etapa.setdefault(etapa, []).append(latencia)
+                else:
+                    erros[0] += 1
+                restantes[0] -= 1
+                if restantes[0] == 0:
+                    terminou.set()
+            proxima(cliente_id)
+
+    def proxima(cliente_id):
+        roteiro = roteiros[cliente_id]
+        if not roteiro:
+            return
+        sessao = maquina.sessoes.get(cliente_id)
+        etapa = sessao.etapa if sessao else "inicio"
+        # O terceiro argumento do Despachante carrega (instante do envio, etapa) para a medição
+        despachante.entregar(cliente_id, roteiro.pop(0), (time.perf_counter(), etapa))
+
+    despachante = Despachante(processar, workers)
+    inicio = time.perf_counter()
+    for cliente_id in list(roteiros):
+        proxima(cliente_id)
+    terminou.wait()
+    duracao = time.perf_counter() - inicio
+    despachante.parar()
+
+    etapas = {}
+    todas = []
+    for etapa, latencias in sorted(por_etapa.items()):
+        latencias.sort()
+        todas.extend(latencias)
+        etapas[etapa] = {
+            "mensagens": len(latencias),
+            "p50_ms": round(percentil(latencias, 50), 2),
+            "p95_ms": round(percentil(latencias, 95), 2),
+            "p99_ms": round(percentil(latencias, 99), 2)
+        }
+    todas.sort()
+
+    return {
+        "clientes": clientes,
+        "workers": workers,
+        "latencia_api_ms": latencia_api_ms,
+        "latencia_envio_ms": latencia_envio_ms,
+        "mensagens": total_mensagens,
+        "respostas": respostas[0],
+        "erros": erros[0],
+        "chamadas_api": api.chamadas,
+        "agendamentos": len(api.api.reservas),
+        "conflitos": api.api.conflitos,
+        "duracao_s": round(duracao, 3),
+        "mensagens_por_s": round(total_mensagens / duracao, 1) if duracao else None,
+        "p50_ms": round(percentil(todas, 50), 2) if todas else None,
+        "p95_ms": round(percentil(todas, 95), 2) if todas else None,
+        "p99_ms": round(percentil(todas, 99), 2) if todas else None,
+        "por_etapa": etapas
+    }
+
+
+def medir_memoria(sessoes, semente=0):
+    """Bytes por sessão com as conversas espalhadas por todas as etapas do fluxo."""
+    rnd = random.Random(semente)
+    catalogo = catalogo_exemplo()
+    api = ApiSimulada(catalogo)
+    maquina = MaquinaConversa(lambda: catalogo, api.acoes())
+    roteiros = [preencher(r, rnd) for r in ROTEIROS.values()]
+
+    tracemalloc.start()
+    antes = tracemalloc.take_snapshot()
+    for n in range(sessoes):
+        roteiro = rnd.choice(roteiros)
+        # Para no meio do roteiro: a sessão fica aberta numa etapa qualquer
+        for texto in roteiro[:rnd.randint(1, len(roteiro) - 1)]:
+            maquina.processar(f"55119{n:08d}@c.us", texto, lambda t: None)
+    depois = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    total = sum(s.size_diff for s in depois.compare_to(antes, "filename"))
+    abertas = len(maquina.sessoes)
+    return {
+        "sessoes_abertas": abertas,
+        "memoria_mb": round(total / 2 ** 20, 2),
+        "bytes_por_sessao": round(total / max(1, abertas))
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clientes", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--latencia-api-ms", type=float, default=0.0, help="latência de cada chamada à API simulada")
+    parser.add_argument("--latencia-envio-ms", type=float, default=0.0, help="latência de cada mensagem enviada")
+    parser.add_argument("--catalogo-ttl", type=float, default=60.0)
+    parser.add_argument("--sessoes-memoria", type=int, default=20000, help="sessões para medir memória (0 pula)")
+    parser.add_argument("--semente", type=int, default=0)
+    parser.add_argument("--saida", help="arquivo JSON de saída (padrão: stdout)")
+    args = parser.parse_args(argv)
+
+    relatorio = {
+        "carga": simular(args.clientes, args.workers, args.latencia_api_ms, args.latencia_envio_ms,
+                         args.catalogo_ttl, args.semente)
+    }
+    carga = relatorio["carga"]
+    print(f"{carga['mensagens_por_s']} msgs/s, p50={carga['p50_ms']}ms p95={carga['p95_ms']}ms", file=sys.stderr)
+    if carga["erros"]:
+        print(f"{carga['erros']} mensagens falharam", file=sys.stderr)
+
+    if args.sessoes_memoria:
+        relatorio["memoria"] = medir_memoria(args.sessoes_memoria, args.semente)
+
+    texto = json.dumps(relatorio, indent=2, ensure_ascii=False)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+    return relatorio
+
+
+if __name__ == "__main__":
+    main()
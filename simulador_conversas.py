@@ -0,0 +1,174 @@
+"""
+Simulador de conversas do robô
+
+Reproduz roteiros de conversa (listas de mensagens do cliente) na
+MaquinaConversa com um catálogo e uma API simulados, sem WhatsApp nem rede.
+Mede mensagens por segundo e a memória das sessões ociosas:
+
+    python simulador_conversas.py --clientes 2000 --ociosas 100000
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+from fluxo_conversa import MAX_HORARIOS, MaquinaConversa, montar_catalogo
+
+# Cada roteiro termina a conversa (agendada ou cancelada); "oi" abre o menu.
+# {data} vira um DD/MM dos próximos 30 dias e {horario} um dos horários oferecidos
+ROTEIROS = {
+    "agenda_direto": ["oi", "1", "0", "{data}", "{horario}", "Maria Souza", "1"],
+    "escolhe_profissional": ["olá", "2", "1", "{data}", "{horario}", "João", "sim"],
+    "erra_e_corrige": ["bom dia", "99", "1", "x", "0", "32/13", "{data}", "abc", "{horario}", "Ana", "talvez", "1"],
+    "troca_data": ["oi", "3", "0", "amanhã", "0", "{data}", "{horario}", "Carla", "1"],
+    "desiste": ["oi", "1", "0", "{data}", "{horario}", "Pedro", "2"],
+    "cancela_no_meio": ["oi", "2", "cancelar"]
+}
+
+
+def catalogo_exemplo(servicos=8, profissionais=6, semente=7):
+    rnd = random.Random(semente)
+    lista_servicos = [{"id": f"svc-{i}", "name": f"Serviço {i}", "price": 50.0, "duration_minutes": 30} for i in range(servicos)]
+    lista_profissionais = [
+        {"id": f"pro-{i}", "name": f"Profissional {i}", "services": rnd.sample(lista_servicos, k=min(servicos, 4))}
+        for i in range(profissionais)
+    ]
+    # Garante que todo serviço tem ao menos um profissional
+    for i, s in enumerate(lista_servicos):
+        p = lista_profissionais[i % profissionais]
+        if s not in p["services"]:
+            p["services"].append(s)
+    return montar_catalogo(lista_servicos, lista_profissionais)
+
+
+class ApiSimulada:
+    """Horários de 30 em 30 minutos (9h-18h) por profissional; reservas conflitantes devolvem 409."""
+
+    def __init__(self, catalogo, abertura=9, fechamento=18, passo=30):
+        self.catalogo = catalogo
+        self.abertura = abertura
+        self.fechamento = fechamento
+        self.passo = passo
+        self.reservas = set() # (profissional_id, start_time)
+        self.conflitos = 0
+        self._lock = threading.Lock()
+
+    def buscar_horarios(self, servico_id, data, profissional_id=None):
+        dia = date.fromisoformat(data)
+        candidatos = [
+            p for p in self.catalogo["profissionais_por_servico"].get(servico_id, [])
+            if profissional_id in (None, p["id"])
+        ]
+        slots = []
+        agora = datetime.now()
+        inicio = datetime(dia.year, dia.month, dia.day, self.abertura)
+        while inicio.hour < self.fechamento:
+            start_time = inicio.isoformat()
+            if inicio <= agora:
+                inicio += timedelta(minutes=self.passo)
+                continue
+            with self._lock:
+                livres = [{"id": p["id"], "name": p["name"]} for p in candidatos if (p["id"], start_time) not in self.reservas]
+            if livres:
+                slots.append({"start_time": start_time, "available_professionals": livres})
+            inicio += timedelta(minutes=self.passo)
+        return slots
+
+    def criar_agendamento(self, agendamento):
+        chave = (agendamento["professional_id"], agendamento["start_time"])
+        with self._lock:
+            if chave in self.reservas:
+                self.conflitos += 1
+                return 409, {"error": "Horário já ocupado"}
+            self.reservas.add(chave)
+        return 201, {"id": f"apt-{len(self.reservas)}", **agendamento}
+
+    def acoes(self):
+        return {"buscar_horarios": self.buscar_horarios, "criar_agendamento": self.criar_agendamento}
+
+
+def criar_maquina(catalogo=None, api=None):
+    catalogo = catalogo or catalogo_exemplo()
+    api = api or ApiSimulada(catalogo)
+    return MaquinaConversa(lambda: catalogo, api.acoes()), api
+
+
+def preencher(roteiro, rnd):
+    hoje = date.today()
+    valores = {
+        "data": (hoje + timedelta(days=rnd.randint(1, 30))).strftime("%d/%m"),
+        "horario": str(rnd.randint(1, MAX_HORARIOS))
+    }
+    return [mensagem.format(**valores) for mensagem in roteiro]
+
+
+def reproduzir(maquina, clientes, roteiros=ROTEIROS, semente=0):
+    """
+    Cada cliente recebe um roteiro sorteado; as mensagens de todos os clientes
+    são intercaladas (uma de cada por rodada), como num atendimento real.
+    """
+    rnd = random.Random(semente)
+    filas = {f"55119{n:08d}@c.us": preencher(rnd.choice(list(roteiros.values())), rnd) for n in range(clientes)}
+    respostas = [0]
+
+    def enviar(texto):
+        respostas[0] += 1
+
+    mensagens = 0
+    inicio = time.perf_counter()
+    while filas:
+        for cliente_id in list(filas):
+            maquina.processar(cliente_id, filas[cliente_id].pop(0), enviar)
+            mensagens += 1
+            if not filas[cliente_id]:
+                del filas[cliente_id]
+    duracao = time.perf_counter() - inicio
+
+    return {
+        "clientes": clientes,
+        "mensagens": mensagens,
+        "respostas": respostas[0],
+        "duracao_s": round(duracao, 3),
+        "mensagens_por_s": round(mensagens / duracao, 1) if duracao else None,
+        "sessoes_abertas": len(maquina.sessoes)
+    }
+
+
+def medir_ociosas(quantidade):
+    """Memória de `quantidade` sessões paradas no menu de serviços (o caso mais comum)."""
+    maquina, _ = criar_maquina()
+    tracemalloc.start()
+    antes = tracemalloc.take_snapshot()
+    for n in range(quantidade):
+        maquina.processar(f"55119{n:08d}@c.us", "oi", lambda texto: None)
+    depois = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(s.size_diff for s in depois.compare_to(antes, "filename"))
+    return {"sessoes": quantidade, "memoria_mb": round(total / 2 ** 20, 2), "bytes_por_sessao": round(total / max(1, quantidade))}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clientes", type=int, default=2000)
+    parser.add_argument("--ociosas", type=int, default=100_000, help="sessões ociosas para medir memória (0 pula)")
+    parser.add_argument("--semente", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    maquina, api = criar_maquina()
+    relatorio = {"replay": reproduzir(maquina, args.clientes, semente=args.semente)}
+    relatorio["replay"]["agendamentos"] = len(api.reservas)
+    relatorio["replay"]["conflitos"] = api.conflitos # Horário tomado entre a oferta e a confirmação
+    if args.ociosas:
+        relatorio["ociosas"] = medir_ociosas(args.ociosas)
+
+    print(json.dumps(relatorio, indent=2, ensure_ascii=False))
+    return relatorio
+
+
+if __name__ == "__main__":
+    sys.exit(main() and 0)
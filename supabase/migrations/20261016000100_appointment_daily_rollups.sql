@@ -0,0 +1,124 @@
+-- Rollup diário de agendamentos por negócio (lido pelo /api/dashboard/stats)
+--
+-- Mantido por trigger em appointments: todo insert/update/delete (vindo da API
+-- ou direto do frontend) aplica -1 no dia/serviço antigo e +1 no novo.
+-- O "dia" é a data local no timezone do negócio; se businesses.timezone mudar,
+-- rode o backfill:  flask --app app rebuild-rollups --business-id <id>
+--
+-- revenue usa o preço do serviço no momento da escrita. O dashboard calcula o
+-- faturamento a partir de service_counts x preço atual, igual ao cálculo antigo.
+
+create table if not exists public.appointment_daily_rollups (
+    business_id uuid not null references public.businesses(id) on delete cascade,
+    day date not null,
+    appointment_count integer not null default 0,
+    revenue numeric(12, 2) not null default 0,
+    service_counts jsonb not null default '{}'::jsonb,
+    updated_at timestamptz not null default now(),
+    primary key (business_id, day)
+);
+
+create or replace function public.apply_appointment_rollup(
+    p_business_id uuid,
+    p_start_time timestamptz,
+    p_service_id uuid,
+    p_delta integer
+) returns void
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    v_tz text;
+    v_day date;
+    v_price numeric;
+    v_key text := coalesce(p_service_id::text, 'null');
+begin
+    select coalesce(b.timezone, 'America/Sao_Paulo') into v_tz
+      from businesses b
+     where b.id = p_business_id;
+
+    v_day := (p_start_time at time zone coalesce(v_tz, 'America/Sao_Paulo'))::date;
+
+    select coalesce(s.price, 0) into v_price
+      from services s
+     where s.id = p_service_id;
+
+    insert into appointment_daily_rollups as r (business_id, day, appointment_count, revenue, service_counts)
+    values (p_business_id, v_day, p_delta, p_delta * coalesce(v_price, 0), jsonb_build_object(v_key, p_delta))
+    on conflict (business_id, day) do update set
+        appointment_count = r.appointment_count + excluded.appointment_count,
+        revenue = r.revenue + excluded.revenue,
+        service_counts = case
+            when coalesce((r.service_counts ->> v_key)::integer, 0) + p_delta = 0
+                then r.service_counts - v_key
+            else r.service_counts || jsonb_build_object(
+                v_key, coalesce((r.service_counts ->> v_key)::integer, 0) + p_delta)
+        end,
+        updated_at = now();
+end
+$$;
+
+create or replace function public.appointments_rollup_trigger()
+returns trigger
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    if tg_op in ('UPDATE', 'DELETE') then
+        perform apply_appointment_rollup(old.business_id, old.start_time, old.service_id, -1);
+    end if;
+
+    if tg_op in ('INSERT', 'UPDATE') then
+        perform apply_appointment_rollup(new.business_id, new.start_time, new.service_id, 1);
+    end if;
+
+    return null;
+end
+$$;
+
+drop trigger if exists appointments_rollup on public.appointments;
+
+create trigger appointments_rollup
+    after insert or update of business_id, start_time, service_id or delete
+    on public.appointments
+    for each row execute function public.appointments_rollup_trigger();
+
+-- Backfill / reconstrução (todos os negócios quando p_business_id é null)
+create or replace function public.rebuild_appointment_rollups(p_business_id uuid default null)
+returns integer
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    v_rows integer;
+begin
+    -- Bloqueia escritas em appointments enquanto recalcula (o trigger ficaria fora do snapshot)
+    lock table appointments in share mode;
+
+    delete from appointment_daily_rollups
+     where p_business_id is null or business_id = p_business_id;
+
+    insert into appointment_daily_rollups (business_id, day, appointment_count, revenue, service_counts)
+    select business_id, day, sum(n), sum(revenue), jsonb_object_agg(service_key, n)
+      from (
+        select a.business_id,
+               (a.start_time at time zone coalesce(b.timezone, 'America/Sao_Paulo'))::date as day,
+               coalesce(a.service_id::text, 'null') as service_key,
+               count(*) as n,
+               sum(coalesce(s.price, 0)) as revenue
+          from appointments a
+          join businesses b on b.id = a.business_id
+          left join services s on s.id = a.service_id
+         where p_business_id is null or a.business_id = p_business_id
+         group by 1, 2, 3
+      ) per_service
+     group by business_id, day;
+
+    get diagnostics v_rows = row_count;
+
+    return v_rows;
+end
+$$;
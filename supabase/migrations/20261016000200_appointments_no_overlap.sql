@@ -0,0 +1,23 @@
+-- Impede dois agendamentos sobrepostos para o mesmo profissional
+--
+-- A checagem acontece no próprio INSERT/UPDATE (uma ida ao banco, atômica
+-- mesmo com requisições concorrentes). A violação retorna SQLSTATE 23P01,
+-- que a API traduz em HTTP 409.
+--
+-- Antes de aplicar, confira se já existem sobreposições (a constraint não é criada com elas):
+--
+--   select a.id, b.id
+--     from appointments a
+--     join appointments b
+--       on a.professional_id = b.professional_id
+--      and a.id < b.id
+--      and tstzrange(a.start_time, a.end_time, '[)') && tstzrange(b.start_time, b.end_time, '[)');
+
+create extension if not exists btree_gist;
+
+alter table public.appointments
+    add constraint appointments_no_overlap
+    exclude using gist (
+        professional_id with =,
+        tstzrange(start_time, end_time, '[)') with &&
+    );
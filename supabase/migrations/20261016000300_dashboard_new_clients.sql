@@ -0,0 +1,27 @@
+-- Novos clientes do dashboard em uma única chamada
+--
+-- Conta os telefones distintos com agendamento a partir de p_since que não
+-- tinham nenhum agendamento antes disso. Substitui a leitura dos telefones do
+-- mês + consultas em lotes (uma ida ao banco por 100 telefones).
+
+create index if not exists appointments_business_phone_start_idx
+    on public.appointments (business_id, customer_phone, start_time);
+
+create or replace function public.dashboard_new_clients(p_business_id uuid, p_since timestamptz)
+returns integer
+language sql
+stable
+as $$
+    select count(distinct a.customer_phone)::integer
+      from public.appointments a
+     where a.business_id = p_business_id
+       and a.start_time >= p_since
+       and coalesce(a.customer_phone, '') <> ''
+       and not exists (
+           select 1
+             from public.appointments b
+            where b.business_id = p_business_id
+              and b.customer_phone = a.customer_phone
+              and b.start_time < p_since
+       );
+$$;
@@ -0,0 +1,35 @@
+-- Fecha o rollup diário para os clientes do PostgREST
+--
+-- A API lê e escreve com a service key (ignora RLS). Sem RLS, qualquer um com
+-- a anon key lia e alterava os números de todos os negócios; as funções
+-- security definer também ficavam expostas em /rest/v1/rpc.
+-- O trigger continua funcionando: appointments_rollup_trigger roda como dono
+-- da função, que mantém o execute em apply_appointment_rollup.
+
+alter table public.appointment_daily_rollups enable row level security;
+
+drop policy if exists "appointment_daily_rollups_select_own_business" on public.appointment_daily_rollups;
+
+create policy "appointment_daily_rollups_select_own_business"
+    on public.appointment_daily_rollups
+    for select
+    to authenticated
+    using (
+        business_id in (
+            select p.business_id
+              from public.profiles p
+             where p.id = auth.uid()
+        )
+    );
+
+revoke insert, update, delete, truncate on public.appointment_daily_rollups from anon, authenticated;
+
+revoke execute on function public.apply_appointment_rollup(uuid, timestamptz, uuid, integer) from public, anon, authenticated;
+
+revoke execute on function public.rebuild_appointment_rollups(uuid) from public, anon, authenticated;
+
+revoke execute on function public.appointments_rollup_trigger() from public, anon, authenticated;
+
+grant execute on function public.apply_appointment_rollup(uuid, timestamptz, uuid, integer) to service_role;
+
+grant execute on function public.rebuild_appointment_rollups(uuid) to service_role;
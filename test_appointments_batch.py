@@ -0,0 +1,129 @@
+"""
+POST /api/appointments/batch: relatório por item
+
+Cada item recebe o próprio status: conflitos (no lote, contra o banco ou
+gravados por outra requisição no meio do caminho) dão 409 só ao item em
+conflito, horários fora do expediente dão 400 e ids inválidos ou de outro
+negócio não derrubam o lote.
+"""
+
+import uuid
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import benchmark
+
+
+@pytest.fixture
+def api():
+    fake, ctx = benchmark.build_fake(professionals=2, appointments=0, services=2)
+    app_module = benchmark.load_app(fake)
+    return app_module.app.test_client(), fake, ctx
+
+
+@pytest.fixture
+def booking(api):
+    _, _, ctx = api
+    pro = ctx["professionals"][0]
+    svc = ctx["offers"][pro["id"]][0]
+
+    day = date.today() + timedelta(days=80)
+    while day.weekday() == 6:
+        day += timedelta(days=1)
+
+    def build(hour, **extra):
+        return {
+            "professional_id": pro["id"],
+            "service_id": svc["id"],
+            "customer_name": "Cliente",
+            "customer_phone": "5511900000000",
+            "start_time": datetime(day.year, day.month, day.day, hour).isoformat(),
+            **extra
+        }
+
+    build.day = day
+    return build
+
+
+def post_batch(client, items):
+    response = client.post("/api/appointments/batch", headers=benchmark.auth_headers(), json={"appointments": items})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def statuses(report):
+    return [r["status"] for r in report["results"]]
+
+
+def test_conflicts_only_fail_the_conflicting_items(api, booking):
+    client, _, _ = api
+    client.post("/api/appointments", headers=benchmark.auth_headers(), json=booking(10))
+
+    report = post_batch(client, [booking(10), booking(12), booking(12), booking(14)])
+
+    assert statuses(report) == [409, 201, 409, 201]
+    assert (report["created"], report["failed"]) == (2, 2)
+
+
+def test_update_frees_its_old_slot_for_a_create(api, booking):
+    client, _, _ = api
+    existing = client.post("/api/appointments", headers=benchmark.auth_headers(), json=booking(10)).get_json()
+
+    report = post_batch(client, [booking(10), booking(15, id=existing["id"])])
+
+    assert statuses(report) == [201, 200]
+
+
+def test_outside_business_hours_is_rejected_per_item(api, booking):
+    client, _, _ = api
+    sunday = booking.day + timedelta(days=6 - booking.day.weekday())
+
+    report = post_batch(client, [
+        booking(6),
+        booking(10),
+        {**booking(10), "start_time": datetime(sunday.year, sunday.month, sunday.day, 10).isoformat()}
+    ])
+
+    assert statuses(report) == [400, 201, 400]
+
+
+def test_invalid_and_unknown_ids_do_not_fail_the_batch(api, booking):
+    client, _, _ = api
+
+    report = post_batch(client, [
+        booking(9, id="apt-0000000"),
+        booking(11, id=str(uuid.uuid4())),
+        booking(13),
+        {"customer_name": "Sem campos"}
+    ])
+
+    assert statuses(report) == [400, 404, 201, 400]
+
+
+def test_conflict_written_meanwhile_falls_back_to_row_inserts(api, booking, monkeypatch):
+    client, fake, ctx = api
+    concurrent = {**booking(12), "business_id": benchmark.BUSINESS_ID}
+    concurrent["end_time"] = datetime.fromisoformat(concurrent["start_time"]).replace(minute=59).isoformat()
+    pending = [concurrent]
+    table = fake.table
+
+    def racing_table(name):
+        # Outra requisição grava no horário depois da checagem do lote e antes do insert
+        query = table(name)
+        insert = query.insert
+
+        def racing_insert(json, **kwargs):
+            if pending:
+                fake.seed("appointments", [pending.pop()])
+            return insert(json, **kwargs)
+
+        query.insert = racing_insert
+        return query
+
+    monkeypatch.setattr(fake, "table", racing_table)
+
+    report = post_batch(client, [booking(10), booking(12), booking(14)])
+
+    assert statuses(report) == [201, 409, 201]
+    assert report["results"][1]["error"] == "Profissional já possui agendamento neste horário"
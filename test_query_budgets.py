@@ -0,0 +1,25 @@
+"""
+Orçamento de round-trips ao Supabase por rota (@query_budget no app.py)
+
+A mesma verificação do `python benchmark.py --check-budgets`, numa base pequena:
+falha quando alguma rota passa do orçamento, não tem @query_budget ou não tem
+chamada de referência em benchmark.budget_requests().
+"""
+
+import pytest
+
+import benchmark
+
+
+@pytest.fixture(scope="module")
+def seeded():
+    fake, ctx = benchmark.build_fake(professionals=5, appointments=2000, services=5)
+    return benchmark.load_app(fake), fake, ctx
+
+
+def test_routes_stay_within_query_budget(seeded):
+    app_module, fake, ctx = seeded
+    report, failures = benchmark.check_query_budgets(app_module, fake, ctx)
+
+    assert report
+    assert not failures, "\n".join(failures)
@@ -1,40 +1,37 @@
-import time
-from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
-from selenium.common.exceptions import NoSuchElementException
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import NoSuchElementException, TimeoutException
+from sessao_whatsapp import iniciar_sessao
 
-# Inicia o Chrome
-driver = webdriver.Chrome()
-driver.get('https://web.whatsapp.com')
+CAIXA_DE_TEXTO_SELECTOR = "div[contenteditable='true'][data-tab='10']"
 
 print("--- Teste de Envio do Robô Fluxo (v2) ---")
-print("\n[AÇÃO NECESSÁRIA] Por favor, escaneie o QR Code se for solicitado.")
-print("Aguardando login completo... (Você tem até 60 segundos)")
-time.sleep(60)
+print("\n[AÇÃO NECESSÁRIA] Escaneie o QR Code se for solicitado (só na primeira vez neste perfil).")
+
+# Abre o Chrome com o perfil persistente e espera o WhatsApp ficar pronto (sem esperas fixas)
+driver = iniciar_sessao(headless=False)
 
 print("\n[AÇÃO NECESSÁRIA] Agora, por favor, use o seu mouse para ABRIR A CONVERSA para a qual deseja enviar a mensagem de teste.")
-print("O robô tentará enviar a mensagem em 20 segundos...")
-time.sleep(20)
+print("O robô envia assim que a conversa estiver aberta (até 120 segundos)...")
 
 try:
     texto_teste = "Olá! Isto é um teste de envio automático do Robô Fluxo v2.0!"
-    
-    # --- AQUI ESTÁ A CORREÇÃO ---
-    # Usando um seletor CSS mais robusto e moderno para encontrar a caixa de texto
-    caixa_de_texto_selector = "div[contenteditable='true'][data-tab='10']"
-    caixa_de_texto = driver.find_element(By.CSS_SELECTOR, caixa_de_texto_selector)
-    # --- FIM DA CORREÇÃO ---
-    
+
+    # Espera a caixa de texto da conversa aparecer
+    caixa_de_texto = WebDriverWait(driver, 120, poll_frequency=0.25).until(
+        lambda d: d.find_element(By.CSS_SELECTOR, CAIXA_DE_TEXTO_SELECTOR)
+    )
+
     caixa_de_texto.send_keys(texto_teste)
     caixa_de_texto.send_keys(Keys.ENTER)
-    
+
     print("\n[SUCESSO] Mensagem de teste enviada!")
 
-except NoSuchElementException:
-    print(f"\n[FALHA] Não foi possível encontrar a caixa de texto usando o novo seletor. O WhatsApp pode ter atualizado seu código novamente.")
+except (NoSuchElementException, TimeoutException):
+    print(f"\n[FALHA] Nenhuma conversa aberta ou a caixa de texto não foi encontrada com o seletor atual. O WhatsApp pode ter atualizado seu código novamente.")
 except Exception as e:
     print(f"\n[FALHA] Ocorreu um erro inesperado: {e}")
 
 input("\nTeste concluído. Pressione Enter para fechar o navegador...")
-driver.quit()
\ No newline at end of file
+driver.quit()
@@ -0,0 +1,235 @@
+"""
+Transportes do robô: por onde as mensagens chegam e por onde saem as respostas
+
+O processar_mensagem do chatbot.py não conhece o transporte: recebe o
+cliente, o texto e uma função `enviar(texto)` que responde àquele cliente.
+
+    Despachante       -- pool de workers; cada cliente cai sempre no mesmo
+                         worker, então as mensagens dele são processadas em
+                         ordem enquanto clientes diferentes andam em paralelo
+    TransporteWebhook -- recebe POST /webhook {"id", "from", "text"} e
+                         responde com POST {"to", "text"} em WEBHOOK_RESPOSTA_URL
+    ProvedorLocal     -- stand-in do provedor de mensagens para testar o
+                         webhook na máquina local
+
+O transporte Selenium (WhatsApp Web) fica no chatbot.py.
+"""
+
+import hmac
+import ipaddress
+import json
+import os
+import queue
+import threading
+import zlib
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+CHATBOT_WORKERS = int(os.getenv("CHATBOT_WORKERS", "8"))
+
+# Fora do loopback (ex.: 0.0.0.0) o WEBHOOK_TOKEN é obrigatório
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+
+WEBHOOK_PORTA = int(os.getenv("WEBHOOK_PORTA", "8081"))
+
+# Exigido no "Authorization: Bearer" das mensagens recebidas e enviado nas respostas
+WEBHOOK_TOKEN = os.getenv("WEBHOOK_TOKEN", "").strip()
+
+WEBHOOK_RESPOSTA_URL = os.getenv("WEBHOOK_RESPOSTA_URL", "").strip()
+
+WEBHOOK_TIMEOUT = (3.05, 10) # Segundos: (conexão, leitura) ao entregar uma resposta
+
+
+def endereco_local(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class Despachante:
+    """Pool de workers com uma fila por worker; o cliente é fixado no worker pelo hash do id."""
+
+    def __init__(self, processar, workers=CHATBOT_WORKERS):
+        self.processar = processar
+        self.filas = [queue.Queue() for _ in range(max(1, workers))]
+        self.threads = [
+            threading.Thread(target=self._trabalhar, args=(fila,), name=f"chatbot-worker-{i}", daemon=True)
+            for i, fila in enumerate(self.filas)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def entregar(self, cliente_id, texto, enviar):
+        # crc32 e não hash(): o mesmo cliente cai no mesmo worker em qualquer processo
+        fila = self.filas[zlib.crc32(cliente_id.encode("utf-8")) % len(self.filas)]
+        fila.put((cliente_id, texto, enviar))
+
+    def _trabalhar(self, fila):
+        while True:
+            item = fila.get()
+            try:
+                if item is None:
+                    return
+                self.processar(*item)
+            except Exception as e:
+                print(f"Erro ao processar mensagem de {item[0]}: {e}")
+            finally:
+                fila.task_done()
+
+    def aguardar(self):
+        """Bloqueia até todas as mensagens entregues terem sido processadas."""
+        for fila in self.filas:
+            fila.join()
+
+    def parar(self):
+        for fila in self.filas:
+            fila.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+class TransporteWebhook:
+    """Servidor HTTP que recebe mensagens e as passa ao despachante; respostas saem por POST."""
+
+    def __init__(self, url_resposta=WEBHOOK_RESPOSTA_URL, host=WEBHOOK_HOST, porta=WEBHOOK_PORTA, token=WEBHOOK_TOKEN):
+        self.url_resposta = url_resposta
+        self.endereco = (host, porta)
+        self.token = token
+        self.sessao = requests.Session()
+        if token:
+            self.sessao.headers["Authorization"] = f"Bearer {token}"
+        self.servidor = None
+        self._vistos = deque(maxlen=10000) # Ids recentes: o provedor pode reentregar a mesma mensagem
+        self._vistos_set = set()
+        self._vistos_lock = threading.Lock()
+
+    def primeira_vez(self, mensagem_id):
+        if not mensagem_id:
+            return True
+        with self._vistos_lock:
+            if mensagem_id in self._vistos_set:
+                return False
+            if len(self._vistos) == self._vistos.maxlen:
+                self._vistos_set.discard(self._vistos[0])
+            self._vistos.append(mensagem_id)
+            self._vistos_set.add(mensagem_id)
+            return True
+
+    def enviar(self, cliente_id, texto):
+        try:
+            r = self.sessao.post(self.url_resposta, json={"to": cliente_id, "text": texto}, timeout=WEBHOOK_TIMEOUT)
+            return r.status_code < 300
+        except Exception as e:
+            print(f"Erro ao entregar resposta para {cliente_id}: {e}")
+            return False
+
+    def autorizado(self, cabecalho):
+        if not self.token:
+            return True
+        return hmac.compare_digest(cabecalho.encode("utf-8"), f"Bearer {self.token}".encode("utf-8"))
+
+    def iniciar(self, despachante):
+        # Sem token, qualquer um na rede criaria agendamentos em nome de qualquer telefone
+        if not self.token and not endereco_local(self.endereco[0]):
+            raise RuntimeError(f"Defina WEBHOOK_TOKEN para escutar em {self.endereco[0]} (ou use WEBHOOK_HOST=127.0.0.1).")
+
+        transporte = self
+
+        class Receptor(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path.rstrip("/") != "/webhook":
+                    return self._responder(404, {"error": "Rota não encontrada"})
+                if not transporte.autorizado(self.headers.get("Authorization", "")):
+                    return self._responder(401, {"error": "Não autorizado"})
+                try:
+                    dados = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                    cliente_id, texto = str(dados["from"]), str(dados["text"])
+                except (ValueError, KeyError, TypeError):
+                    return self._responder(400, {"error": "Envie JSON com from e text"})
+
+                if transporte.primeira_vez(dados.get("id")):
+                    despachante.entregar(cliente_id, texto, lambda t, c=cliente_id: transporte.enviar(c, t))
+                self._responder(202, {"status": "aceito"})
+
+            def do_GET(self):
+                if self.path.rstrip("/") == "/health":
+                    return self._responder(200, {"status": "ok"})
+                self._responder(404, {"error": "Rota não encontrada"})
+
+            def _responder(self, status, corpo):
+                dados = json.dumps(corpo).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(dados)))
+                self.end_headers()
+                self.wfile.write(dados)
+
+            def log_message(self, *args):
+                pass
+
+        self.servidor = ThreadingHTTPServer(self.endereco, Receptor)
+        self.servidor.daemon_threads = True
+        threading.Thread(target=self.servidor.serve_forever, name="webhook", daemon=True).start()
+        return self
+
+    @property
+    def porta(self):
+        return self.servidor.server_address[1] if self.servidor else self.endereco[1]
+
+    def parar(self):
+        if self.servidor:
+            self.servidor.shutdown()
+            self.servidor.server_close()
+
+
+class ProvedorLocal:
+    """Stand-in do provedor: manda mensagens ao webhook do robô e guarda as respostas recebidas."""
+
+    def __init__(self, url_webhook, host="127.0.0.1", porta=0, token=WEBHOOK_TOKEN):
+        self.url_webhook = url_webhook
+        self.token = token
+        self.respostas = {} # cliente -> [textos]
+        self._cond = threading.Condition()
+        self._contador = 0
+        provedor = self
+
+        class Receptor(BaseHTTPRequestHandler):
+            def do_POST(self):
+                dados = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)))
+                with provedor._cond:
+                    provedor.respostas.setdefault(dados["to"], []).append(dados["text"])
+                    provedor._cond.notify_all()
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.servidor = ThreadingHTTPServer((host, porta), Receptor)
+        self.servidor.daemon_threads = True
+        threading.Thread(target=self.servidor.serve_forever, name="provedor-local", daemon=True).start()
+        self.url_resposta = f"http://{host}:{self.servidor.server_address[1]}/respostas"
+
+    def mandar(self, cliente_id, texto):
+        self._contador += 1
+        headers = {"Authorization": f"Bearer {self.token}"} if self.token else {}
+        return requests.post(
+            self.url_webhook,
+            json={"id": f"local-{self._contador}", "from": cliente_id, "text": texto},
+            headers=headers,
+            timeout=WEBHOOK_TIMEOUT
+        ).status_code
+
+    def esperar_respostas(self, cliente_id, quantidade, timeout=10):
+        with self._cond:
+            self._cond.wait_for(lambda: len(self.respostas.get(cliente_id, [])) >= quantidade, timeout)
+            return list(self.respostas.get(cliente_id, []))
+
+    def parar(self):
+        self.servidor.shutdown()
+        self.servidor.server_close()